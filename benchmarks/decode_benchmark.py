@@ -0,0 +1,239 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures the throughput of reading, decoding and dispatching events.
+
+Runs on synthetic logs of every registered event, written by etw.synthetic
+for 32 and 64 bit pointers, so it needs neither Windows nor captured logs.
+Each stage is timed on its own, and the best of several runs is kept:
+
+  parse: reading the event headers of a log with etl.EtlFile.
+  decode: constructing the EventClass of each event, eagerly and lazily,
+      and eagerly with an intern table of the strings and SIDs.
+  dispatch: TraceEventSource.ProcessEtlEvent, to a handler of every event.
+  consume: opening and consuming a log with EtlFileEventSource, with and
+      without memory mapping.
+
+The results can be written as JSON, and compared against the JSON of an
+earlier run, in which case the exit code is 1 if any stage got slower by
+more than the threshold.
+
+Usage: decode_benchmark.py [--events=N] [--repeat=N] [--seed=N]
+                           [--output=results.json] [--baseline=old.json]
+                           [--threshold=0.1]
+"""
+import json
+import optparse
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from etw import EtlFileEventSource, EventConsumer, EventHandler
+from etw import etl
+from etw import synthetic
+from etw.descriptors import binary_buffer
+from etw.descriptors import event
+
+
+_clock = timeit.default_timer
+
+
+def _MakeConsumer():
+  """Returns an EventConsumer with a handler of every registered event."""
+  event_infos = set((guid, event_type) for guid, unused_version, event_type
+                    in synthetic.GetEventKeys())
+
+  class Consumer(EventConsumer):
+    def __init__(self):
+      self.count = 0
+
+    @EventHandler(*event_infos)
+    def OnEvent(self, event_data):
+      self.count += 1
+
+  return Consumer()
+
+
+def _ReadRecords(path):
+  log = etl.EtlFile(path)
+  records = list(log.IterEvents())
+  return log, records
+
+
+def _Parse(path):
+  log = etl.EtlFile(path)
+  count = 0
+  for unused_record in log.IterEvents():
+    count += 1
+  log.Close()
+  return count
+
+
+def _Decode(log, records, lazy):
+  for record in records:
+    event_class = event.EventClass.Get(etl.GuidToString(record.provider_id),
+                                       record.version, record.event_type)
+    if event_class:
+      event_class(log, record, lazy)
+
+
+def _DecodeInterned(log, records):
+  binary_buffer.SetInternTable(binary_buffer.InternTable())
+  try:
+    _Decode(log, records, False)
+  finally:
+    binary_buffer.SetInternTable(None)
+
+
+def _Dispatch(source, log, records):
+  for record in records:
+    source.ProcessEtlEvent(log, record)
+
+
+def _Consume(path, use_mmap):
+  source = EtlFileEventSource([_MakeConsumer()], use_mmap=use_mmap)
+  source.OpenFileSession(path)
+  source.Consume()
+  source.Close()
+
+
+def _Best(func, repeat):
+  best = None
+  for unused_i in range(repeat):
+    start = _clock()
+    func()
+    elapsed = _clock() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+
+def RunBenchmarks(event_count, repeat, seed, directory):
+  """Runs every stage on logs of both pointer sizes.
+
+  Returns:
+    A dict from '<stage>/<pointer bits>' to a dict of seconds,
+    events_per_second and bytes_per_second. For the parse and consume
+    stages the bytes are those of the log file, and for the others those of
+    the event payloads.
+  """
+  results = {}
+  for pointer_size in (4, 8):
+    path = os.path.join(directory, 'synthetic_%d.etl' % (8 * pointer_size))
+    writer = synthetic.GenerateLog(path, event_count, pointer_size, seed)
+    file_bytes = os.path.getsize(path)
+    payload_bytes = writer.payload_bytes
+    log, records = _ReadRecords(path)
+    source = EtlFileEventSource([_MakeConsumer()])
+
+    stages = [
+        ('parse', file_bytes, lambda: _Parse(path)),
+        ('decode', payload_bytes, lambda: _Decode(log, records, False)),
+        ('decode_lazy', payload_bytes, lambda: _Decode(log, records, True)),
+        ('decode_interned', payload_bytes,
+         lambda: _DecodeInterned(log, records)),
+        ('dispatch', payload_bytes, lambda: _Dispatch(source, log, records)),
+        ('consume', file_bytes, lambda: _Consume(path, False)),
+        ('consume_mmap', file_bytes, lambda: _Consume(path, True)),
+    ]
+    for name, byte_count, func in stages:
+      seconds = _Best(func, repeat)
+      results['%s/%d' % (name, 8 * pointer_size)] = {
+          'seconds': seconds,
+          'events_per_second': writer.event_count / seconds,
+          'bytes_per_second': byte_count / seconds,
+      }
+    log.Close()
+  return results
+
+
+def Compare(results, baseline, threshold):
+  """Prints the change of each stage against a baseline.
+
+  Returns:
+    The names of the stages that got slower by more than threshold.
+  """
+  regressions = []
+  print '\n%-20s %14s %14s %8s' % ('Stage', 'Baseline ev/s', 'Current ev/s',
+                                   'Change')
+  for name in sorted(results):
+    if name not in baseline:
+      continue
+    old = baseline[name]['events_per_second']
+    new = results[name]['events_per_second']
+    change = new / old - 1
+    flag = ''
+    if change < -threshold:
+      regressions.append(name)
+      flag = '  REGRESSION'
+    print '%-20s %14.0f %14.0f %+7.1f%%%s' % (name, old, new, 100 * change,
+                                              flag)
+  return regressions
+
+
+def main():
+  parser = optparse.OptionParser(
+      usage='%prog [--events=N] [--repeat=N] [--seed=N] '
+            '[--output=results.json] [--baseline=old.json] [--threshold=0.1]')
+  parser.add_option('--events', type='int', default=100000,
+                    help='The number of events in each synthetic log.')
+  parser.add_option('--repeat', type='int', default=3,
+                    help='The number of runs of each stage to keep the '
+                         'best of.')
+  parser.add_option('--seed', type='int', default=0,
+                    help='The seed of the synthetic logs.')
+  parser.add_option('--output', help='Write the results to this JSON file.')
+  parser.add_option('--baseline',
+                    help='Compare the results to this earlier JSON file.')
+  parser.add_option('--threshold', type='float', default=0.1,
+                    help='The slowdown, as a fraction, that counts as a '
+                         'regression.')
+  options, unused_args = parser.parse_args()
+
+  directory = tempfile.mkdtemp(prefix='decode_benchmark')
+  try:
+    results = RunBenchmarks(options.events, options.repeat, options.seed,
+                            directory)
+  finally:
+    shutil.rmtree(directory)
+
+  print '%-20s %14s %14s' % ('Stage', 'Events/s', 'MB/s')
+  for name in sorted(results):
+    result = results[name]
+    print '%-20s %14.0f %14.1f' % (name, result['events_per_second'],
+                                   result['bytes_per_second'] / 1e6)
+
+  if options.output:
+    output = open(options.output, 'w')
+    json.dump({'python': platform.python_version(),
+               'platform': platform.platform(),
+               'events': options.events,
+               'seed': options.seed,
+               'results': results}, output, indent=2, sort_keys=True)
+    output.close()
+
+  if options.baseline:
+    baseline = json.load(open(options.baseline))['results']
+    if Compare(results, baseline, options.threshold):
+      return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
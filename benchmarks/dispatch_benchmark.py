@@ -0,0 +1,118 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures the per-event cost of dispatching events to handlers.
+
+Compares TraceEventSource's dispatch, which goes through a cached index of
+bound handlers, against the previous dispatch, which looked up the event
+class by string GUID and bound a new closure per handler for every event.
+Both handled and unhandled events are measured.
+
+Usage: dispatch_benchmark.py [--events=N]
+"""
+import optparse
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from etw import EtlFileEventSource, EventConsumer, EventHandler
+from etw import etl
+from etw import util
+from etw.descriptors import event
+from etw.descriptors import image
+from etw.descriptors import process
+
+
+class _Session(object):
+  """Stands in for the log file the events were read from."""
+  is_64_bit_log = False
+
+  def SessionTimeToTime(self, session_time):
+    return util.FileTimeToTime(session_time)
+
+
+class _Consumer(EventConsumer):
+  def __init__(self):
+    self.count = 0
+
+  @EventHandler(image.Event.Load)
+  def OnImageLoad(self, event_data):
+    self.count += 1
+
+
+def _Record(event_info, version, payload):
+  return etl.EventRecord(etl.TRACE_HEADER_TYPE_SYSTEM32,
+                         etl.GuidToBytes(event_info[0]), version,
+                         event_info[1], 0, 0, 10, 1, 129000000000000000, 0,
+                         payload, 0, len(payload))
+
+
+def _LegacyDispatch(source, session, record):
+  """The dispatch of ProcessEtlEvent before the handler cache was filled."""
+  guid = etl.GuidToString(record.provider_id)
+  kind = record.event_type
+  event_class = event.EventClass.Get(guid, record.version, kind)
+  if event_class:
+    handler_list = []
+    for handler_instance in source._handlers:
+      for handler_func in handler_instance.event_handler_map.get((guid, kind),
+                                                                 []):
+        def BoundHandler(event_obj, func=handler_func,
+                         instance=handler_instance):
+          func(instance, event_obj)
+        handler_list.append(BoundHandler)
+    if handler_list:
+      event_obj = event_class(session, record)
+      for handler in handler_list:
+        handler(event_obj)
+
+
+def _Time(dispatch, source, session, records):
+  start = time.clock()
+  for record in records:
+    dispatch(source, session, record)
+  return (time.clock() - start) / len(records) * 1e6
+
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [--events=N]')
+  parser.add_option('--events', type='int', default=100000,
+                    help='The number of events to dispatch per run.')
+  options, unused_args = parser.parse_args()
+
+  image_payload = struct.pack('<IIIIIIIIIII', 0x400000, 0x1000, 10, 0, 0, 0,
+                              0x400000, 0, 0, 0, 0)
+  image_payload += u'foo.dll\0'.encode('utf-16-le')
+  process_payload = '\0' * 64
+  handled = [_Record(image.Event.Load, 2, image_payload)] * options.events
+  unhandled = [_Record(process.Event.Start, 3, process_payload)] * \
+      options.events
+
+  source = EtlFileEventSource([_Consumer()])
+  session = _Session()
+  current = lambda source, session, record: source.ProcessEtlEvent(session,
+                                                                   record)
+  print '%-12s %12s %12s' % ('', 'legacy us', 'current us')
+  for name, records in (('handled', handled), ('unhandled', unhandled)):
+    print '%-12s %12.3f %12.3f' % (
+        name,
+        _Time(_LegacyDispatch, source, session, records),
+        _Time(current, source, session, records))
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,133 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Stress tests the record ring that carries realtime events to the readers.
+
+A synthetic producer thread writes records the way PipelineTraceEventSource
+does: a header packed in place, and a payload copied in with ctypes.memmove
+from memory outside the ring. A consumer thread reads them back, and checks
+that every record arrives intact and in order. Records that don't fit are
+dropped and counted, or, with --retry, written again until they fit.
+
+This doesn't need ETW, so it runs on any platform.
+
+Usage: ring_buffer_benchmark.py [--records=N] [--capacity=BYTES]
+                                [--max-size=BYTES] [--retry]
+"""
+import ctypes
+import optparse
+import os
+import random
+import struct
+import sys
+import threading
+import time
+
+# Import the module on its own, as importing the etw package needs Windows.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'etw'))
+
+import ring_buffer
+
+
+# Each record starts with its sequence number and the length of its payload.
+_HEADER = struct.Struct('<QI')
+
+
+def _Produce(ring, payloads, record_count, retry):
+  addresses = [(ctypes.addressof(payload), len(payload))
+               for payload in payloads]
+  for sequence in xrange(record_count):
+    address, length = addresses[sequence % len(addresses)]
+    while True:
+      offset = ring.Reserve(_HEADER.size + length)
+      if offset is not None:
+        break
+      if not retry:
+        break
+    if offset is None:
+      continue
+    _HEADER.pack_into(ring.buffer, offset, sequence, length)
+    ctypes.memmove(ring.address + offset + _HEADER.size, address, length)
+    ring.Commit()
+  ring.Close()
+
+
+def _Consume(ring, payloads, result):
+  expected = [payload.raw for payload in payloads]
+  last_sequence = -1
+  count = 0
+  byte_count = 0
+  errors = 0
+  while True:
+    view = ring.Read()
+    if view is None:
+      break
+    sequence, length = _HEADER.unpack_from(view)
+    data = view[_HEADER.size:].tobytes()
+    ring.Release()
+    if (sequence <= last_sequence or
+        data != expected[sequence % len(expected)] or length != len(data)):
+      errors += 1
+    last_sequence = sequence
+    count += 1
+    byte_count += _HEADER.size + length
+  result.extend([count, byte_count, errors])
+
+
+def main():
+  parser = optparse.OptionParser(
+      usage='%prog [--records=N] [--capacity=BYTES] [--max-size=BYTES] '
+            '[--retry]')
+  parser.add_option('--records', type='int', default=1000000,
+                    help='The number of records to write.')
+  parser.add_option('--capacity', type='int', default=1024 * 1024,
+                    help='The size of the ring in bytes.')
+  parser.add_option('--max-size', type='int', default=512,
+                    help='The largest payload size in bytes.')
+  parser.add_option('--retry', action='store_true', default=False,
+                    help='Wait for room instead of dropping records.')
+  options, unused_args = parser.parse_args()
+
+  generator = random.Random(0)
+  payloads = []
+  for unused_i in xrange(257):
+    length = generator.randint(0, options.max_size)
+    data = ''.join(chr(generator.randint(0, 255)) for unused_j in xrange(length))
+    payloads.append(ctypes.create_string_buffer(data, length))
+
+  ring = ring_buffer.RingBuffer(options.capacity)
+  result = []
+  consumer = threading.Thread(target=_Consume, args=(ring, payloads, result))
+  start = time.time()
+  consumer.start()
+  _Produce(ring, payloads, options.records, options.retry)
+  consumer.join()
+  elapsed = time.time() - start
+
+  count, byte_count, errors = result
+  print 'records read:    %12d' % count
+  # With --retry, these count the attempts that found the ring full.
+  print 'records dropped: %12d' % ring.overflow_count
+  print 'bytes dropped:   %12d' % ring.overflow_bytes
+  print 'records/s:       %12.0f' % (count / elapsed)
+  print 'MB/s:            %12.1f' % (byte_count / elapsed / 1e6)
+  print 'corrupt records: %12d' % errors
+  dropped = 0 if options.retry else ring.overflow_count
+  if errors or count + dropped != options.records:
+    return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -17,12 +17,25 @@
     'chromium_code': 1,
     'etw_sources': [
       'etw/__init__.py',
+      'etw/async_source.py',
+      'etw/columnar.py',
+      'etw/census.py',
       'etw/consumer.py',
       'etw/controller.py',
+      'etw/etl.py',
+      'etw/etl_index.py',
       'etw/evntcons.py',
       'etw/evntrace.py',
       'etw/guiddef.py',
+      'etw/instrumentation.py',
+      'etw/native.py',
+      'etw/parallel.py',
+      'etw/parquet_export.py',
+      'etw/pipeline.py',
+      'etw/profiler.py',
       'etw/provider.py',
+      'etw/ring_buffer.py',
+      'etw/synthetic.py',
       'etw/util.py',
       'etw/descriptors/__init__.py',
       'etw/descriptors/binary_buffer.py',
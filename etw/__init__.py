@@ -17,6 +17,8 @@ Event Tracing for Windows. The classes implement an ETW controller, consumer
 and provider.
 """
 from etw.consumer import TraceEventSource, EventConsumer, EventHandler
+from etw.consumer import BatchEventHandler
+from etw.consumer import EtlFileEventSource, EventFilter
 from etw.controller import TraceController, TraceProperties
 from etw.provider import TraceProvider, MofEvent
 from etw.guiddef import GUID
@@ -26,6 +28,9 @@ __all__ = ['GUID',
            'MofEvent',
            'EventConsumer',
            'EventHandler',
+           'BatchEventHandler',
            'TraceEventSource',
+           'EtlFileEventSource',
+           'EventFilter',
            'TraceController',
            'TraceProperties']
@@ -0,0 +1,368 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Consumes events on a dedicated thread, for use from an asyncio event loop.
+
+TraceEventSource.Consume blocks in ProcessTrace until a realtime session is
+closed. AsyncEventSource runs it on a thread of its own, where the events are
+decoded and put on a bounded EventQueue, and hands them out in batches from
+there. Handlers run wherever the batches are taken, so a slow handler can
+never hold up the thread that ETW delivers buffers to.
+
+The batches can be taken from an asyncio event loop with "async for", or
+from any thread by iterating the source or calling GetBatch:
+
+  source = AsyncEventSource(realtime_source, [image.Event.Load])
+  source.Start()
+  async for events in source:
+    for event in events:
+      ...
+
+When the queue is full, its policy decides what to do with the next event:
+  DROP_OLDEST: drop the oldest queued event to make room. This is the
+      default.
+  BLOCK: wait for room, holding up the consumer thread. For a realtime
+      session, that's the thread ETW delivers buffers on, so BLOCK is only
+      allowed for sources without realtime sessions.
+  SAMPLE: keep one in every sample_interval events, each in place of the
+      oldest queued event, and drop the others.
+
+A batch is handed out once batch_size events are queued, at the end of each
+buffer, and when consumption ends, so no event waits for more than a buffer.
+
+The sources should be created with lazy set, so the consumer thread only
+copies the payload of each event, and the fields are decoded on first use by
+the handlers. The payloads of events read from memory mapped log files are
+copied, so that they can still be decoded after the source is closed.
+Either asyncio or trollius is required for "async for", and is
+only imported then. On python 2, where there's no StopAsyncIteration, the
+end of the batches is signalled with StopIteration.
+"""
+from etw import consumer
+from etw.descriptors import event
+import collections
+import logging
+import threading
+
+try:
+  _StopAsyncIteration = StopAsyncIteration
+except NameError:
+  _StopAsyncIteration = StopIteration
+
+
+# The policies for putting an event on a full queue.
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+SAMPLE = 'sample'
+
+# The defaults for the size of the queue, and of the batches taken from it.
+DEFAULT_MAX_SIZE = 65536
+DEFAULT_BATCH_SIZE = 256
+
+
+def _ImportAsyncio():
+  try:
+    import asyncio
+  except ImportError:
+    try:
+      import trollius as asyncio
+    except ImportError:
+      raise ImportError('asyncio or trollius is required for async iteration.')
+  return asyncio
+
+
+class EventQueue(object):
+  """A bounded queue of events, put by one thread and taken in batches.
+
+  Attributes:
+    dropped_count: the number of events dropped because the queue was full.
+  """
+
+  def __init__(self, max_size=DEFAULT_MAX_SIZE, policy=DROP_OLDEST,
+               batch_size=DEFAULT_BATCH_SIZE, sample_interval=10):
+    """Creates an empty queue.
+
+    Args:
+      max_size: the maximum number of queued events.
+      policy: DROP_OLDEST, BLOCK or SAMPLE.
+      batch_size: the maximum number of events in a batch.
+      sample_interval: with the SAMPLE policy, keep one in this many events
+          when the queue is full.
+
+    Raises:
+      ValueError: the policy is unknown.
+    """
+    if policy not in (BLOCK, DROP_OLDEST, SAMPLE):
+      raise ValueError('Unknown queue policy %r.' % policy)
+    self._max_size = max_size
+    self._policy = policy
+    self._batch_size = batch_size
+    self._sample_interval = sample_interval
+    self._sample_count = 0
+    self._events = collections.deque()
+    self._lock = threading.Lock()
+    self._not_full = threading.Condition(self._lock)
+    self._ready = threading.Condition(self._lock)
+    self._flushed = False
+    self._closed = False
+    # A (loop, future) tuple for the batch awaited by an event loop, if any.
+    self._waiter = None
+    self.dropped_count = 0
+
+  def Put(self, event_obj):
+    """Queues an event, applying the queue's policy if it's full.
+
+    Events put after the queue is closed are dropped.
+    """
+    with self._lock:
+      events = self._events
+      if len(events) >= self._max_size:
+        if self._policy == BLOCK:
+          while len(events) >= self._max_size and not self._closed:
+            self._not_full.wait()
+        elif self._policy == DROP_OLDEST:
+          events.popleft()
+          self.dropped_count += 1
+        else:
+          self._sample_count += 1
+          self.dropped_count += 1
+          if self._sample_count % self._sample_interval:
+            return
+          events.popleft()
+      if self._closed:
+        return
+      events.append(event_obj)
+      if len(events) >= self._batch_size:
+        self._NotifyLocked()
+
+  def Flush(self):
+    """Makes the queued events available, even if there's less than a batch."""
+    with self._lock:
+      if self._events:
+        self._flushed = True
+        self._NotifyLocked()
+
+  def Close(self):
+    """Closes the queue. The queued events can still be taken."""
+    with self._lock:
+      self._closed = True
+      self._not_full.notify_all()
+      self._NotifyLocked()
+
+  def GetBatch(self, timeout=None):
+    """Takes the next batch of events, waiting for it if necessary.
+
+    Args:
+      timeout: the longest time to wait, in seconds, or None to wait until a
+          batch is ready or the queue is closed.
+
+    Returns:
+      A list of events, which is empty if the queue was closed and drained,
+      or if the timeout expired.
+    """
+    with self._lock:
+      if timeout is None:
+        while not self._IsReadyLocked():
+          self._ready.wait()
+      elif not self._IsReadyLocked():
+        self._ready.wait(timeout)
+        if not self._IsReadyLocked():
+          return []
+      return self._TakeLocked()
+
+  def __iter__(self):
+    """Iterates the batches of events until the queue is closed and empty."""
+    while True:
+      batch = self.GetBatch()
+      if not batch:
+        return
+      yield batch
+
+  def GetBatchFuture(self, loop):
+    """Returns a future for the next batch of events.
+
+    Args:
+      loop: the event loop to resolve the future on.
+
+    Returns:
+      A future whose result is a non-empty list of events, or which raises
+      StopAsyncIteration once the queue is closed and drained.
+    """
+    if hasattr(loop, 'create_future'):
+      future = loop.create_future()
+    else:
+      future = _ImportAsyncio().Future(loop=loop)
+    with self._lock:
+      if self._IsReadyLocked():
+        self._ResolveLocked(future)
+      else:
+        self._waiter = loop, future
+    return future
+
+  def _IsReadyLocked(self):
+    return (len(self._events) >= self._batch_size or
+            (self._flushed and self._events) or self._closed)
+
+  def _TakeLocked(self):
+    events = self._events
+    count = min(len(events), self._batch_size)
+    batch = [events.popleft() for unused_i in xrange(count)]
+    if not events:
+      self._flushed = False
+    if batch:
+      self._not_full.notify()
+    return batch
+
+  def _NotifyLocked(self):
+    self._ready.notify()
+    if self._waiter is not None:
+      loop, future = self._waiter
+      self._waiter = None
+      loop.call_soon_threadsafe(self._Resolve, loop, future)
+
+  def _Resolve(self, loop, future):
+    """Resolves a waiting future. This runs on the future's event loop."""
+    with self._lock:
+      if future.cancelled():
+        return
+      if self._IsReadyLocked():
+        self._ResolveLocked(future)
+      else:
+        self._waiter = loop, future
+
+  def _ResolveLocked(self, future):
+    batch = self._TakeLocked()
+    if batch:
+      future.set_result(batch)
+    else:
+      future.set_exception(_StopAsyncIteration())
+
+
+class _QueueingConsumer(consumer.EventConsumer):
+  """Puts the events it handles on an EventQueue."""
+
+  def __init__(self, queue, events):
+    self._queue = queue
+    # Handle the given events, rather than those declared on the class.
+    self.event_handler_map = dict((event_info, [type(self).OnEvent])
+                                  for event_info in events)
+
+  def OnEvent(self, event_obj):
+    # The event may be taken after the log file it refers to is closed.
+    event_obj.Detach()
+    self._queue.Put(event_obj)
+
+  def ProcessBuffer(self, session, buffer):
+    self._queue.Flush()
+
+
+class AsyncEventSource(object):
+  """Consumes the sessions of an event source on a thread of its own.
+
+  Attributes:
+    queue: the EventQueue the events are handed out from.
+  """
+
+  def __init__(self, source, events=None, max_size=DEFAULT_MAX_SIZE,
+               policy=DROP_OLDEST, batch_size=DEFAULT_BATCH_SIZE,
+               sample_interval=10, loop=None):
+    """Creates a consumer for the open sessions of source.
+
+    Args:
+      source: a TraceEventSource, or a subclass, with open sessions.
+      events: a list of (guid, event_type) tuples of the events to hand out,
+          such as image.Event.Load. By default, all the events that have an
+          EventClass are handed out.
+      max_size: the maximum number of events waiting to be taken.
+      policy: what to do with events when the queue is full: DROP_OLDEST,
+          BLOCK or SAMPLE. BLOCK is not allowed if the source has realtime
+          sessions.
+      batch_size: the maximum number of events in a batch.
+      sample_interval: with the SAMPLE policy, keep one in this many events
+          when the queue is full.
+      loop: the event loop to iterate the batches on. By default, this is
+          the current event loop at the time of iteration.
+
+    Raises:
+      ValueError: the policy is BLOCK, and the source has a realtime
+          session, whose ETW callback thread it would hold up.
+    """
+    if policy == BLOCK and any(getattr(session, 'is_realtime', False)
+                               for session in source._trace_sessions):
+      raise ValueError('The BLOCK policy would stall the callbacks of a '
+                       'realtime session.')
+    self._thread = None
+    self._source = source
+    self._loop = loop
+    self.queue = EventQueue(max_size, policy, batch_size, sample_interval)
+    if events is None:
+      events = set((guid, kind)
+                   for (guid, version, kind), unused_class
+                   in event.EventClass.GetAll())
+    source.AddHandler(_QueueingConsumer(self.queue, events))
+
+  @property
+  def dropped_count(self):
+    """The number of events dropped because the queue was full."""
+    return self.queue.dropped_count
+
+  def Start(self):
+    """Starts consuming the sessions of the source on a new thread."""
+    self._thread = threading.Thread(target=self._Consume,
+                                    name='AsyncEventSource')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def Close(self, timeout=None):
+    """Stops consuming, and closes the sessions of the source.
+
+    Events that are still queued can be taken after the source is closed.
+
+    Args:
+      timeout: the longest time to wait for the consumer thread to exit.
+    """
+    # Stop dispatching, and wake the consumer thread if it's blocked on the
+    # queue, before closing the sessions out from under it.
+    self._source._stop = True
+    self.queue.Close()
+    self._source.Close()
+    if self._thread is not None:
+      self._thread.join(timeout)
+      self._thread = None
+
+  def GetBatch(self, timeout=None):
+    """Takes the next batch of events. See EventQueue.GetBatch."""
+    return self.queue.GetBatch(timeout)
+
+  def __iter__(self):
+    return iter(self.queue)
+
+  def __aiter__(self):
+    return self
+
+  def __anext__(self):
+    loop = self._loop
+    if loop is None:
+      loop = _ImportAsyncio().get_event_loop()
+    return self.queue.GetBatchFuture(loop)
+
+  def _Consume(self):
+    try:
+      self._source.Consume()
+    except consumer.TraceCancelledError:
+      pass
+    except:
+      logging.exception('Exception consuming events.')
+    finally:
+      self.queue.Close()
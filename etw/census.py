@@ -0,0 +1,264 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Takes a census of the events in log files, without decoding them.
+
+The census counts the events and payload bytes of each (provider, version,
+event type), with the time stamps of the first and last of them, and the
+events of each process. Only the event headers are read: the payloads are
+never sliced, copied or decoded, so a census of a memory mapped log runs at
+about the speed its buffers can be read.
+
+Run as a script, this module prints the census of the logs given on the
+command line:
+  python -m etw.census [--sort=count|bytes] [--no-mmap] log.etl...
+"""
+from etw import consumer
+from etw import etl
+from etw import util
+from etw.descriptors import event
+import operator
+import optparse
+import sys
+
+
+# Maps the sort keys of PrintCensus to the attributes they sort on.
+_SORT_ATTRIBUTES = {
+  'count': 'count',
+  'bytes': 'byte_count',
+}
+
+
+class EventStats(object):
+  """The census of the events of a (provider, version, event type).
+
+  Attributes:
+    guid: the string GUID of the provider.
+    version: the version of the events.
+    event_type: the type of the events.
+    count: the number of events.
+    byte_count: the total size of their payloads.
+    first_time: the time stamp of the first event, in seconds since 1.1.1970.
+    last_time: the time stamp of the last event.
+  """
+
+  def __init__(self, guid, version, event_type, count, byte_count,
+               first_time, last_time):
+    self.guid = guid
+    self.version = version
+    self.event_type = event_type
+    self.count = count
+    self.byte_count = byte_count
+    self.first_time = first_time
+    self.last_time = last_time
+
+  @property
+  def name(self):
+    """The name of the EventClass of the events, or None if it's unknown."""
+    event_class = event.EventClass.Get(self.guid, self.version,
+                                       self.event_type)
+    if event_class is None:
+      return None
+    return event_class.__name__
+
+
+class ProcessStats(object):
+  """The census of the events of a process.
+
+  Attributes:
+    process_id: the ID of the process.
+    count: the number of events.
+    byte_count: the total size of their payloads.
+    first_time: the time stamp of the first event, in seconds since 1.1.1970.
+    last_time: the time stamp of the last event.
+  """
+
+  def __init__(self, process_id, count, byte_count, first_time, last_time):
+    self.process_id = process_id
+    self.count = count
+    self.byte_count = byte_count
+    self.first_time = first_time
+    self.last_time = last_time
+
+
+class Census(object):
+  """Accumulates the census of the events of one or more logs.
+
+  Attributes:
+    event_count: the total number of events.
+    start_time: the earliest time stamp, in seconds since 1.1.1970, or None
+        if no events were added.
+    end_time: the latest time stamp, or None if no events were added.
+  """
+
+  def __init__(self):
+    # Both map their key to a [count, bytes, first, last] list, where first
+    # and last are FILETIMEs.
+    self._events = {}
+    self._processes = {}
+
+  def Add(self, log_session, record):
+    """Adds an event to the census, without reading its payload.
+
+    Args:
+      log_session: the etl.EtlFile the event was read from.
+      record: the etl.EventRecord of the event.
+    """
+    time_stamp = log_session.SessionTimeToFileTime(record.time_stamp)
+    length = record.user_data_length
+    for stats_map, key in (
+        (self._events, (record.provider_id, record.version,
+                        record.event_type)),
+        (self._processes, record.process_id)):
+      stats = stats_map.get(key, None)
+      if stats is None:
+        stats_map[key] = [1, length, time_stamp, time_stamp]
+      else:
+        stats[0] += 1
+        stats[1] += length
+        if time_stamp < stats[2]:
+          stats[2] = time_stamp
+        elif time_stamp > stats[3]:
+          stats[3] = time_stamp
+
+  def AddSource(self, source):
+    """Adds the events of all the open sessions of source.
+
+    Events that don't pass the source's filter are skipped.
+
+    Args:
+      source: an EtlFileEventSource with open file sessions.
+    """
+    add = self.Add
+    for session, record in source.IterEvents():
+      add(session, record)
+
+  @property
+  def event_count(self):
+    return sum(stats[0] for stats in self._events.itervalues())
+
+  @property
+  def start_time(self):
+    if not self._events:
+      return None
+    return util.FileTimeToTime(min(s[2] for s in self._events.itervalues()))
+
+  @property
+  def end_time(self):
+    if not self._events:
+      return None
+    return util.FileTimeToTime(max(s[3] for s in self._events.itervalues()))
+
+  def GetEventStats(self):
+    """Returns a list of EventStats, one per (provider, version, type)."""
+    return [EventStats(etl.GuidToString(provider_id), version, event_type,
+                       count, length, util.FileTimeToTime(first),
+                       util.FileTimeToTime(last))
+            for (provider_id, version, event_type),
+                (count, length, first, last) in self._events.iteritems()]
+
+  def GetProcessStats(self):
+    """Returns a list of ProcessStats, one per process."""
+    return [ProcessStats(process_id, count, length, util.FileTimeToTime(first),
+                         util.FileTimeToTime(last))
+            for process_id, (count, length, first, last)
+            in self._processes.iteritems()]
+
+  def GetProcessRates(self):
+    """Returns a map from process ID to its events per second.
+
+    Rates are averaged over the time spanned by the whole census, so that the
+    rates of different processes can be compared.
+    """
+    duration = (self.end_time or 0) - (self.start_time or 0)
+    if duration <= 0:
+      return dict((process_id, None) for process_id in self._processes)
+    return dict((process_id, stats[0] / duration)
+                for process_id, stats in self._processes.iteritems())
+
+
+def TakeCensus(source):
+  """Takes the census of the events of all the open sessions of source.
+
+  Args:
+    source: an EtlFileEventSource with open file sessions.
+
+  Returns:
+    A Census.
+  """
+  census = Census()
+  census.AddSource(source)
+  return census
+
+
+def PrintCensus(census, sort_key='count', output=sys.stdout):
+  """Prints a census as two tables, of events and of processes.
+
+  Args:
+    census: the Census to print.
+    sort_key: 'count' or 'bytes', what to sort the rows on in decreasing
+        order.
+    output: the file to print to.
+  """
+  sort_key = operator.attrgetter(_SORT_ATTRIBUTES[sort_key])
+  start_time = census.start_time or 0
+  output.write('%d events over %.6f s\n\n' %
+               (census.event_count, (census.end_time or 0) - start_time))
+
+  output.write('%-38s %4s %4s %10s %12s %12s %12s  %s\n' %
+               ('Provider', 'Ver', 'Type', 'Count', 'Bytes', 'First (s)',
+                'Last (s)', 'Event'))
+  for stats in sorted(census.GetEventStats(),
+                      key=sort_key, reverse=True):
+    output.write('%-38s %4d %4d %10d %12d %12.6f %12.6f  %s\n' %
+                 (stats.guid, stats.version, stats.event_type, stats.count,
+                  stats.byte_count, stats.first_time - start_time,
+                  stats.last_time - start_time, stats.name or '-'))
+
+  rates = census.GetProcessRates()
+  output.write('\n%8s %10s %12s %12s\n' %
+               ('Process', 'Count', 'Bytes', 'Events/s'))
+  for stats in sorted(census.GetProcessStats(),
+                      key=sort_key, reverse=True):
+    rate = rates[stats.process_id]
+    output.write('%8d %10d %12d %12s\n' %
+                 (stats.process_id, stats.count, stats.byte_count,
+                  '-' if rate is None else '%.1f' % rate))
+
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [options] log.etl...')
+  parser.add_option('--sort', dest='sort_key', default='count',
+                    choices=['count', 'bytes'],
+                    help='Sort the tables on count or bytes.')
+  parser.add_option('--no-mmap', dest='use_mmap', default=True,
+                    action='store_false',
+                    help='Read the logs a buffer at a time rather than '
+                         'memory mapping them.')
+  options, args = parser.parse_args()
+  if not args:
+    parser.error('No log files specified.')
+
+  source = consumer.EtlFileEventSource(use_mmap=options.use_mmap)
+  try:
+    for path in args:
+      source.OpenFileSession(path)
+    census = TakeCensus(source)
+  finally:
+    source.Close()
+  PrintCensus(census, options.sort_key)
+
+
+if __name__ == '__main__':
+  sys.exit(main())
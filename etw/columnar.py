@@ -0,0 +1,261 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Decodes log events into columns, rather than into one object per event.
+
+DecodeColumns reads the events of an EtlFileEventSource and returns a table
+per EventClass, where each event is a row of packed fixed size values. The
+column types are derived from the struct formats of the field.* functions in
+the EventClass' _fields_. Variable size fields, such as strings and SIDs, are
+interned into a side table per column, and the column holds the index of the
+value in that table.
+
+The tables can be turned into NumPy structured arrays over the packed row
+data. NumPy is only needed for that last step.
+"""
+import struct
+from etw.descriptors import binary_buffer
+from etw.descriptors import event
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+# The NumPy types for the struct formats declared by field functions.
+_DTYPES = {
+  '?': '?',
+  'b': 'i1',
+  'B': 'u1',
+  'h': '<i2',
+  'H': '<u2',
+  'i': '<i4',
+  'I': '<u4',
+  'q': '<i8',
+  'Q': '<u8',
+  'd': '<f8',
+}
+
+# The columns that hold the event header, as (name, struct format) tuples.
+HEADER_COLUMNS = (('process_id', 'I'),
+                  ('thread_id', 'I'),
+                  ('raw_time_stamp', 'q'),
+                  ('time_stamp', 'd'))
+
+
+class StringTable(object):
+  """Interns the values of a variable size column.
+
+  Attributes:
+    values: the list of distinct values, in the order they were first seen.
+  """
+
+  def __init__(self):
+    self.values = []
+    self._indexes = {}
+
+  def Intern(self, value):
+    """Returns the index of value in the table, adding it if needed."""
+    index = self._indexes.get(value, None)
+    if index is None:
+      index = len(self.values)
+      self._indexes[value] = index
+      self.values.append(value)
+    return index
+
+  def Clear(self):
+    """Removes all the values from the table."""
+    self.values = []
+    self._indexes = {}
+
+  def __len__(self):
+    return len(self.values)
+
+
+class Table(object):
+  """Accumulates the events of an EventClass as rows of packed values.
+
+  Pointers are always stored as 64 bit values, so that logs with either
+  pointer size can be collected into the same table. Fields with a converter,
+  such as WmiTime, are stored as the converted float.
+
+  Attributes:
+    event_class: the EventClass whose events are collected.
+    columns: a list of (name, struct format) tuples, one per column.
+    strings: a map from the name of each variable size column to the
+        StringTable its values are interned in.
+    row_count: the number of rows in the table.
+  """
+
+  def __init__(self, event_class):
+    self.event_class = event_class
+    self.columns = list(HEADER_COLUMNS)
+    self.strings = {}
+    self.row_count = 0
+    # (index, convert) tuples for the values that need converting, and
+    # (index, StringTable) tuples for the values that need interning.
+    self._converters = []
+    self._interned = []
+    fields = getattr(event_class, '_fields_', [])
+    for name, field in fields:
+      index = len(self.columns)
+      formats = getattr(field, 'struct_formats', None)
+      if not formats:
+        table = StringTable()
+        self.strings[name] = table
+        self._interned.append((index, table))
+        self.columns.append((name, 'i'))
+      elif field.convert:
+        self._converters.append((index, field.convert))
+        self.columns.append((name, 'd'))
+      else:
+        self.columns.append((name, formats[True]))
+    self._row = struct.Struct('<' + ''.join(f for n, f in self.columns))
+    self._rows = bytearray()
+    # The rows are decoded with the same compiled steps as event objects, so
+    # that the two can't disagree on the layout of the fields.
+    self._steps = (event_class.GetFieldDecoder(False),
+                   event_class.GetFieldDecoder(True))
+
+  def Add(self, log_session, record):
+    """Decodes an event and appends it to the table.
+
+    Args:
+      log_session: the etl.EtlFile the event was read from.
+      record: the etl.EventRecord to decode.
+
+    Raises:
+      BufferOverflowError: the event data is too short for the fields.
+    """
+    reader = binary_buffer.BinaryDataReader(record.data,
+                                            record.user_data_offset,
+                                            record.user_data_length)
+    values = [record.process_id,
+              record.thread_id,
+              record.time_stamp,
+              log_session.SessionTimeToTime(record.time_stamp)]
+    for step in self._steps[bool(log_session.is_64_bit_log)]:
+      values.extend(step.ReadValues(log_session, reader))
+    for index, convert in self._converters:
+      values[index] = convert(log_session, values[index])
+    for index, table in self._interned:
+      values[index] = table.Intern(values[index])
+    self._rows += self._row.pack(*values)
+    self.row_count += 1
+
+  def GetDtype(self):
+    """Returns the NumPy dtype of the rows."""
+    return numpy.dtype([(name, _DTYPES[f]) for name, f in self.columns])
+
+  def ToArray(self):
+    """Returns the rows of the table as a read-only NumPy structured array.
+
+    The array is backed by a single copy of the packed rows, so rows added to
+    the table afterwards don't show up in it.
+
+    Raises:
+      ImportError: NumPy is not installed.
+    """
+    if numpy is None:
+      raise ImportError('NumPy is required to create arrays.')
+    return numpy.frombuffer(str(self._rows), dtype=self.GetDtype())
+
+  def TakeArray(self):
+    """Removes the rows from the table and returns them as a NumPy array.
+
+    The array takes over the row data without copying it. The string tables
+    are kept, so the indexes in later rows refer to the same tables.
+
+    Raises:
+      ImportError: NumPy is not installed.
+    """
+    if numpy is None:
+      raise ImportError('NumPy is required to create arrays.')
+    rows = self._rows
+    self._rows = bytearray()
+    self.row_count = 0
+    if not rows:
+      return numpy.zeros(0, dtype=self.GetDtype())
+    return numpy.frombuffer(rows, dtype=self.GetDtype())
+
+
+def IterClassEvents(source, event_classes):
+  """Iterates the events of a source that belong to the given classes.
+
+  Args:
+    source: an EtlFileEventSource with open file sessions.
+    event_classes: the EventClass subclasses to iterate the events of.
+
+  Yields:
+    (event_class, session, record) tuples.
+  """
+  event_classes = frozenset(event_classes)
+  # Maps (guid, version, event_type) to an EventClass, or None for the events
+  # that aren't wanted.
+  class_cache = {}
+  for session, record in source.IterEvents():
+    key = record.provider_id, record.version, record.event_type
+    event_class = class_cache.get(key, False)
+    if event_class is False:
+      event_class = event.EventClass.Get(record.guid, record.version,
+                                         record.event_type)
+      if event_class not in event_classes:
+        event_class = None
+      class_cache[key] = event_class
+    if event_class is not None:
+      yield event_class, session, record
+
+
+def CollectTables(source, event_classes):
+  """Collects the events of the given classes into a Table per class.
+
+  Args:
+    source: an EtlFileEventSource with open file sessions.
+    event_classes: the EventClass subclasses to collect.
+
+  Returns:
+    A map from each of event_classes to its Table.
+  """
+  tables = dict((event_class, Table(event_class))
+                for event_class in event_classes)
+  for event_class, session, record in IterClassEvents(source, event_classes):
+    tables[event_class].Add(session, record)
+  return tables
+
+
+def DecodeColumns(source, event_classes):
+  """Decodes the events of the given classes into NumPy structured arrays.
+
+  Args:
+    source: an EtlFileEventSource with open file sessions.
+    event_classes: the EventClass subclasses to decode.
+
+  Returns:
+    A map from each of event_classes to an (array, strings) tuple, where array
+    is a NumPy structured array with a row per event, and strings maps the
+    name of each variable size column to the list of values its indexes
+    refer to.
+
+  Raises:
+    ImportError: NumPy is not installed.
+  """
+  if numpy is None:
+    raise ImportError('NumPy is required to decode columns.')
+  result = {}
+  for event_class, table in CollectTables(source, event_classes).iteritems():
+    strings = dict((name, string_table.values)
+                   for name, string_table in table.strings.iteritems())
+    result[event_class] = table.ToArray(), strings
+  return result
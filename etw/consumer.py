@@ -13,18 +13,80 @@
 # limitations under the License.
 """Implements a trace consumer utility class."""
 from collections import defaultdict
-from ctypes import byref, cast, POINTER
+from ctypes import byref, cast, POINTER, string_at
+from etw import etl
+from etw import etl_index
 from etw import evntcons
 from etw import evntrace
+from etw import instrumentation
+from etw import profiler
 from etw import util
 from etw.descriptors import event
 import logging
+import struct
 
 
-def _BindHandler(handler_func, handler_instance):
-  def BoundHandler(event):
-    handler_func(handler_instance, event)
-  return BoundHandler
+def _HeaderStruct(header_type, fields):
+  """Builds a struct that reads fields from the start of an event header.
+
+  Args:
+    header_type: the ctypes header structure.
+    fields: a list of (name, struct format) tuples, in the order the fields
+        appear in the header. Fields of nested structures are named with a
+        dotted path.
+
+  Returns:
+    A struct.Struct that unpacks the values of the fields.
+  """
+  struct_format = '<'
+  position = 0
+  for name, field_format in fields:
+    offset = 0
+    field_type = header_type
+    for part in name.split('.'):
+      offset += getattr(field_type, part).offset
+      field_type = dict(field_type._fields_)[part]
+    struct_format += '%dx%s' % (offset - position, field_format)
+    position = offset + struct.calcsize('<' + field_format)
+  return struct.Struct(struct_format)
+
+
+# The structs that read the dispatch key of an event, as (kind, version,
+# raw guid) from an EVENT_TRACE, and (raw guid, kind, version) from an
+# EVENT_RECORD.
+_EVENT_TRACE_KEY = _HeaderStruct(evntrace.EVENT_TRACE_HEADER,
+                                 [('Class.Type', 'B'),
+                                  ('Class.Version', 'H'),
+                                  ('Guid', '16s')])
+_EVENT_RECORD_KEY = _HeaderStruct(evntrace.EVENT_HEADER,
+                                  [('ProviderId', '16s'),
+                                   ('EventDescriptor.Id', 'H'),
+                                   ('EventDescriptor.Version', 'B')])
+
+# The structs that read the dispatch key along with the fields an EventFilter
+# looks at.
+_EVENT_TRACE_FILTER_KEY = _HeaderStruct(evntrace.EVENT_TRACE_HEADER,
+                                        [('Class.Type', 'B'),
+                                         ('Class.Level', 'B'),
+                                         ('Class.Version', 'H'),
+                                         ('ThreadId', 'I'),
+                                         ('ProcessId', 'I'),
+                                         ('TimeStamp', 'q'),
+                                         ('Guid', '16s')])
+_EVENT_RECORD_FILTER_KEY = _HeaderStruct(evntrace.EVENT_HEADER,
+                                         [('ThreadId', 'I'),
+                                          ('ProcessId', 'I'),
+                                          ('TimeStamp', 'q'),
+                                          ('ProviderId', '16s'),
+                                          ('EventDescriptor.Id', 'H'),
+                                          ('EventDescriptor.Version', 'B'),
+                                          ('EventDescriptor.Level', 'B'),
+                                          ('EventDescriptor.Keyword', 'Q')])
+
+
+# The default number of events collected for a batch handler before it's
+# called.
+DEFAULT_BATCH_SIZE = 1024
 
 
 def EventHandler(*event_infos):
@@ -40,6 +102,71 @@ def EventHandler(*event_infos):
   return wrapper
 
 
+def BatchEventHandler(*event_infos, **kwargs):
+  """BatchEventHandler decorator factory.
+
+  Like EventHandler, but the decorated function is called with a list of
+  events rather than with each event. The events of a list all have the same
+  event info. Events are collected until batch_size of them are waiting,
+  until the end of the buffer they were read from, or until the end of the
+  trace, whichever comes first. This means that a batch handler sees its
+  events later than the other handlers of the same consumer do.
+
+  Args:
+    event_infos: the event infos of the events to handle.
+    batch_size: an optional keyword argument, the largest number of events
+        to pass at once. Defaults to DEFAULT_BATCH_SIZE.
+  """
+  batch_size = kwargs.pop('batch_size', DEFAULT_BATCH_SIZE)
+  if kwargs:
+    raise TypeError('Unexpected arguments: %s.' % ', '.join(kwargs))
+  def wrapper(func):
+    func.batch_event_infos = event_infos[:]
+    func.batch_size = batch_size
+    return func
+  return wrapper
+
+
+class _EventBatch(object):
+  """Collects the events for a batch handler, and passes them on in lists.
+
+  When events are dispatched from several threads, the batch is given a lock
+  to guard its list with. The handler itself is called outside the lock.
+  """
+
+  def __init__(self, handler, batch_size, lock=None):
+    self._handler = handler
+    self._batch_size = batch_size
+    self._lock = lock
+    self._events = []
+
+  def Add(self, event_obj):
+    if self._lock is not None:
+      with self._lock:
+        events = self._events
+        events.append(event_obj)
+        if len(events) < self._batch_size:
+          return
+        self._events = []
+      self._handler(events)
+      return
+
+    events = self._events
+    events.append(event_obj)
+    if len(events) >= self._batch_size:
+      self.Flush()
+
+  def Flush(self):
+    if self._lock is not None:
+      with self._lock:
+        events, self._events = self._events, []
+    else:
+      events = self._events
+      self._events = []
+    if events:
+      self._handler(events)
+
+
 class MetaEventConsumer(type):
   """Meta class for TraceConsumer.
 
@@ -48,21 +175,28 @@ class MetaEventConsumer(type):
   for functions that have an event_info property and assigns them to a map.
   The map is then assigned to the subclass type. It also handles a hierarchy
   of consumers and will register event handlers defined in parent classes
-  for the given sub class.
+  for the given sub class. Batch event handlers go to a map of their own.
   """
   def __new__(cls, name, bases, dict):
     """Create a new TraceConsumer class type."""
     event_handler_map = defaultdict(list)
+    batch_handler_map = defaultdict(list)
     for base in bases:
       base_map = getattr(base, 'event_handler_map', None)
       if base_map:
         event_handler_map.update(base_map)
+      base_map = getattr(base, 'batch_handler_map', None)
+      if base_map:
+        batch_handler_map.update(base_map)
     for v in dict.values():
       event_infos = getattr(v, 'event_infos', [])
       for event_info in event_infos:
         event_handler_map[event_info].append(v)
+      for event_info in getattr(v, 'batch_event_infos', []):
+        batch_handler_map[event_info].append(v)
     new_type = type.__new__(cls, name, bases, dict)
     new_type.event_handler_map = event_handler_map
+    new_type.batch_handler_map = batch_handler_map
     return new_type
 
 
@@ -78,11 +212,46 @@ class EventConsumer(object):
   to handle events. One or more event handler instances can then be passed to a
   LogConsumer, which will dispatch log events to them during log consumption.
 
+  Handlers decorated with BatchEventHandler instead receive lists of events:
+
+  @BatchEventHandler(module.Event.EventName, batch_size=1000)
+  def OnEventNames(self, events):
+    pass
+
   Note that if any handler raises an exception, the exception will be logged,
   and log parsing will be terminated as soon as possible.
+
+  Consumers whose handlers don't depend on the order of events can set
+  order_independent to True, and implement Reduce. A parallel event source
+  may then run a copy of the consumer on each part of a log, and combine the
+  copies with Reduce at the end.
   """
   __metaclass__ = MetaEventConsumer
 
+  order_independent = False
+
+  def Reduce(self, consumers):
+    """Combines the state of copies of this consumer into this consumer.
+
+    Args:
+      consumers: a list of copies of this consumer, each of which has handled
+          the events of a different part of the log.
+    """
+    raise NotImplementedError('Order independent consumers must implement '
+                              'Reduce.')
+
+  def ProcessBuffer(self, session, buffer):
+    """Called after the events of each buffer have been dispatched.
+
+    Consumers that hold on to events can override this to pass them on at
+    buffer boundaries. The default implementation does nothing.
+
+    Args:
+      session: the session the buffer was read from.
+      buffer: the buffer, as passed to TraceEventSource.ProcessBuffer.
+    """
+    pass
+
 
 class _TraceLogSession(object):
   """An internal implementation class that wraps an open event trace session.
@@ -108,6 +277,7 @@ class _TraceLogSession(object):
     self._start_time = None
     self._processed_first_event = False
     self.is_64_bit_log = False
+    self.is_realtime = False
 
   def SessionTimeToTime(self, session_time):
     """Convert a raw time value from this session to a python time value.
@@ -145,6 +315,7 @@ class _TraceLogSession(object):
     else:
       logfile.EventCallback = self._event_callback
     self._handle = evntrace.OpenTrace(byref(logfile))
+    self.is_realtime = True
     self._ProcessHeader(logfile.LogfileHeader)
 
   def OpenFileSession(self, path):
@@ -212,6 +383,78 @@ class _TraceLogSession(object):
     except:
       logging.exception('Exception in _ProcessEventRecordCallback')
 
+class EventFilter(object):
+  """Selects events by their header fields, before their payload is decoded.
+
+  Each criterion that's left as None accepts all events. An event must meet
+  all the other criteria to be dispatched.
+  """
+
+  def __init__(self, process_ids=None, thread_ids=None, start_time=None,
+               end_time=None, providers=None, max_level=None, keywords=None):
+    """Creates a filter.
+
+    Args:
+      process_ids: the set of process IDs to accept.
+      thread_ids: the set of thread IDs to accept.
+      start_time: the earliest time stamp to accept, in seconds since 1970.
+      end_time: the time stamp to accept events up to, exclusively, in
+          seconds since 1970.
+      providers: the set of provider GUIDs, in registry format, to accept.
+      max_level: the highest (least severe) level to accept. Events with
+          level 0 are always accepted.
+      keywords: the keyword mask to accept. Events that match any of the
+          keywords are accepted, as are events without keywords. This only
+          applies to events delivered as an EVENT_RECORD or read from a log
+          file.
+    """
+    self.process_ids = process_ids and frozenset(process_ids)
+    self.thread_ids = thread_ids and frozenset(thread_ids)
+    self.start_time = start_time
+    self.end_time = end_time
+    self.providers = providers and frozenset(etl.GuidToBytes(guid)
+                                             for guid in providers)
+    self.max_level = max_level
+    self.keywords = keywords
+
+  def Match(self, session, raw_guid, level, keyword, process_id, thread_id,
+            time_stamp):
+    """Returns whether an event passes this filter.
+
+    Args:
+      session: the session the event arrived on.
+      raw_guid: the 16 bytes of the event's provider GUID.
+      level: the level of the event.
+      keyword: the keyword of the event, or None if it doesn't have any.
+      process_id: the ID of the process that generated the event.
+      thread_id: the ID of the thread that generated the event.
+      time_stamp: the raw time stamp of the event.
+    """
+    if self.process_ids is not None and process_id not in self.process_ids:
+      return False
+    if self.thread_ids is not None and thread_id not in self.thread_ids:
+      return False
+    if self.providers is not None and raw_guid not in self.providers:
+      return False
+    if self.max_level is not None and level > self.max_level:
+      return False
+    if self.keywords is not None and keyword and not keyword & self.keywords:
+      return False
+    if self.start_time is not None or self.end_time is not None:
+      time_stamp = session.SessionTimeToTime(time_stamp)
+      if self.start_time is not None and time_stamp < self.start_time:
+        return False
+      if self.end_time is not None and time_stamp >= self.end_time:
+        return False
+    return True
+
+  def MatchRecord(self, session, record):
+    """Returns whether an etl.EventRecord read from session passes."""
+    return self.Match(session, record.provider_id, record.level,
+                      record.keyword, record.process_id, record.thread_id,
+                      record.time_stamp)
+
+
 class TraceEventSource(object):
   """An Event Tracing for Windows consumer class.
 
@@ -226,9 +469,17 @@ class TraceEventSource(object):
 
   Note that each TraceEventSource can at most consume a single real time
   session, and no more than 63 sessions overall.
+
+  An EventFilter set with SetFilter rejects events on their header alone,
+  before an EventClass is constructed or their payload is decoded. An
+  instrumentation.TraceStatistics set with SetStatistics counts the events,
+  buffers, and the time spent decoding and handling them, and a
+  profiler.HandlerProfiler set with SetProfiler profiles each handler and
+  decoder.
   """
 
-  def __init__(self, handlers=[], raw_time=False, new_format=True):
+  def __init__(self, handlers=[], raw_time=False, new_format=True,
+               lazy=False):
     """Creates an idle consumer.
 
     Args:
@@ -236,13 +487,27 @@ class TraceEventSource(object):
           Each handler should be an object derived from EventConsumer.
       raw_time: if True, consume logs with the raw time option. This allows
           converting stamps recorded in events to wall-clock time.
+      lazy: if True, the events handed to the handlers decode their fields
+          the first time they're read, rather than up front.
     """
     self._stop = False
     self._handlers = handlers[:]
     self._raw_time = raw_time
     self._new_format = new_format
+    self._lazy = lazy
     self._trace_sessions = []
     self._handler_cache = dict()
+    # The _EventBatch of each batch handler in the handler cache, and the
+    # lock they're given if events are dispatched from several threads.
+    self._batches = []
+    self._batch_lock = None
+    # Maps (raw guid, version, kind) to (EventClass, handler list) for the
+    # events that have both, or None until it's built.
+    self._dispatch_index = None
+    self._filter = None
+    self._statistics = None
+    self._profiler = None
+    self._profile_output = None
 
   def __del__(self):
     """Clean up any trace sessions we have open."""
@@ -255,8 +520,37 @@ class TraceEventSource(object):
       handler: the handler to add.
     """
     self._handlers.append(handler)
-    # Clear our handler cache.
-    self._handler_cache.clear()
+    self._ClearHandlerCache()
+
+  def SetFilter(self, event_filter):
+    """Sets the filter that events must pass to be dispatched.
+
+    Args:
+      event_filter: an EventFilter, or None to dispatch all events.
+    """
+    self._filter = event_filter
+
+  def SetStatistics(self, statistics):
+    """Sets the statistics that count the events and time their handling.
+
+    Args:
+      statistics: an instrumentation.TraceStatistics, or None to stop
+          counting.
+    """
+    self._statistics = statistics
+    self._ClearHandlerCache()
+
+  def SetProfiler(self, profiler, output=None):
+    """Sets the profiler that profiles the handlers and decoders.
+
+    Args:
+      profiler: a profiler.HandlerProfiler, or None to stop profiling.
+      output: if not None, a file the profile is printed to when the source
+          is closed.
+    """
+    self._profiler = profiler
+    self._profile_output = output
+    self._ClearHandlerCache()
 
   def OpenRealtimeSession(self, name):
     """Open a trace session named "name".
@@ -284,6 +578,14 @@ class TraceEventSource(object):
     Note: if any of the open sessions are realtime sessions, this function
       will not return until Close() is called to close the realtime session.
     """
+    self._ProcessTrace()
+    try:
+      self._FlushBatches()
+    except:
+      logging.exception("Exception in batch handler")
+      self._stop = True
+
+  def _ProcessTrace(self):
     handles = (evntrace.TRACEHANDLE *
                len(self._trace_sessions))()
 
@@ -296,11 +598,16 @@ class TraceEventSource(object):
                           None)
 
   def Close(self):
-    """Close all open trace sessions."""
+    """Close all open trace sessions, and print the profile if asked to."""
     while len(self._trace_sessions):
       session = self._trace_sessions.pop()
       session.Close()
 
+    if self._profile_output is not None:
+      output = self._profile_output
+      self._profile_output = None
+      profiler.PrintProfile(self._profiler, output=output)
+
   def ProcessEvent(self, session, event_trace):
     """Process a single event.
 
@@ -312,19 +619,24 @@ class TraceEventSource(object):
       session: the _TraceLogSession on which this event occurred.
       event_trace: a POINTER(EVENT_TRACE) for the current event.
     """
-    header = event_trace.contents.Header
-    guid = str(header.Guid)
-    version = header.Class.Version
-    kind = header.Class.Type
-
-    # Look for a handler and EventClass for the event.
-    event_class = event.EventClass.Get(guid, version, kind)
-    if event_class:
-      handlers = self._GetHandlers(guid, kind)
-      if handlers:
-        event_obj = event_class(session, event_trace)
-        for handler in handlers:
-          handler(event_obj)
+    event_filter = self._filter
+    if event_filter is None:
+      kind, version, guid = _EVENT_TRACE_KEY.unpack(
+          string_at(event_trace, _EVENT_TRACE_KEY.size))
+    else:
+      (kind, level, version, thread_id, process_id, time_stamp,
+       guid) = _EVENT_TRACE_FILTER_KEY.unpack(
+          string_at(event_trace, _EVENT_TRACE_FILTER_KEY.size))
+    entry = self._GetDispatchIndex().get((guid, version, kind), None)
+    if entry and event_filter is not None:
+      if not event_filter.Match(session, guid, level, None, process_id,
+                                thread_id, time_stamp):
+        return
+    if entry:
+      event_class, handlers = entry
+      event_obj = event_class(session, event_trace, self._lazy)
+      for handler in handlers:
+        handler(event_obj)
 
   def ProcessEventRecord(self, session, event_record):
     """Process a single event.
@@ -337,31 +649,65 @@ class TraceEventSource(object):
       session: the _TraceLogSession on which this event occurred.
       event_trace: a POINTER(EVENT_RECORD) for the current event.
     """
-    header = event_record.contents.EventHeader
-    guid = str(header.ProviderId)
-    version = header.EventDescriptor.Version
-    kind = header.EventDescriptor.Id
-
-    # Look for a handler and EventClass for the event.
-    event_class = event.EventClass.Get(guid, version, kind)
-    if event_class:
-      handlers = self._GetHandlers(guid, kind)
-      if handlers:
-        event_obj = event_class(session, event_record)
-        for handler in handlers:
-          handler(event_obj)
+    event_filter = self._filter
+    if event_filter is None:
+      guid, kind, version = _EVENT_RECORD_KEY.unpack(
+          string_at(event_record, _EVENT_RECORD_KEY.size))
+    else:
+      (thread_id, process_id, time_stamp, guid, kind, version, level,
+       keyword) = _EVENT_RECORD_FILTER_KEY.unpack(
+          string_at(event_record, _EVENT_RECORD_FILTER_KEY.size))
+    entry = self._GetDispatchIndex().get((guid, version, kind), None)
+    if entry and event_filter is not None:
+      if not event_filter.Match(session, guid, level, keyword, process_id,
+                                thread_id, time_stamp):
+        return
+    if entry:
+      event_class, handlers = entry
+      event_obj = event_class(session, event_record, self._lazy)
+      for handler in handlers:
+        handler(event_obj)
+
+  def ProcessEtlEvent(self, session, record):
+    """Process a single event read from a log file.
+
+    Retrieve the guid, version and type from the event and try to find a handler
+    for the event and event class that can parse the event data. If both exist,
+    dispatch the event object to the handler.
+
+    Args:
+      session: the etl.EtlFile from which this event was read.
+      record: an etl.EventRecord for the current event.
+    """
+    entry = self._GetDispatchIndex().get(
+        (record.provider_id, record.version, record.event_type), None)
+    if entry and self._filter is not None:
+      if not self._filter.MatchRecord(session, record):
+        return
+    if entry:
+      event_class, handlers = entry
+      event_obj = event_class(session, record, self._lazy)
+      for handler in handlers:
+        handler(event_obj)
 
   def ProcessBuffer(self, session, buffer):
     """Process a buffer.
 
+    The default implementation passes the buffer on to the ProcessBuffer
+    method of each handler.
+
     Args:
       session: the _TraceLogSession on which this event occurred.
       event: a POINTER(TRACE_EVENT) for the current event.
     """
-    pass
+    for handler in self._handlers:
+      handler.ProcessBuffer(session, buffer)
 
   def _ProcessBufferCallback(self, session, buffer):
+    if self._statistics is not None:
+      self._statistics.CountBuffer()
     try:
+      self._FlushBatches()
       self.ProcessBuffer(session, buffer)
     except:
       # Terminate parsing on exception.
@@ -399,16 +745,230 @@ class TraceEventSource(object):
       logging.exception("Exception in ProcessEventRecord, terminating parsing")
       self._stop = True
 
+  def _ProcessEtlEventCallback(self, session, record):
+    # Don't process the event if we're stopping. Note that we can only
+    # terminate the processing once a whole buffer has been processed.
+    if self._stop:
+      return
+
+    try:
+      self.ProcessEtlEvent(session, record)
+    except:
+      # Terminate parsing on exception.
+      logging.exception("Exception in ProcessEtlEvent, terminating parsing")
+      self._stop = True
+
+  def _GetDispatchIndex(self):
+    """Returns the map from (raw guid, version, kind) to the event class and
+    handlers of the events that have both.
+
+    The map is built on first use after handlers are added, so that events
+    can be dispatched without formatting their GUID as a string. Events that
+    aren't in the map are skipped without constructing an EventClass. With
+    statistics or a profiler set, the event classes are wrapped to count and
+    time their decoding.
+    """
+    index = self._dispatch_index
+    if index is None:
+      index = {}
+      instruments = self._GetInstruments()
+      for (guid, version, kind), event_class in event.EventClass.GetAll():
+        handlers = self._GetHandlers(guid, kind)
+        if handlers:
+          key = (etl.GuidToBytes(guid), version, kind)
+          if instruments:
+            # Name the class before it's wrapped, as the wrappers have no
+            # name of their own.
+            name = instrumentation.GetDecoderName(event_class, version)
+            for instrument in instruments:
+              event_class = instrument.WrapDecoder(key, event_class, name)
+          index[key] = event_class, handlers
+      self._dispatch_index = index
+    return index
+
+  def _GetInstruments(self):
+    """Returns the statistics and profiler that are set, innermost first."""
+    return [instrument for instrument in (self._profiler, self._statistics)
+            if instrument is not None]
+
+  def _WrapHandler(self, handler, instruments):
+    """Returns a bound handler method wrapped by each instrument."""
+    if instruments:
+      name = instrumentation.GetHandlerName(handler)
+      for instrument in instruments:
+        handler = instrument.WrapHandler(handler, name)
+    return handler
+
+  def _ClearHandlerCache(self):
+    """Clears the handler cache, passing on the events collected by the
+    batches in it."""
+    self._FlushBatches()
+    self._batches = []
+    self._handler_cache.clear()
+    self._dispatch_index = None
+
+  def _FlushBatches(self):
+    """Passes the events collected for batch handlers on to them."""
+    for batch in self._batches:
+      batch.Flush()
+
   def _GetHandlers(self, guid, kind):
+    """Returns the bound handler methods for an event.
+
+    The handler lists are computed once per (guid, kind) and cached until a
+    handler is added. Events without handlers are cached as an empty tuple.
+    Batch handlers are represented by the Add method of their _EventBatch.
+    With statistics or a profiler set, the handlers are wrapped to count and
+    time their calls.
+    """
     key = (guid, kind)
     handler_list = self._handler_cache.get(key, None)
     if handler_list != None:
       return handler_list
 
     # We didn't cache this already.
+    instruments = self._GetInstruments()
     handler_list = []
     for handler_instance in self._handlers:
       for handler_func in handler_instance.event_handler_map.get(key, []):
-        handler_list.append(_BindHandler(handler_func, handler_instance))
-
+        handler = self._WrapHandler(handler_func.__get__(handler_instance),
+                                    instruments)
+        handler_list.append(handler)
+      for handler_func in handler_instance.batch_handler_map.get(key, []):
+        handler = self._WrapHandler(handler_func.__get__(handler_instance),
+                                    instruments)
+        batch = _EventBatch(handler, handler_func.batch_size,
+                            self._batch_lock)
+        self._batches.append(batch)
+        handler_list.append(batch.Add)
+
+    handler_list = tuple(handler_list)
+    self._handler_cache[key] = handler_list
     return handler_list
+
+
+class TraceCancelledError(RuntimeError):
+  """A custom error to throw when log consumption is terminated early."""
+
+
+class EtlFileEventSource(TraceEventSource):
+  """A trace consumer class that reads log files without the ETW APIs.
+
+  This class dispatches events to EventConsumers exactly like TraceEventSource,
+  but parses the log files itself rather than going through OpenTrace and
+  ProcessTrace. This allows consuming .etl files on hosts where advapi32 is not
+  available. Real time sessions are not supported.
+
+  Note that events are delivered in file order, one buffer at a time, rather
+  than in strict time stamp order across processors, unless the source is
+  created with time_ordered set.
+  """
+
+  def __init__(self, handlers=[], raw_time=False, use_mmap=False, lazy=False,
+               time_ordered=False, read_ahead=etl.DEFAULT_READ_AHEAD):
+    """Creates an idle consumer.
+
+    Args:
+      handlers: an optional list of handlers to consume the log(s).
+          Each handler should be an object derived from EventConsumer.
+      raw_time: if True, consume logs with the raw time option. This allows
+          converting stamps recorded in events to wall-clock time.
+      use_mmap: if True, memory map the log files rather than reading them
+          a buffer at a time.
+      lazy: if True, the events handed to the handlers decode their fields
+          the first time they're read, rather than up front.
+      time_ordered: if True, merge the events of all open sessions into a
+          single stream in time stamp order. See etl.MergeEvents.
+      read_ahead: the number of events read ahead in each session when
+          merging them.
+    """
+    super(EtlFileEventSource, self).__init__(handlers, raw_time, lazy=lazy)
+    self._use_mmap = use_mmap
+    self._time_ordered = time_ordered
+    self._read_ahead = read_ahead
+
+  def OpenRealtimeSession(self, name):
+    """Real time sessions can't be consumed without the ETW APIs."""
+    raise NotImplementedError('Real time sessions are not supported.')
+
+  def OpenFileSession(self, path, start_time=None, end_time=None,
+                      events=None):
+    """Open a file session for the file at "path".
+
+    When a time range or a list of events is given, only the buffers of the
+    file that may hold matching events are read. They are found with the
+    file's etl_index sidecar, which is built on first use. The buffers found
+    can also hold other events, so use SetFilter to get exact results.
+
+    Args:
+      path: relative or absolute path to the file to open.
+      start_time: if not None, the start of the time range to read, in
+          seconds since 1.1.1970.
+      end_time: if not None, the end of the time range to read.
+      events: if not None, a list of (guid, event_type) tuples of the events
+          to read, such as image.Event.Load.
+    """
+    session = etl.EtlFile(path, self._raw_time, self._use_mmap)
+    if start_time is not None or end_time is not None or events is not None:
+      try:
+        index = etl_index.GetIndex(path)
+      except:
+        session.Close()
+        raise
+      session.SelectBuffers(index.FindBuffers(start_time, end_time, events))
+    self._trace_sessions.append(session)
+
+  def IterEvents(self):
+    """Iterates the events of all open sessions, without dispatching them.
+
+    Events that don't pass the filter set with SetFilter are skipped.
+
+    Yields:
+      (session, record) tuples, where session is the etl.EtlFile the
+      etl.EventRecord record was read from.
+    """
+    event_filter = self._filter
+    for session, record in self._IterAllEvents():
+      if event_filter is None or event_filter.MatchRecord(session, record):
+        yield session, record
+
+  def _IterAllEvents(self):
+    if self._time_ordered:
+      for session, record in etl.MergeEvents(self._trace_sessions,
+                                             self._read_ahead):
+        yield session, record
+      return
+
+    for session in self._trace_sessions:
+      for record in session.IterEvents():
+        yield session, record
+
+  def Consume(self):
+    """Consume all open sessions.
+
+    Raises:
+      TraceCancelledError: processing was terminated by an exception in a
+          handler.
+    """
+    if self._time_ordered:
+      # The events of a buffer aren't delivered together, so there are no
+      # buffer callbacks.
+      for session, record in self._IterAllEvents():
+        self._ProcessEtlEventCallback(session, record)
+        if self._stop:
+          raise TraceCancelledError('Processing of %s was cancelled.' %
+                                    session.path)
+    else:
+      for session in self._trace_sessions:
+        for etl_buffer in session.IterBuffers():
+          for record in etl_buffer.IterEvents():
+            self._ProcessEtlEventCallback(session, record)
+          if not self._ProcessBufferCallback(session, etl_buffer):
+            raise TraceCancelledError('Processing of %s was cancelled.' %
+                                      session.path)
+
+    try:
+      self._FlushBatches()
+    except:
+      logging.exception("Exception in batch handler, terminating parsing")
+      raise TraceCancelledError('Processing was cancelled.')
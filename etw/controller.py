@@ -115,6 +115,24 @@ class TraceController(object):
                           properties.get(),
                           evntrace.EVENT_TRACE_CONTROL_STOP)
 
+  def Query(self, properties = None):
+    """Query the current trace session.
+
+    Args:
+      properties: if provided, receives the session's properties.
+
+    Returns:
+      The TraceProperties holding the session's current properties, such
+      as the number of events and buffers lost so far.
+    """
+    if properties == None:
+      properties = TraceProperties()
+    evntrace.ControlTrace(self.session,
+                          None,
+                          properties.get(),
+                          evntrace.EVENT_TRACE_CONTROL_QUERY)
+    return properties
+
   def EnableProvider(self, provider, level, flags = None):
     """Enable provider at level with flags.
 
@@ -142,3 +160,25 @@ class TraceController(object):
   def _Cleanup(self):
     if self.session:
       self.Stop()
+
+
+def QueryTrace(name, properties = None):
+  """Query a running trace session by name.
+
+  This also works for sessions started by other processes, such as a
+  realtime session being consumed by a TraceEventSource.
+
+  Args:
+    name: the name of the trace session.
+    properties: if provided, receives the session's properties.
+
+  Returns:
+    The TraceProperties holding the session's current properties.
+  """
+  if properties == None:
+    properties = TraceProperties()
+  evntrace.ControlTrace(evntrace.TRACEHANDLE(),
+                        name,
+                        properties.get(),
+                        evntrace.EVENT_TRACE_CONTROL_QUERY)
+  return properties
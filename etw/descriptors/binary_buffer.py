@@ -12,12 +12,22 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-"""Helper classes for reading binary buffers."""
+"""Helper classes for reading binary buffers.
+
+BinaryBufferReader reads from a buffer given by its address in memory, as
+handed out by the native ETW consumer APIs. BinaryDataReader reads the same
+values from a python string, bytearray, mmap or memoryview, and decodes them
+with precompiled struct formats rather than through ctypes pointers.
+
+Both readers can share the strings and SIDs they decode through an
+InternTable set with SetInternTable. The same file names and SIDs recur
+throughout a trace, so the events then hold references to one copy of each
+value rather than a copy per event.
+"""
 import ctypes
-import pywintypes
-
-ctypes.windll.advapi32.IsValidSid.argtypes = [ctypes.c_void_p]
-ctypes.windll.advapi32.GetLengthSid.argtypes = [ctypes.c_void_p]
+import struct
+import threading
+import weakref
 
 
 class BufferOverflowError(RuntimeError):
@@ -28,6 +38,252 @@ class BufferDataError(RuntimeError):
     """A custom error to throw when the buffer contains invalid data."""
 
 
+class Sid(object):
+    """A security identifier, decoded from its binary form.
+
+    A SID is a revision byte, a sub authority count byte, a 48 bit big endian
+    identifier authority and that many 32 bit little endian sub authorities.
+    Sids compare and hash by their binary form, and are interned: the readers
+    return the same Sid object for every occurrence of a binary form, so the
+    many identical SIDs of a trace share one object, and its string form is
+    built once. When an InternTable is set, Sids are interned in it instead.
+
+    Attributes:
+      data: the binary form of the SID, as a string.
+    """
+    __slots__ = ('data', '_string', '__weakref__')
+
+    # The revision of all SIDs, the size of a SID without sub authorities,
+    # and the maximum number of sub authorities of a SID, from winnt.h.
+    REVISION = 1
+    MINIMUM_SIZE = 8
+    MAX_SUB_AUTHORITIES = 15
+
+    # The interned Sids by binary form. They're held weakly, so a Sid is
+    # only kept while events refer to it, and a long running consumer
+    # doesn't collect every SID it has seen.
+    _interned = weakref.WeakValueDictionary()
+
+    def __init__(self, data):
+        self.data = str(data)
+        self._string = None
+
+    @classmethod
+    def Intern(cls, data):
+        """Returns the interned Sid of a binary form.
+
+        Args:
+          data: the binary form of the SID, as a string.
+        """
+        sid = cls._interned.get(data)
+        if sid is None:
+            sid = cls(data)
+            # Another thread may have interned the same SID meanwhile.
+            sid = cls._interned.setdefault(data, sid)
+        return sid
+
+    @classmethod
+    def GetSize(cls, revision, sub_authority_count):
+        """Returns the size of a SID, given its first two bytes.
+
+        Raises:
+          BufferDataError: the bytes are not those of a valid SID.
+        """
+        if (revision != cls.REVISION or
+            sub_authority_count > cls.MAX_SUB_AUTHORITIES):
+            raise BufferDataError('Invalid SID.')
+        return cls.MINIMUM_SIZE + 4 * sub_authority_count
+
+    def IsValid(self):
+        """Returns whether the binary form is that of a valid SID."""
+        if len(self.data) < self.MINIMUM_SIZE:
+            return False
+        revision, sub_authority_count = struct.unpack_from('<BB', self.data)
+        try:
+            return self.GetSize(revision, sub_authority_count) == len(self.data)
+        except BufferDataError:
+            return False
+
+    def GetLength(self):
+        return len(self.data)
+
+    def GetSubAuthorityCount(self):
+        return ord(self.data[1])
+
+    def GetSidIdentifierAuthority(self):
+        """Returns the identifier authority, as a tuple of 6 bytes."""
+        return struct.unpack_from('6B', self.data, 2)
+
+    def GetSubAuthority(self, index):
+        if not 0 <= index < self.GetSubAuthorityCount():
+            raise IndexError('Sub authority index out of range.')
+        offset = self.MINIMUM_SIZE + 4 * index
+        return struct.unpack_from('<I', self.data, offset)[0]
+
+    def __str__(self):
+        """Returns the string form of the SID, such as S-1-5-18."""
+        if self._string is None:
+            high, low = struct.unpack_from('>HI', self.data, 2)
+            authority = (high << 32) | low
+            # Authorities that don't fit in 32 bits are written in hex.
+            if high:
+                parts = ['S', str(ord(self.data[0])), '0x%012X' % authority]
+            else:
+                parts = ['S', str(ord(self.data[0])), str(authority)]
+            parts.extend(str(self.GetSubAuthority(i))
+                         for i in xrange(self.GetSubAuthorityCount()))
+            self._string = '-'.join(parts)
+        return self._string
+
+    def __unicode__(self):
+        return unicode(str(self))
+
+    def __repr__(self):
+        return 'Sid(%s)' % self
+
+    def __eq__(self, other):
+        return isinstance(other, Sid) and self.data == other.data
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.data)
+
+
+# The default maximum number of values an InternTable holds.
+DEFAULT_INTERN_TABLE_SIZE = 65536
+
+# The kinds of values in an InternTable, which keep apart equal raw bytes
+# that decode to different values.
+_INTERN_STRING = 0
+_INTERN_WSTRING = 1
+_INTERN_SID = 2
+# The wide strings of BinaryBufferReader, which are keyed by their value.
+_INTERN_WSTRING_VALUE = 3
+
+
+class InternTable(object):
+    """A bounded table of decoded values, keyed by their raw bytes.
+
+    The table keeps the values it has seen most recently, and evicts the
+    least recently used one when it's full. It's shared by all the readers of
+    a process, so it's safe to use from several threads.
+
+    Attributes:
+      max_size: the maximum number of values held.
+      hits: the number of values found in the table.
+      misses: the number of values decoded and added to the table.
+      evictions: the number of values evicted from the table.
+    """
+
+    # The values are held in [previous, next, key, value] links of a circular
+    # list, from the least to the most recently used, and are found by key in
+    # _links. This is the layout of functools.lru_cache: the OrderedDict of
+    # python 2 is written in python, and moving its entries takes several
+    # times longer than decoding most strings.
+
+    def __init__(self, max_size=DEFAULT_INTERN_TABLE_SIZE):
+        """Creates an empty table.
+
+        Raises:
+          ValueError: max_size is less than 1.
+        """
+        if max_size < 1:
+            raise ValueError('An InternTable must hold at least one value.')
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self.Clear()
+
+    def __len__(self):
+        return len(self._links)
+
+    @property
+    def hit_rate(self):
+        """The fraction of the values looked up that were found."""
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def Intern(self, kind, raw, decode):
+        """Returns the interned value of raw bytes.
+
+        Args:
+          kind: the kind of the value, which is part of its key.
+          raw: the raw bytes of the value, as a string.
+          decode: the function that decodes raw into the value, called if the
+            value isn't in the table.
+        """
+        key = (kind, raw)
+        with self._lock:
+            root = self._root
+            link = self._links.get(key)
+            if link is not None:
+                self.hits += 1
+                last = root[0]
+                if link is not last:
+                    # Move the link to the most recently used end.
+                    previous, next = link[0], link[1]
+                    previous[1] = next
+                    next[0] = previous
+                    last[1] = root[0] = link
+                    link[0] = last
+                    link[1] = root
+                return link[3]
+
+            self.misses += 1
+            value = decode(raw)
+            if len(self._links) >= self.max_size:
+                oldest = root[1]
+                root[1] = oldest[1]
+                oldest[1][0] = root
+                del self._links[oldest[2]]
+                self.evictions += 1
+            last = root[0]
+            link = [last, root, key, value]
+            last[1] = root[0] = link
+            self._links[key] = link
+            return value
+
+    def Clear(self):
+        """Removes all values, and resets the statistics."""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self._links = {}
+            root = []
+            root[:] = [root, root, None, None]
+            self._root = root
+
+
+_intern_table = None
+
+
+def SetInternTable(table):
+    """Sets the table the readers intern strings and SIDs in.
+
+    Args:
+      table: an InternTable, or None to stop interning.
+    """
+    global _intern_table
+    _intern_table = table
+
+
+def GetInternTable():
+    """Returns the table set with SetInternTable, or None."""
+    return _intern_table
+
+
+def _DecodeWString(raw):
+    return raw.decode('utf-16-le')
+
+
+def _Identity(value):
+    return value
+
+
 class BinaryBuffer(object):
     """A utility class to wrap a binary buffer.
 
@@ -149,6 +405,23 @@ class BinaryBufferReader(object):
             raise BufferOverflowError()
         self._offset += length
 
+    def Unpack(self, struct_type):
+        """Unpacks a struct from the current offset in the buffer.
+
+        Args:
+          struct_type: A struct.Struct that describes the values to read.
+
+        Returns:
+          The tuple of values read.
+
+        Raises:
+          BufferOverflowError: The struct extends past the end of the buffer.
+        """
+        size = struct_type.size
+        data = ctypes.string_at(self._buffer.GetAt(self._offset, size), size)
+        self.Consume(size)
+        return struct_type.unpack(data)
+
     def Read(self, data_type):
         """Reads the value of the data type from the current offset in the buffer.
 
@@ -193,17 +466,28 @@ class BinaryBufferReader(object):
     def ReadString(self):
         val = self._buffer.GetStringAt(self._offset)
         self.Consume(len(val) + ctypes.sizeof(ctypes.c_char))
+        table = _intern_table
+        if table is not None:
+            val = table.Intern(_INTERN_STRING, val, _Identity)
         return val
 
     def ReadWString(self):
         val = self._buffer.GetWStringAt(self._offset)
-        self.Consume(len(val) + ctypes.sizeof(ctypes.c_wchar))
+        self.Consume((len(val) + 1) * ctypes.sizeof(ctypes.c_wchar))
+        table = _intern_table
+        if table is not None:
+            # ctypes decodes wide strings straight from memory, so they're
+            # keyed by their value.
+            val = table.Intern(_INTERN_WSTRING_VALUE, val, _Identity)
         return val
 
     def ReadCountedWString(self):
         str_length = self.ReadUInt16() / ctypes.sizeof(ctypes.c_wchar)
         val = self._buffer.GetWStringAt(self._offset, str_length)
         self.Consume(len(val) * ctypes.sizeof(ctypes.c_wchar))
+        table = _intern_table
+        if table is not None:
+            val = table.Intern(_INTERN_WSTRING_VALUE, val, _Identity)
         return val
 
     def ReadCountedBlob(self):
@@ -211,8 +495,6 @@ class BinaryBufferReader(object):
         val = "".join([chr(self.ReadUInt8()) for i in xrange(blob_length)])
         return val
 
-    _MINIMUM_SID_SIZE = 8
-
     def ReadSid(self, is_64_bit_ptrs):
         """Reads a SID from the current offset in the buffer.
 
@@ -220,7 +502,7 @@ class BinaryBufferReader(object):
           is_64_bit_ptrs: Whether the current buffer contains 64 bit pointers.
 
         Returns:
-          The SID at the current offset in the buffer.
+          The interned Sid at the current offset in the buffer.
 
         Raises:
           BufferDataError: Raised if the buffer does not contain a valid SID at
@@ -240,11 +522,281 @@ class BinaryBufferReader(object):
         # Ignore the second pointer.
         ignore = ReadPtr()
 
-        data = self._buffer.GetAt(self._offset, self._MINIMUM_SID_SIZE)
-        if not ctypes.windll.advapi32.IsValidSid(data):
-            raise BufferDataError('Invalid SID.')
-        sid_len = ctypes.windll.advapi32.GetLengthSid(data)
+        data = self._buffer.GetAt(self._offset, Sid.MINIMUM_SIZE)
+        revision, sub_authority_count = struct.unpack(
+            '<BB', ctypes.string_at(data, 2))
+        sid_len = Sid.GetSize(revision, sub_authority_count)
+        data = self._buffer.GetAt(self._offset, sid_len)
         self.Consume(sid_len)
 
         sid_buffer = ctypes.string_at(data, sid_len)
-        return pywintypes.SID(sid_buffer)
+        table = _intern_table
+        if table is not None:
+            return table.Intern(_INTERN_SID, sid_buffer, Sid)
+        return Sid.Intern(sid_buffer)
+
+
+_INT8 = struct.Struct('<b')
+_UINT8 = struct.Struct('<B')
+_INT16 = struct.Struct('<h')
+_UINT16 = struct.Struct('<H')
+_INT32 = struct.Struct('<i')
+_UINT32 = struct.Struct('<I')
+_INT64 = struct.Struct('<q')
+_UINT64 = struct.Struct('<Q')
+
+# The struct formats that decode the ctypes types accepted by Read.
+_CTYPES_STRUCTS = {
+    ctypes.c_char: struct.Struct('<c'),
+    ctypes.c_byte: _INT8,
+    ctypes.c_ubyte: _UINT8,
+    ctypes.c_short: _INT16,
+    ctypes.c_ushort: _UINT16,
+    ctypes.c_int: _INT32,
+    ctypes.c_uint: _UINT32,
+    ctypes.c_longlong: _INT64,
+    ctypes.c_ulonglong: _UINT64,
+}
+
+# The size of the units of the strings read by ReadWString, which are always
+# UTF-16 in event data, regardless of the size of the host's wchar_t.
+_WCHAR_SIZE = 2
+
+# The number of bytes scanned at a time for the terminator of a string when
+# the data doesn't support find, as is the case for memoryview.
+_SCAN_SIZE = 256
+
+
+class BinaryDataReader(object):
+    """A utility class to help read values from a python buffer object.
+
+    This class provides the same interface as BinaryBufferReader, but reads
+    from a string, bytearray, mmap or memoryview rather than from a memory
+    address. Values are decoded with precompiled struct formats, so reading
+    doesn't allocate intermediate ctypes objects, and works on any platform.
+    """
+
+    def __init__(self, data, offset=0, length=None):
+        """Creates a new binary data reader.
+
+        Args:
+          data: The buffer object to read from.
+          offset: The offset of the data to read in the buffer object.
+          length: The length of the data to read. By default, this extends to
+            the end of the buffer object.
+        """
+        if length is None:
+            length = len(data) - offset
+        if offset < 0 or length < 0 or offset + length > len(data):
+            raise BufferOverflowError()
+        self._data = data
+        self._start = offset
+        self._end = offset + length
+        self._offset = offset
+
+    def Consume(self, length):
+        """Advances the current offset in the buffer by length.
+
+        Args:
+          length: The length to consume.
+
+        Raises:
+          BufferOverflowError: Consuming the specified length will overflow
+          the buffer.
+        """
+        if length < 0 or self._offset + length > self._end:
+            raise BufferOverflowError()
+        self._offset += length
+
+    def Tell(self):
+        """Returns the current offset, relative to the start of the data."""
+        return self._offset - self._start
+
+    def Unpack(self, struct_type):
+        """Unpacks a struct from the current offset in the buffer.
+
+        Args:
+          struct_type: A struct.Struct that describes the values to read.
+
+        Returns:
+          The tuple of values read.
+
+        Raises:
+          BufferOverflowError: The struct extends past the end of the buffer.
+        """
+        offset = self._offset
+        end = offset + struct_type.size
+        if end > self._end:
+            raise BufferOverflowError()
+        self._offset = end
+        return struct_type.unpack_from(self._data, offset)
+
+    def Read(self, data_type):
+        """Reads the value of the data type from the current offset in the buffer.
+
+        Args:
+          data_type: A ctypes type that specifies the data type to get from
+            the buffer.
+
+        Returns:
+          The value of the data type at the current offset in the buffer.
+        """
+        struct_type = _CTYPES_STRUCTS.get(data_type, None)
+        if struct_type:
+            return self.Unpack(struct_type)[0]
+        size = ctypes.sizeof(data_type)
+        val = data_type.from_buffer_copy(self._Slice(self._offset, size)).value
+        self.Consume(size)
+        return val
+
+    def ReadBoolean(self):
+        return self.Unpack(_INT8)[0] != 0
+
+    def ReadInt8(self):
+        return self.Unpack(_INT8)[0]
+
+    def ReadUInt8(self):
+        return self.Unpack(_UINT8)[0]
+
+    def ReadInt16(self):
+        return self.Unpack(_INT16)[0]
+
+    def ReadUInt16(self):
+        return self.Unpack(_UINT16)[0]
+
+    def ReadInt32(self):
+        return self.Unpack(_INT32)[0]
+
+    def ReadUInt32(self):
+        return self.Unpack(_UINT32)[0]
+
+    def ReadInt64(self):
+        return self.Unpack(_INT64)[0]
+
+    def ReadUInt64(self):
+        return self.Unpack(_UINT64)[0]
+
+    def ReadString(self):
+        end = self._Find('\0', 1)
+        val = self._Slice(self._offset, end - self._offset)
+        self._offset = end + 1
+        table = _intern_table
+        if table is not None:
+            val = table.Intern(_INTERN_STRING, val, _Identity)
+        return val
+
+    def ReadWString(self):
+        end = self._Find('\0\0', _WCHAR_SIZE)
+        val = self._Slice(self._offset, end - self._offset)
+        self._offset = end + _WCHAR_SIZE
+        table = _intern_table
+        if table is not None:
+            return table.Intern(_INTERN_WSTRING, val, _DecodeWString)
+        return val.decode('utf-16-le')
+
+    def ReadCountedWString(self):
+        str_length = self.ReadUInt16()
+        str_length -= str_length % _WCHAR_SIZE
+        if self._offset + str_length > self._end:
+            raise BufferOverflowError()
+        val = self._Slice(self._offset, str_length)
+        self._offset += str_length
+        table = _intern_table
+        if table is not None:
+            return table.Intern(_INTERN_WSTRING, val, _DecodeWString)
+        return val.decode('utf-16-le')
+
+    def ReadCountedBlob(self):
+        blob_length = self.ReadUInt32()
+        if self._offset + blob_length > self._end:
+            raise BufferOverflowError()
+        val = self._Slice(self._offset, blob_length)
+        self._offset += blob_length
+        return val
+
+    def ReadSid(self, is_64_bit_ptrs):
+        """Reads a SID from the current offset in the buffer.
+
+        Args:
+          is_64_bit_ptrs: Whether the current buffer contains 64 bit pointers.
+
+        Returns:
+          The interned Sid at the current offset in the buffer.
+
+        Raises:
+          BufferDataError: Raised if the buffer does not contain a valid SID at
+          this offset.
+        """
+        # Two pointers are included before the SID. If the first one is zero,
+        # there is no more data, so read that one first.
+        if is_64_bit_ptrs:
+            ReadPtr = self.ReadUInt64
+        else:
+            ReadPtr = self.ReadUInt32
+
+        has_sid = ReadPtr()
+        if not has_sid:
+            return None
+
+        # Ignore the second pointer.
+        ignore = ReadPtr()
+
+        if self._offset + Sid.MINIMUM_SIZE > self._end:
+            raise BufferOverflowError()
+        revision, sub_authority_count = struct.unpack_from(
+            '<BB', self._data, self._offset)
+        sid_len = Sid.GetSize(revision, sub_authority_count)
+        if self._offset + sid_len > self._end:
+            raise BufferOverflowError()
+
+        sid_buffer = self._Slice(self._offset, sid_len)
+        self._offset += sid_len
+        table = _intern_table
+        if table is not None:
+            return table.Intern(_INTERN_SID, sid_buffer, Sid)
+        return Sid.Intern(sid_buffer)
+
+    def _Slice(self, offset, length):
+        """Returns a copy of length bytes at offset as a string."""
+        val = self._data[offset:offset + length]
+        if isinstance(val, str):
+            return val
+        if isinstance(val, memoryview):
+            return val.tobytes()
+        return str(val)
+
+    def _Find(self, terminator, alignment):
+        """Finds the terminator of the string at the current offset.
+
+        Args:
+          terminator: The terminator to look for. Its length must be the
+            alignment.
+          alignment: The alignment of the terminator relative to the current
+            offset.
+
+        Returns:
+          The offset of the terminator.
+
+        Raises:
+          BufferOverflowError: The terminator is not in the buffer.
+        """
+        data = self._data
+        start = self._offset
+        end = self._end
+        if hasattr(data, 'find'):
+            found = data.find(terminator, start, end)
+            while found != -1 and (found - start) % alignment:
+                found = data.find(terminator, found + 1, end)
+            if found != -1:
+                return found
+        else:
+            # Scan a chunk at a time. The chunks are a multiple of the
+            # alignment, so an aligned terminator never straddles two chunks.
+            for pos in xrange(start, end, _SCAN_SIZE):
+                chunk = self._Slice(pos, min(_SCAN_SIZE, end - pos))
+                found = chunk.find(terminator)
+                while found != -1 and found % alignment:
+                    found = chunk.find(terminator, found + 1)
+                if found != -1:
+                    return pos + found
+        raise BufferOverflowError()
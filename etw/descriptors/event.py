@@ -13,11 +13,171 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """EventClass and EventCategory base classes for Event descriptors."""
+import ctypes
 import inspect
+import struct
+from etw import etl
 from etw.descriptors import binary_buffer
 from etw.evntrace import LP_EVENT_TRACE, LP_EVENT_RECORD
 
 
+class _StructRun(object):
+  """Decodes a run of fixed size fields with a single struct unpack."""
+
+  def __init__(self, names, formats, converters):
+    self._names = tuple(names)
+    self._struct = struct.Struct('<' + ''.join(formats))
+    # (index, name, convert) tuples for the values that need converting.
+    self._converters = tuple((i, names[i], convert)
+                             for i, convert in enumerate(converters)
+                             if convert)
+
+  def ReadValues(self, log_session, reader):
+    """Returns the unconverted values of the fields, as a tuple."""
+    return reader.Unpack(self._struct)
+
+  def Read(self, event_obj, log_session, reader):
+    values = reader.Unpack(self._struct)
+    for name, value in zip(self._names, values):
+      setattr(event_obj, name, value)
+    for index, name, convert in self._converters:
+      setattr(event_obj, name, convert(log_session, values[index]))
+
+
+class _FieldCall(object):
+  """Decodes a single field by calling its field function."""
+
+  def __init__(self, name, field):
+    self._name = name
+    self._field = field
+
+  def ReadValues(self, log_session, reader):
+    """Returns the value of the field, as a one element tuple."""
+    return (self._field(log_session, reader),)
+
+  def Read(self, event_obj, log_session, reader):
+    setattr(event_obj, self._name, self._field(log_session, reader))
+
+
+def _CompileFields(fields, is_64_bit):
+  """Compiles a _fields_ list into a list of decoding steps.
+
+  Each run of consecutive fixed size fields is turned into a single
+  _StructRun, while any other field falls back to a _FieldCall.
+
+  Args:
+    fields: the _fields_ list of an EventClass.
+    is_64_bit: whether to compile for a log with 64 bit pointers.
+
+  Returns:
+    A tuple of _StructRun and _FieldCall objects.
+  """
+  steps = []
+  run = []
+  for name, field in fields:
+    formats = getattr(field, 'struct_formats', None)
+    if formats:
+      run.append((name, formats[is_64_bit], field.convert))
+      continue
+    if run:
+      steps.append(_StructRun(*zip(*run)))
+      run = []
+    steps.append(_FieldCall(name, field))
+  if run:
+    steps.append(_StructRun(*zip(*run)))
+  return tuple(steps)
+
+
+class _LazyLayout(object):
+  """The field offsets used to decode the fields of an event on demand.
+
+  The offset of each field up to and including the first variable size field
+  is known up front. The offsets of the fields that follow it depend on the
+  event data, and are resolved on demand.
+
+  Attributes:
+    fields: a tuple of (name, field, struct or None, convert) tuples.
+    index: a map from field name to its index in fields.
+    offsets: the offset of each field, or None where it depends on the data.
+    first_variable: the index of the first variable size field.
+  """
+
+  def __init__(self, fields, is_64_bit):
+    self.index = {}
+    layout = []
+    offsets = []
+    offset = 0
+    for name, field in fields:
+      formats = getattr(field, 'struct_formats', None)
+      if formats:
+        struct_type = struct.Struct('<' + formats[is_64_bit])
+        convert = field.convert
+      else:
+        struct_type = None
+        convert = None
+      self.index[name] = len(layout)
+      layout.append((name, field, struct_type, convert))
+      offsets.append(offset)
+      if offset is not None:
+        offset = offset + struct_type.size if struct_type else None
+    self.fields = tuple(layout)
+    self.offsets = tuple(offsets)
+    self.first_variable = len(layout)
+    for i, (name, field, struct_type, convert) in enumerate(layout):
+      if not struct_type:
+        self.first_variable = i
+        break
+
+
+def _RestoreEvent(event_class, state):
+  """Recreates an event pickled by EventClass.__reduce__.
+
+  Args:
+    event_class: the EventClass of the event, or the (guid, version,
+        event_type) key it's registered under.
+    state: a tuple of (name, value) tuples for the attributes of the event.
+  """
+  if isinstance(event_class, tuple):
+    event_class = EventClass.Get(*event_class)
+  event_obj = event_class.__new__(event_class)
+  for name, value in state:
+    setattr(event_obj, name, value)
+  return event_obj
+
+
+class MetaEventClass(type):
+  """Meta class for EventClass.
+
+  The purpose of this metaclass is to keep event objects compact. When an
+  EventClass subclass is defined, the __new__ method generates its __slots__
+  from the names in its _fields_, so that its instances don't carry a
+  __dict__. Subclasses that define their own __slots__ are left alone.
+  """
+
+  def __new__(cls, name, bases, attrs):
+    """Create a new EventClass class.
+
+    Args:
+      name: The name of the class to create.
+      bases: The base classes of the class to create.
+      attrs: The attributes of the class to create.
+
+    Returns:
+      A new class with the specified name, base classes and attributes.
+    """
+    if '__slots__' not in attrs:
+      inherited = set()
+      for base in bases:
+        for klass in base.__mro__:
+          inherited.update(klass.__dict__.get('__slots__', ()))
+      slots = []
+      for field_name, field in attrs.get('_fields_', []):
+        if field_name not in inherited and field_name not in slots:
+          slots.append(field_name)
+      attrs['__slots__'] = tuple(slots)
+    return type.__new__(cls, name, bases, attrs)
+
+
 class EventClass(object):
   """Base class for event classes.
 
@@ -33,7 +193,18 @@ class EventClass(object):
   defined in the second half of the tuple. The return value is assigned as a
   named attribute of this class, the name being the first half of the tuple. The
   function in the second half of the tuple should take a TraceLogSession and a
-  BinaryBufferReader as parameters and should return a mixed value.
+  BinaryBufferReader as parameters and should return a mixed value. Runs of
+  field functions that declare fixed size struct formats are decoded together,
+  with a single struct unpack per run.
+
+  The fields are stored in __slots__ generated from _fields_ by the
+  MetaEventClass metaclass, so event objects have no __dict__ and stay small
+  when many of them are held in memory.
+
+  Passing lazy=True to the constructor defers decoding: the event then only
+  holds on to its data, and each field is decoded the first time it's read.
+  Note that lazily decoded events read from a memory mapped log must not be
+  used after the log has been closed.
 
   Subclasses must also define the _event_types_ list. This will cause the
   subclass to be registered in the the EventClass's subclass map for each event
@@ -46,35 +217,190 @@ class EventClass(object):
     raw_time_stamp: The raw time stamp of the ETW event.
     time_stamp: The timestamp of the event (in seconds since 01-01-1970).
   """
+  __metaclass__ = MetaEventClass
+  __slots__ = ('process_id', 'thread_id', 'raw_time_stamp', 'time_stamp',
+               '_lazy', '_lazy_next')
+
   # A map of all classes that derive from this class. The keys are
   # (string guid, number version, number event_type) tuples and the values are
   # the derived classes.
   _subclass_map = {}
 
-  def __init__(self, log_session, event_trace):
+  def __init__(self, log_session, event_trace, lazy=False):
     """Initialize by extracting event trace header and MOF data.
 
     Args:
-      event_trace: a POINTER(EVENT_TRACE) or POINTER(EVENT_RECORD) for the current event.
-      is_64_bit_log: whether the log is from a 64 bit system.
+      log_session: the session the event arrived on.
+      event_trace: a POINTER(EVENT_TRACE) or POINTER(EVENT_RECORD) for the
+          current event, or an etl.EventRecord read from a log file.
+      lazy: if True, don't decode the fields up front. Each field is instead
+          decoded the first time it's read.
     """
-    if (isinstance(event_trace, LP_EVENT_TRACE)):
+    if isinstance(event_trace, LP_EVENT_TRACE):
       header = event_trace.contents.Header
-      user_data, user_data_length = (event_trace.contents.MofData, event_trace.contents.MofDataLength)
-    elif (isinstance(event_trace, LP_EVENT_RECORD)):
+      user_data, user_data_length = (event_trace.contents.MofData,
+                                     event_trace.contents.MofLength)
+    elif isinstance(event_trace, LP_EVENT_RECORD):
       header = event_trace.contents.EventHeader
-      user_data, user_data_length = (event_trace.contents.UserData, event_trace.contents.UserDataLength)
+      user_data, user_data_length = (event_trace.contents.UserData,
+                                     event_trace.contents.UserDataLength)
+    elif isinstance(event_trace, etl.EventRecord):
+      self._InitFromRecord(log_session, event_trace, lazy)
+      return
     else:
       raise TypeError("Unrecognized event format")
-    
+
     self.process_id = header.ProcessId
     self.thread_id = header.ThreadId
 
     self.raw_time_stamp = header.TimeStamp
     self.time_stamp = log_session.SessionTimeToTime(header.TimeStamp)
-    reader = binary_buffer.BinaryBufferReader(user_data, user_data_length)
-    for name, field in self._fields_:
-      setattr(self, name, field(log_session, reader))
+    if lazy:
+      # The event data is only valid for the duration of the callback, so
+      # hold on to a copy of it.
+      data = ''
+      if user_data_length:
+        data = ctypes.string_at(user_data, user_data_length)
+      self._InitLazy(log_session, data, 0, user_data_length)
+    else:
+      reader = binary_buffer.BinaryBufferReader(user_data, user_data_length)
+      self._ReadFields(log_session, reader)
+
+  def _InitFromRecord(self, log_session, record, lazy):
+    self.process_id = record.process_id
+    self.thread_id = record.thread_id
+
+    self.raw_time_stamp = record.time_stamp
+    self.time_stamp = log_session.SessionTimeToTime(record.time_stamp)
+    if lazy:
+      self._InitLazy(log_session, record.data, record.user_data_offset,
+                     record.user_data_length)
+    else:
+      reader = binary_buffer.BinaryDataReader(record.data,
+                                              record.user_data_offset,
+                                              record.user_data_length)
+      self._ReadFields(log_session, reader)
+
+  def _InitLazy(self, log_session, data, offset, length):
+    layout = self.GetLazyLayout(log_session.is_64_bit_log)
+    self._lazy = log_session, data, offset, length, layout
+    # The first field whose offset isn't known yet, and its offset.
+    first_variable = layout.first_variable
+    if first_variable < len(layout.fields):
+      self._lazy_next = first_variable, layout.offsets[first_variable]
+
+  def Detach(self):
+    """Copies the data of a lazily decoded event out of its log file.
+
+    The events read from a memory mapped log file refer to the mapping,
+    which is gone once the file is closed. After this, the fields that
+    haven't been read yet can still be decoded then.
+    """
+    try:
+      log_session, data, offset, length, layout = self._lazy
+    except AttributeError:
+      return
+    if isinstance(data, memoryview):
+      self._lazy = (log_session, data[offset:offset + length].tobytes(), 0,
+                    length, layout)
+
+  def _ReadFields(self, log_session, reader):
+    for step in self.GetFieldDecoder(log_session.is_64_bit_log):
+      step.Read(self, log_session, reader)
+
+  def __getattr__(self, name):
+    """Decodes a field of a lazily decoded event on its first access.
+
+    This is only called for attributes that haven't been set, which includes
+    the fields of a lazily decoded event that haven't been read yet.
+
+    Raises:
+      AttributeError: name is not a field of this event.
+      BufferOverflowError: the field extends past the end of the event data.
+    """
+    if name.startswith('_'):
+      raise AttributeError(name)
+    try:
+      log_session, data, offset, length, layout = self._lazy
+    except AttributeError:
+      raise AttributeError(name)
+    index = layout.index.get(name, None)
+    if index is None:
+      raise AttributeError(name)
+
+    reader = binary_buffer.BinaryDataReader(data, offset, length)
+    field_name, field, struct_type, convert = layout.fields[index]
+    offset = layout.offsets[index]
+    if struct_type and offset is not None:
+      reader.Consume(offset)
+      value = reader.Unpack(struct_type)[0]
+      if convert:
+        value = convert(log_session, value)
+      setattr(self, name, value)
+      return value
+
+    # Decode the fields from the first one with an unresolved offset, up to
+    # and including the requested one. This resolves the offsets of all the
+    # fields in between.
+    next_index, next_offset = self._lazy_next
+    reader.Consume(next_offset)
+    for field_name, field, struct_type, convert in (
+        layout.fields[next_index:index + 1]):
+      value = field(log_session, reader)
+      setattr(self, field_name, value)
+    self._lazy_next = index + 1, reader.Tell()
+    return value
+
+  def __reduce__(self):
+    """Pickles the event by the key its class is registered under.
+
+    The event classes are nested in their EventCategory, so pickle can't find
+    them by name. Lazily decoded fields are decoded before pickling.
+    """
+    state = []
+    names = ['process_id', 'thread_id', 'raw_time_stamp', 'time_stamp']
+    names.extend(name for name, field in getattr(self, '_fields_', []))
+    for name in names:
+      try:
+        state.append((name, getattr(self, name)))
+      except AttributeError:
+        pass
+    event_class = getattr(type(self), '_event_key_', type(self))
+    return _RestoreEvent, (event_class, tuple(state))
+
+  @classmethod
+  def GetFieldDecoder(cls, is_64_bit):
+    """Returns the compiled decoding steps for this class' _fields_.
+
+    The steps are compiled once per class and pointer size, and cached on the
+    class.
+
+    Args:
+      is_64_bit: whether to decode a log with 64 bit pointers.
+    """
+    decoders = cls.__dict__.get('_field_decoders', None)
+    if decoders is None:
+      fields = getattr(cls, '_fields_', [])
+      decoders = (_CompileFields(fields, False), _CompileFields(fields, True))
+      cls._field_decoders = decoders
+    return decoders[bool(is_64_bit)]
+
+  @classmethod
+  def GetLazyLayout(cls, is_64_bit):
+    """Returns the _LazyLayout for this class' _fields_.
+
+    The layouts are computed once per class and pointer size, and cached on
+    the class.
+
+    Args:
+      is_64_bit: whether to decode a log with 64 bit pointers.
+    """
+    layouts = cls.__dict__.get('_lazy_layouts', None)
+    if layouts is None:
+      fields = getattr(cls, '_fields_', [])
+      layouts = (_LazyLayout(fields, False), _LazyLayout(fields, True))
+      cls._lazy_layouts = layouts
+    return layouts[bool(is_64_bit)]
 
   @staticmethod
   def Get(guid, version, event_type):
@@ -92,6 +418,12 @@ class EventClass(object):
     key = guid, version, event_type
     return EventClass._subclass_map.get(key, None)
 
+  @staticmethod
+  def GetAll():
+    """Returns a list of ((guid, version, event_type), subclass) tuples for
+    all the registered subclasses."""
+    return EventClass._subclass_map.items()
+
   @staticmethod
   def Set(guid, version, event_type, subclass):
     """Sets the subclass for the given guid, version and event_type.
@@ -134,8 +466,12 @@ class MetaEventCategory(type):
     """
     for value in attrs.values():
       if inspect.isclass(value) and issubclass(value, EventClass):
+        # Compile the field decoders up front, rather than on the first event.
+        value.GetFieldDecoder(False)
         for event_type in value.GetEventTypes():
           EventClass.Set(attrs['GUID'], attrs['VERSION'], event_type[1], value)
+          # Remember a key the class is registered under, for pickling.
+          value._event_key_ = attrs['GUID'], attrs['VERSION'], event_type[1]
     return type.__new__(cls, name, bases, attrs)
 
 
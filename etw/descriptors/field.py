@@ -35,45 +35,78 @@ To add a new field type, define a function that takes these arguments:
   reader: An instance of the BinaryBufferReader class to read from.
 and returns a mixed value. If the BinaryBufferReader doesn't already have
 a function to read a certain type, it will need to be added as well.
+
+Field types that always occupy the same number of bytes should also be
+decorated with FixedSize, which declares the struct format of the field for
+32 and 64 bit logs. EventClass uses these to decode each run of fixed size
+fields with a single struct unpack, rather than calling each field function
+in turn.
 """
 
 
+def FixedSize(format_32, format_64=None, convert=None):
+  """Declares the struct formats of a fixed size field type.
+
+  Args:
+    format_32: the struct format character of the field in 32 bit logs.
+    format_64: the struct format character of the field in 64 bit logs.
+        Defaults to format_32.
+    convert: an optional function taking a session and the unpacked value,
+        and returning the value of the field.
+  """
+  def wrapper(func):
+    func.struct_formats = (format_32, format_64 or format_32)
+    func.convert = convert
+    return func
+  return wrapper
+
+
+@FixedSize('?')
 def Boolean(unused_session, reader):
   return reader.ReadBoolean()
 
 
+@FixedSize('b')
 def Int8(unused_session, reader):
   return reader.ReadInt8()
 
 
+@FixedSize('B')
 def UInt8(unused_session, reader):
   return reader.ReadUInt8()
 
 
+@FixedSize('h')
 def Int16(unused_session, reader):
   return reader.ReadInt16()
 
 
+@FixedSize('H')
 def UInt16(unused_session, reader):
   return reader.ReadUInt16()
 
 
+@FixedSize('i')
 def Int32(unused_session, reader):
   return reader.ReadInt32()
 
 
+@FixedSize('I')
 def UInt32(unused_session, reader):
   return reader.ReadUInt32()
 
 
+@FixedSize('q')
 def Int64(unused_session, reader):
   return reader.ReadInt64()
 
 
+@FixedSize('Q')
 def UInt64(unused_session, reader):
   return reader.ReadUInt64()
 
 
+@FixedSize('I', 'Q')
 def Pointer(session, reader):
   if session.is_64_bit_log:
     return reader.ReadUInt64()
@@ -101,5 +134,10 @@ def Sid(session, reader):
   return reader.ReadSid(session.is_64_bit_log)
 
 
+def _SessionTime(session, value):
+  return session.SessionTimeToTime(value)
+
+
+@FixedSize('Q', convert=_SessionTime)
 def WmiTime(session, reader):
   return session.SessionTimeToTime(reader.ReadUInt64())
@@ -0,0 +1,702 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A pure python reader for Event Tracing for Windows log (.etl) files.
+
+An .etl file is a sequence of fixed-size buffers, each of which starts with a
+WMI_BUFFER_HEADER followed by a packed run of 8-byte aligned events. The first
+event of the first buffer carries the TRACE_LOGFILE_HEADER for the log. The
+classes in this module parse that layout directly, without going through
+OpenTrace/ProcessTrace, so logs can be read on hosts without advapi32.
+
+Log files can either be read a buffer at a time, or be mapped into memory, in
+which case event payloads are handed out as memoryview slices of the mapping
+without being copied. Either way, payloads can be decoded in place with a
+binary_buffer.BinaryDataReader.
+
+Compressed logs are not supported.
+"""
+import heapq
+import mmap
+import os
+import struct
+from etw import util
+
+
+# The default number of events each log reads ahead when merging logs.
+DEFAULT_READ_AHEAD = 1024
+
+# The header types found in the marker of each event in a buffer. These are
+# from ntwmi.h.
+TRACE_HEADER_TYPE_SYSTEM32 = 1
+TRACE_HEADER_TYPE_SYSTEM64 = 2
+TRACE_HEADER_TYPE_COMPACT32 = 3
+TRACE_HEADER_TYPE_COMPACT64 = 4
+TRACE_HEADER_TYPE_FULL_HEADER32 = 10
+TRACE_HEADER_TYPE_INSTANCE32 = 11
+TRACE_HEADER_TYPE_TIMED = 12
+TRACE_HEADER_TYPE_ERROR = 13
+TRACE_HEADER_TYPE_WNODE_HEADER = 14
+TRACE_HEADER_TYPE_MESSAGE = 15
+TRACE_HEADER_TYPE_PERFINFO32 = 16
+TRACE_HEADER_TYPE_PERFINFO64 = 17
+TRACE_HEADER_TYPE_EVENT_HEADER32 = 18
+TRACE_HEADER_TYPE_EVENT_HEADER64 = 19
+TRACE_HEADER_TYPE_FULL_HEADER64 = 20
+TRACE_HEADER_TYPE_INSTANCE64 = 21
+
+# EVENT_HEADER flags, from evntcons.h.
+EVENT_HEADER_FLAG_EXTENDED_INFO = 0x0001
+
+# The kernel logger identifies its events by a hook id rather than by a GUID.
+# The top byte of the hook id is the event group, which maps to the GUID of the
+# MOF class describing the event. The groups are from ntwmi.h.
+EVENT_TRACE_GROUP_HEADER = 0x0000
+EVENT_TRACE_GROUP_IO = 0x0100
+EVENT_TRACE_GROUP_MEMORY = 0x0200
+EVENT_TRACE_GROUP_PROCESS = 0x0300
+EVENT_TRACE_GROUP_FILE = 0x0400
+EVENT_TRACE_GROUP_THREAD = 0x0500
+EVENT_TRACE_GROUP_TCPIP = 0x0600
+EVENT_TRACE_GROUP_UDPIP = 0x0800
+EVENT_TRACE_GROUP_REGISTRY = 0x0900
+EVENT_TRACE_GROUP_CONFIG = 0x0B00
+EVENT_TRACE_GROUP_PERFINFO = 0x0F00
+EVENT_TRACE_GROUP_IMAGE = 0x1400
+
+_GROUP_GUIDS = {
+    EVENT_TRACE_GROUP_HEADER: '{68fdd900-4a3e-11d1-84f4-0000f80464e3}',
+    EVENT_TRACE_GROUP_IO: '{3d6fa8d4-fe05-11d0-9dda-00c04fd7ba7c}',
+    EVENT_TRACE_GROUP_MEMORY: '{3d6fa8d3-fe05-11d0-9dda-00c04fd7ba7c}',
+    EVENT_TRACE_GROUP_PROCESS: '{3d6fa8d0-fe05-11d0-9dda-00c04fd7ba7c}',
+    EVENT_TRACE_GROUP_FILE: '{90cbdc39-4a3e-11d1-84f4-0000f80464e3}',
+    EVENT_TRACE_GROUP_THREAD: '{3d6fa8d1-fe05-11d0-9dda-00c04fd7ba7c}',
+    EVENT_TRACE_GROUP_TCPIP: '{9a280ac0-c8e0-11d1-84e2-00c04fb998a2}',
+    EVENT_TRACE_GROUP_UDPIP: '{bf3a50c5-a9c9-4988-a005-2df0b7c80f80}',
+    EVENT_TRACE_GROUP_REGISTRY: '{ae53722e-c863-11d2-8659-00c04fa321a1}',
+    EVENT_TRACE_GROUP_CONFIG: '{01853a65-418f-4f36-aefc-dc0f1d2fd235}',
+    EVENT_TRACE_GROUP_PERFINFO: '{ce1dbfb4-137e-4da6-87b0-3f59aa102cbc}',
+    EVENT_TRACE_GROUP_IMAGE: '{2cb15d1d-5fc1-11d2-abe1-00a0c911f518}',
+}
+
+# Before Vista, image loads were logged in the process group with the
+# EVENT_TRACE_TYPE_LOAD event type.
+_PROCESS_LOAD_IMAGE = EVENT_TRACE_GROUP_PROCESS | 0x0A
+
+# The process and thread id of events logged with a header that carries
+# neither.
+INVALID_ID = 0xFFFFFFFF
+
+# WMI_BUFFER_HEADER: BufferSize, SavedOffset, CurrentOffset, ReferenceCount,
+# TimeStamp, SequenceNumber, Clock, ProcessorNumber, Alignment, LoggerId,
+# State, Offset, BufferFlag, BufferType, and 16 bytes of reference time.
+_BUFFER_HEADER = struct.Struct('<IIIiqqQBBHIIHH16x')
+
+# The marker that starts every event: two bytes that are either the version
+# or the size of the event, the header type and the header flags.
+_MARKER = struct.Struct('<HBB')
+
+# SYSTEM_TRACE_HEADER: Version, HeaderType, Flags, Size, HookId, ThreadId,
+# ProcessId, SystemTime, KernelTime, UserTime.
+_SYSTEM_HEADER = struct.Struct('<HBBHHIIqII')
+
+# The compact system header drops the kernel and user times.
+_COMPACT_HEADER = struct.Struct('<HBBHHIIq')
+
+# PERFINFO_TRACE_HEADER: Version, HeaderType, Flags, Size, HookId, SystemTime.
+_PERFINFO_HEADER = struct.Struct('<HBBHHq')
+
+# EVENT_TRACE_HEADER: Size, HeaderType, MarkerFlags, Class.Type, Class.Level,
+# Class.Version, ThreadId, ProcessId, TimeStamp, Guid, KernelTime, UserTime.
+_FULL_HEADER = struct.Struct('<HBBBBHIIq16sII')
+
+# EVENT_HEADER: Size, HeaderType, Flags, EventProperty, ThreadId, ProcessId,
+# TimeStamp, ProviderId, EventDescriptor (Id, Version, Channel, Level, Opcode,
+# Task, Keyword), ProcessorTime and ActivityId.
+_EVENT_HEADER = struct.Struct('<HHHHIIq16sHBBBBHQQ16s')
+
+# The in-buffer header of an EVENT_HEADER_EXTENDED_DATA_ITEM: Reserved1,
+# ExtType, Linkage and DataSize.
+_EXTENDED_ITEM = struct.Struct('<HHHH')
+
+# The leading, pointer size independent part of TRACE_LOGFILE_HEADER, up to
+# and including CpuSpeedInMHz.
+_LOGFILE_HEADER = struct.Struct('<IBBBBIIqIIIIIIII')
+
+# The trailing part of TRACE_LOGFILE_HEADER: BootTime, PerfFreq, StartTime,
+# ReservedFlags and BuffersLost. Its offset depends on the pointer size.
+_LOGFILE_HEADER_TAIL = struct.Struct('<qqqII')
+_LOGFILE_HEADER_TAIL_OFFSET = {4: 240, 8: 248}
+
+
+class EtlFileError(RuntimeError):
+  """A custom error to throw when a log file can't be parsed."""
+
+
+def _Align8(value):
+  return (value + 7) & ~7
+
+
+_guid_strings = {}
+
+
+def GuidToString(raw_guid):
+  """Formats the 16 raw bytes of a GUID like etw.guiddef.GUID does.
+
+  Args:
+    raw_guid: the GUID as 16 bytes, in its in-memory layout.
+
+  Returns:
+    The GUID as a lower case string in registry format.
+  """
+  guid_string = _guid_strings.get(raw_guid, None)
+  if guid_string is None:
+    data1, data2, data3 = struct.unpack_from('<IHH', raw_guid)
+    data4 = struct.unpack_from('8B', raw_guid, 8)
+    guid_string = ('{%08x-%04x-%04x-%02x%02x-%02x%02x%02x%02x%02x%02x}' %
+                   ((data1, data2, data3) + data4))
+    _guid_strings[raw_guid] = guid_string
+  return guid_string
+
+
+def GuidToBytes(guid_string):
+  """Returns the 16 raw bytes of a GUID given in registry format."""
+  fields = guid_string.strip('{}').split('-')
+  data4 = fields[3] + fields[4]
+  return struct.pack('<IHH8B', int(fields[0], 16), int(fields[1], 16),
+                     int(fields[2], 16),
+                     *[int(data4[i:i + 2], 16) for i in range(0, 16, 2)])
+
+
+_group_guid_bytes = dict((group, GuidToBytes(guid))
+                         for group, guid in _GROUP_GUIDS.items())
+
+
+class EventRecord(object):
+  """A single event read from a log file.
+
+  The event header is decoded eagerly, while the event payload is left in
+  place in the buffer it was read from.
+
+  Attributes:
+    header_type: the TRACE_HEADER_TYPE_* the event was logged with.
+    provider_id: the GUID of the event's provider or MOF class, as 16 bytes.
+    version: the version of the event.
+    event_type: the MOF event type, or the event id for manifest events.
+    level: the trace level of the event.
+    keyword: the keyword mask of the event, zero for MOF events.
+    process_id: the ID of the process that generated the event.
+    thread_id: the ID of the thread that generated the event.
+    time_stamp: the time stamp of the event in session units.
+    processor: the number of the processor the event was logged on.
+    data: the buffer the event was read from, as a string or a memoryview.
+    user_data_offset: the offset of the event payload in data.
+    user_data_length: the length of the event payload.
+  """
+
+  def __init__(self, header_type, provider_id, version, event_type, level,
+               keyword, process_id, thread_id, time_stamp, processor,
+               data, user_data_offset, user_data_length):
+    self.header_type = header_type
+    self.provider_id = provider_id
+    self.version = version
+    self.event_type = event_type
+    self.level = level
+    self.keyword = keyword
+    self.process_id = process_id
+    self.thread_id = thread_id
+    self.time_stamp = time_stamp
+    self.processor = processor
+    self.data = data
+    self.user_data_offset = user_data_offset
+    self.user_data_length = user_data_length
+
+  @property
+  def guid(self):
+    """The provider GUID of the event, as a string."""
+    return GuidToString(self.provider_id)
+
+  @property
+  def user_data(self):
+    """The payload of the event."""
+    start = self.user_data_offset
+    return self.data[start:start + self.user_data_length]
+
+
+class EtlBuffer(object):
+  """A single buffer of a log file.
+
+  Attributes:
+    file_offset: the offset of the buffer in the log file.
+    processor: the number of the processor the buffer was filled on.
+    time_stamp: the time stamp of the buffer in session units.
+    buffer_type: the ETW_BUFFER_TYPE of the buffer.
+  """
+
+  def __init__(self, log_file, data, file_offset):
+    """Parse the header of a buffer.
+
+    Args:
+      log_file: the EtlFile the buffer belongs to.
+      data: the contents of the buffer, as a string or a memoryview.
+      file_offset: the offset of the buffer in the log file.
+
+    Raises:
+      EtlFileError: the buffer header is malformed.
+    """
+    if len(data) < _BUFFER_HEADER.size:
+      raise EtlFileError('Truncated buffer at offset %d.' % file_offset)
+
+    (buffer_size, saved_offset, unused_current_offset,
+     unused_reference_count, time_stamp, unused_sequence_number,
+     unused_clock, processor, unused_alignment, unused_logger_id,
+     unused_state, offset, unused_flags,
+     buffer_type) = _BUFFER_HEADER.unpack_from(data)
+
+    self._log_file = log_file
+    self._data = data
+    self.file_offset = file_offset
+    self.processor = processor
+    self.time_stamp = time_stamp
+    self.buffer_type = buffer_type
+
+    # A flushed buffer records the extent of its data in SavedOffset, while
+    # a buffer that was written out when full only updates Offset.
+    end = saved_offset or offset
+    self._end = min(end, buffer_size, len(data))
+
+  def IterEvents(self):
+    """Iterates over the events in this buffer.
+
+    Yields:
+      An EventRecord for each event in the buffer.
+
+    Raises:
+      EtlFileError: an event in the buffer is malformed.
+    """
+    data = self._data
+    offset = _BUFFER_HEADER.size
+    end = self._end
+    while offset + _MARKER.size <= end:
+      first, header_type, unused_flags = _MARKER.unpack_from(data, offset)
+      if first == 0xFFFF and header_type == 0xFF:
+        # The rest of the buffer is padding.
+        break
+
+      size, record = self._ParseEvent(header_type, offset, end)
+      if size < _MARKER.size or offset + size > end:
+        raise EtlFileError('Malformed event at offset %d.' %
+                           (self.file_offset + offset))
+      if record:
+        yield record
+      offset += _Align8(size)
+
+  def _ParseEvent(self, header_type, offset, end):
+    """Parses the header of the event at offset.
+
+    Returns:
+      A (size, record) tuple, where size is the total size of the event and
+      record is an EventRecord for the event or None if the event can't be
+      decoded. The size is 0 if the header is truncated, or if the event is
+      smaller than its header.
+    """
+    data = self._data
+    log_file = self._log_file
+
+    if header_type in (TRACE_HEADER_TYPE_SYSTEM32, TRACE_HEADER_TYPE_SYSTEM64,
+                       TRACE_HEADER_TYPE_COMPACT32,
+                       TRACE_HEADER_TYPE_COMPACT64):
+      if header_type in (TRACE_HEADER_TYPE_SYSTEM32,
+                         TRACE_HEADER_TYPE_SYSTEM64):
+        header = _SYSTEM_HEADER
+      else:
+        header = _COMPACT_HEADER
+      if offset + header.size > end:
+        return 0, None
+      (version, unused_type, unused_flags, size, hook_id, thread_id,
+       process_id, time_stamp) = header.unpack_from(data, offset)[:8]
+      if size < header.size:
+        return 0, None
+      return size, self._SystemRecord(header_type, hook_id, version,
+                                      process_id, thread_id, time_stamp,
+                                      offset + header.size,
+                                      size - header.size)
+
+    if header_type in (TRACE_HEADER_TYPE_PERFINFO32,
+                       TRACE_HEADER_TYPE_PERFINFO64):
+      if offset + _PERFINFO_HEADER.size > end:
+        return 0, None
+      (version, unused_type, unused_flags, size, hook_id,
+       time_stamp) = _PERFINFO_HEADER.unpack_from(data, offset)
+      if size < _PERFINFO_HEADER.size:
+        return 0, None
+      return size, self._SystemRecord(header_type, hook_id, version,
+                                      INVALID_ID, INVALID_ID, time_stamp,
+                                      offset + _PERFINFO_HEADER.size,
+                                      size - _PERFINFO_HEADER.size)
+
+    if header_type in (TRACE_HEADER_TYPE_FULL_HEADER32,
+                       TRACE_HEADER_TYPE_FULL_HEADER64):
+      if offset + _FULL_HEADER.size > end:
+        return 0, None
+      (size, unused_type, unused_flags, event_type, level, version,
+       thread_id, process_id, time_stamp, guid, unused_kernel_time,
+       unused_user_time) = _FULL_HEADER.unpack_from(data, offset)
+      if size < _FULL_HEADER.size:
+        return 0, None
+      return size, EventRecord(header_type, guid, version, event_type, level,
+                               0, process_id, thread_id,
+                               log_file._ConvertTime(time_stamp),
+                               self.processor, data,
+                               offset + _FULL_HEADER.size,
+                               size - _FULL_HEADER.size)
+
+    if header_type in (TRACE_HEADER_TYPE_EVENT_HEADER32,
+                       TRACE_HEADER_TYPE_EVENT_HEADER64):
+      if offset + _EVENT_HEADER.size > end:
+        return 0, None
+      (size, unused_type, flags, unused_property, thread_id, process_id,
+       time_stamp, guid, event_id, version, unused_channel, level,
+       unused_opcode, unused_task, keyword, unused_processor_time,
+       unused_activity_id) = _EVENT_HEADER.unpack_from(data, offset)
+      if size < _EVENT_HEADER.size:
+        return 0, None
+      user_data_offset = offset + _EVENT_HEADER.size
+      if flags & EVENT_HEADER_FLAG_EXTENDED_INFO:
+        user_data_offset = self._SkipExtendedData(user_data_offset,
+                                                  offset + size)
+      return size, EventRecord(header_type, guid, version, event_id, level,
+                               keyword, process_id, thread_id,
+                               log_file._ConvertTime(time_stamp),
+                               self.processor, data, user_data_offset,
+                               offset + size - user_data_offset)
+
+    if header_type in (TRACE_HEADER_TYPE_INSTANCE32,
+                       TRACE_HEADER_TYPE_INSTANCE64,
+                       TRACE_HEADER_TYPE_TIMED,
+                       TRACE_HEADER_TYPE_ERROR,
+                       TRACE_HEADER_TYPE_MESSAGE):
+      # These headers start with the event size, but don't carry enough
+      # information to identify the event class, so they're skipped.
+      size = _MARKER.unpack_from(data, offset)[0]
+      return size, None
+
+    raise EtlFileError('Unsupported header type %d at offset %d.' %
+                       (header_type, self.file_offset + offset))
+
+  def _SystemRecord(self, header_type, hook_id, version, process_id,
+                    thread_id, time_stamp, user_data_offset,
+                    user_data_length):
+    if hook_id == _PROCESS_LOAD_IMAGE:
+      group = EVENT_TRACE_GROUP_IMAGE
+    else:
+      group = hook_id & 0xFF00
+    guid = _group_guid_bytes.get(group, None)
+    if guid is None:
+      return None
+
+    return EventRecord(header_type, guid, version, hook_id & 0xFF, 0, 0,
+                       process_id, thread_id,
+                       self._log_file._ConvertTime(time_stamp),
+                       self.processor, self._data, user_data_offset,
+                       user_data_length)
+
+  def _SkipExtendedData(self, offset, end):
+    """Returns the offset of the payload following a run of extended items."""
+    while offset + _EXTENDED_ITEM.size <= end:
+      (unused_reserved, unused_ext_type, linkage,
+       data_size) = _EXTENDED_ITEM.unpack_from(self._data, offset)
+      offset = _Align8(offset + _EXTENDED_ITEM.size + data_size)
+      if not linkage & 0x1:
+        break
+    return min(offset, end)
+
+
+class EtlFile(object):
+  """A log file opened for reading.
+
+  This class plays the part of a trace session for the events it reads: it
+  provides is_64_bit_log and SessionTimeToTime to the EventClass fields.
+
+  Events are read in file order, which is buffer by buffer, and each buffer
+  only holds the events of a single processor.
+
+  When memory mapped, the log file is mapped read-only, so its pages are
+  shared with the file system cache. Resident memory
+  doesn't grow with the size of the log, and repeated passes over the same file
+  are served from the cache.
+
+  Attributes:
+    path: the path of the log file.
+    is_64_bit_log: whether the log was written on a 64 bit system.
+    buffer_size: the size of each buffer in the file.
+    pointer_size: the size of a pointer on the system that wrote the log.
+    number_of_processors: the number of processors of that system.
+    events_lost: the number of events lost while writing the log.
+    buffers_lost: the number of buffers lost while writing the log.
+  """
+
+  def __init__(self, path, raw_time=False, use_mmap=False):
+    """Open and parse the header of the log file at path.
+
+    Args:
+      path: relative or absolute path to the file to open.
+      raw_time: if True, report event time stamps in the units of the clock
+          the log was written with, rather than converting them to FILETIME.
+      use_mmap: if True, map the log file into memory rather than reading it
+          a buffer at a time.
+
+    Raises:
+      EtlFileError: the file is not a valid log file.
+    """
+    self.path = path
+    self._raw_time = raw_time
+    self._file = open(path, 'rb')
+    self._file_size = os.fstat(self._file.fileno()).st_size
+    self._map = None
+    self._view = None
+    self._selected_buffers = None
+    # Until we've read the logfile header, assume FILETIME conversion.
+    self._ticks_per_second = None
+    self._time_epoch_delta = util.FILETIME_EPOCH_DELTA_S
+    self._time_multiplier = util.FILETIME_TO_SECONDS_MULTIPLIER
+    self.is_64_bit_log = False
+    try:
+      if use_mmap and self._file_size:
+        self._MapFile()
+      self._ProcessHeader()
+    except:
+      self.Close()
+      raise
+
+  def SessionTimeToTime(self, session_time):
+    """Convert a raw time value from this log to a python time value.
+
+    Args:
+      session_time: a time value read from a event header or event field
+          in this log.
+
+    Returns: a floating point time value in seconds, with zero at 1.1.1970.
+    """
+    return session_time * self._time_multiplier - self._time_epoch_delta
+
+  def Close(self):
+    """Close the log file."""
+    self._view = None
+    if self._map:
+      self._map.close()
+      self._map = None
+    if self._file:
+      self._file.close()
+      self._file = None
+
+  @property
+  def buffer_count(self):
+    """The number of buffers in the log file."""
+    return -(-self._file_size // self.buffer_size)
+
+  def IterBuffers(self, start=0, stop=None):
+    """Iterates over the buffers in this log file.
+
+    Args:
+      start: the index of the first buffer to read.
+      stop: the index of the buffer to stop at. By default, buffers are read
+          up to the end of the file.
+
+    Yields:
+      An EtlBuffer for each buffer in the range.
+    """
+    buffer_size = self.buffer_size
+    end = self._file_size
+    if stop is not None:
+      end = min(end, stop * buffer_size)
+    if self._selected_buffers is None:
+      file_offsets = xrange(start * buffer_size, end, buffer_size)
+    else:
+      file_offsets = [index * buffer_size for index in self._selected_buffers
+                      if index >= start and index * buffer_size < end]
+    for file_offset in file_offsets:
+      yield EtlBuffer(self, self._ReadAt(file_offset, buffer_size),
+                      file_offset)
+
+  @property
+  def selected_buffers(self):
+    """The sorted indexes of the buffers set with SelectBuffers, or None."""
+    return self._selected_buffers
+
+  def SelectBuffers(self, indexes):
+    """Restricts IterBuffers and IterEvents to a subset of the buffers.
+
+    Args:
+      indexes: the indexes of the buffers to read, or None to read all of
+          them.
+    """
+    if indexes is not None:
+      indexes = sorted(indexes)
+    self._selected_buffers = indexes
+
+  def IterEvents(self):
+    """Iterates over the events in this log file.
+
+    Yields:
+      An EventRecord for each event in the file.
+    """
+    for etl_buffer in self.IterBuffers():
+      for record in etl_buffer.IterEvents():
+        yield record
+
+  def _MapFile(self):
+    self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+    # The mmap object doesn't export a memoryview itself, but a buffer object
+    # over it does.
+    self._view = memoryview(buffer(self._map))
+
+  def _ReadAt(self, file_offset, length):
+    if self._view is not None:
+      return self._view[file_offset:file_offset + length]
+    self._file.seek(file_offset)
+    return self._file.read(length)
+
+  def _ProcessHeader(self):
+    data = self._ReadAt(0, _BUFFER_HEADER.size + _SYSTEM_HEADER.size)
+    if len(data) < _BUFFER_HEADER.size + _SYSTEM_HEADER.size:
+      raise EtlFileError('%s is too short to be a log file.' % self.path)
+
+    buffer_size = _BUFFER_HEADER.unpack_from(data)[0]
+    if buffer_size < _BUFFER_HEADER.size:
+      raise EtlFileError('%s has an invalid buffer size.' % self.path)
+    self.buffer_size = buffer_size
+
+    # The first event of the log is the logfile header.
+    offset = _BUFFER_HEADER.size
+    (unused_version, header_type, unused_flags, size, hook_id,
+     unused_thread_id, unused_process_id, header_time_stamp, unused_kernel,
+     unused_user) = _SYSTEM_HEADER.unpack_from(data, offset)
+    if (header_type not in (TRACE_HEADER_TYPE_SYSTEM32,
+                            TRACE_HEADER_TYPE_SYSTEM64) or
+        hook_id != EVENT_TRACE_GROUP_HEADER):
+      raise EtlFileError('%s does not start with a logfile header.' %
+                         self.path)
+
+    header_offset = offset + _SYSTEM_HEADER.size
+    data = self._ReadAt(header_offset, size - _SYSTEM_HEADER.size)
+    if len(data) < _LOGFILE_HEADER.size:
+      raise EtlFileError('%s has a truncated logfile header.' % self.path)
+    (unused_buffer_size, unused_major, unused_minor, unused_sub,
+     unused_sub_minor, unused_provider_version, number_of_processors,
+     unused_end_time, unused_timer_resolution, unused_maximum_file_size,
+     unused_log_file_mode, unused_buffers_written, unused_start_buffers,
+     pointer_size, events_lost,
+     cpu_speed) = _LOGFILE_HEADER.unpack_from(data)
+
+    tail_offset = _LOGFILE_HEADER_TAIL_OFFSET.get(pointer_size, None)
+    if (tail_offset is None or
+        len(data) < tail_offset + _LOGFILE_HEADER_TAIL.size):
+      raise EtlFileError('%s has an invalid logfile header.' % self.path)
+    (unused_boot_time, perf_freq, start_time, clock_type,
+     buffers_lost) = _LOGFILE_HEADER_TAIL.unpack_from(data, tail_offset)
+
+    self.pointer_size = pointer_size
+    self.is_64_bit_log = pointer_size == 8
+    self.number_of_processors = number_of_processors
+    self.events_lost = events_lost
+    self.buffers_lost = buffers_lost
+
+    if clock_type == 1:  # QPC timer resolution
+      ticks_sec = perf_freq
+    elif clock_type == 3:  # CPU cycle counter
+      ticks_sec = cpu_speed * 1000000
+    else:  # System time, which is in FILETIME units already.
+      ticks_sec = None
+
+    if ticks_sec:
+      self._ticks_per_second = ticks_sec
+      self._start_time = start_time
+      self._header_time_stamp = header_time_stamp
+
+    if self._raw_time and ticks_sec:
+      # Calibrate the session start time on the logfile header event, the
+      # same way the native consumer does on the first event.
+      self._time_multiplier = 1.0 / ticks_sec
+      self._time_epoch_delta = (header_time_stamp * self._time_multiplier -
+                                util.FileTimeToTime(start_time))
+
+  def SessionTimeToFileTime(self, session_time):
+    """Convert a raw time value from this log to a FILETIME.
+
+    Unlike SessionTimeToTime, this is exact, so it can be used to order the
+    events of logs with different clocks.
+
+    Args:
+      session_time: a time value read from a event header or event field
+          in this log.
+
+    Returns: an integer FILETIME.
+    """
+    if not self._raw_time or not self._ticks_per_second:
+      return session_time
+    return self._FileTimeFromTicks(session_time)
+
+  def _FileTimeFromTicks(self, time_stamp):
+    return self._start_time + (
+        (time_stamp - self._header_time_stamp) * 10000000 //
+        self._ticks_per_second)
+
+  def _ConvertTime(self, time_stamp):
+    """Converts an event time stamp to the units reported by this log."""
+    if self._raw_time or not self._ticks_per_second:
+      return time_stamp
+    return self._FileTimeFromTicks(time_stamp)
+
+
+def _IterTimeOrdered(index, log, read_ahead):
+  """Iterates the events of a log, reordered within a window of read_ahead.
+
+  Yields:
+    (time, index, sequence, log, record) tuples, where time is the time stamp
+    of record as a FILETIME. The index and sequence number keep the tuples
+    from ever comparing the records themselves.
+  """
+  heap = []
+  for sequence, record in enumerate(log.IterEvents()):
+    time_stamp = log.SessionTimeToFileTime(record.time_stamp)
+    heapq.heappush(heap, (time_stamp, index, sequence, log, record))
+    if len(heap) > read_ahead:
+      yield heapq.heappop(heap)
+  while heap:
+    yield heapq.heappop(heap)
+
+
+def MergeEvents(logs, read_ahead=DEFAULT_READ_AHEAD):
+  """Merges the events of several logs into a single time ordered stream.
+
+  The time stamps of each log are normalized with its SessionTimeToFileTime,
+  so logs with different clocks can be merged. Each log is reordered within a
+  window of read_ahead events, which absorbs the interleaving of the buffers
+  of different processors. Memory use is proportional to the number of logs
+  times read_ahead, rather than to the number of events.
+
+  Args:
+    logs: the EtlFile objects to merge.
+    read_ahead: the number of events to read ahead in each log.
+
+  Yields:
+    (log, record) tuples in time stamp order. Events that are further out of
+    order in their log than read_ahead are yielded late, rather than dropped.
+  """
+  streams = [_IterTimeOrdered(index, log, read_ahead)
+             for index, log in enumerate(logs)]
+  for (unused_time, unused_index, unused_sequence, log,
+       record) in heapq.merge(*streams):
+    yield log, record
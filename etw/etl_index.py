@@ -0,0 +1,307 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A sparse index of the buffers of a log file.
+
+For each buffer of a log, the index records its file offset, its processor,
+the range of time stamps of its events, and the set of (provider, event type)
+pairs of its events. Looking up a time range or a set of events in the index
+yields the buffers that may hold matching events, so the rest of the log
+doesn't have to be read.
+
+Indexes are saved next to their log file, in a sidecar file with the same
+name and an .idx extension. The sidecar records the size and modification
+time of the log, and is rebuilt when either of them changes.
+
+The sidecar is a little-endian binary file laid out as:
+  A header: magic, format version, log size, log modification time, buffer
+      size, number of buffers and number of keys.
+  The key table: the raw provider GUID and event type of each distinct key.
+  A record for each buffer: its file offset, first and last time stamps as
+      FILETIMEs, processor and number of keys, followed by the indexes of its
+      keys in the key table.
+"""
+from etw import etl
+from etw import util
+import logging
+import os
+import struct
+
+
+# The extension of the sidecar files, appended to the name of the log file.
+SIDECAR_EXTENSION = '.idx'
+
+_MAGIC = 'PYETWIDX'
+_VERSION = 2
+
+_HEADER = struct.Struct('<8sHxxqqIII')
+# The event type of a manifest event is its 16 bit event Id.
+_KEY = struct.Struct('<16sH')
+_BUFFER = struct.Struct('<QqqHH')
+
+# The slack added to either side of a time range when it's converted to
+# FILETIMEs, in 100ns units. Time values in seconds are floating point, so
+# the conversion can be off by a few ticks.
+_TIME_SLACK = 10
+
+
+class BufferEntry(object):
+  """The index entry of a single buffer.
+
+  Attributes:
+    index: the index of the buffer in the log file.
+    file_offset: the offset of the buffer in the log file.
+    processor: the number of the processor the buffer was filled on.
+    start_time: the earliest time stamp of the buffer's events, as a FILETIME.
+    end_time: the latest time stamp of the buffer's events, as a FILETIME.
+    keys: a frozenset of the (raw_guid, event_type) pairs of the buffer's
+        events, where raw_guid is the 16 byte GUID of the provider.
+  """
+  __slots__ = ('index', 'file_offset', 'processor', 'start_time', 'end_time',
+               'keys')
+
+  def __init__(self, index, file_offset, processor, start_time, end_time,
+               keys):
+    self.index = index
+    self.file_offset = file_offset
+    self.processor = processor
+    self.start_time = start_time
+    self.end_time = end_time
+    self.keys = keys
+
+
+class EtlIndex(object):
+  """The index of the buffers of a log file.
+
+  Attributes:
+    buffer_size: the size of each buffer in the log file.
+    entries: a list of BufferEntry, one per buffer that holds events, in file
+        order.
+    source_size: the size of the log file the index was built from.
+    source_mtime: the modification time of that file, in 100ns units.
+  """
+
+  def __init__(self, buffer_size, entries, source_size=0, source_mtime=0):
+    self.buffer_size = buffer_size
+    self.entries = entries
+    self.source_size = source_size
+    self.source_mtime = source_mtime
+
+  @classmethod
+  def Build(cls, path):
+    """Builds the index of a log file by reading all of its events.
+
+    Args:
+      path: the path of the log file.
+
+    Returns:
+      A new EtlIndex.
+
+    Raises:
+      EtlFileError: the file is not a valid log file.
+    """
+    source_size, source_mtime = _GetSourceStamp(path)
+    log = etl.EtlFile(path)
+    try:
+      entries = []
+      for index, etl_buffer in enumerate(log.IterBuffers()):
+        start_time = None
+        end_time = None
+        keys = set()
+        for record in etl_buffer.IterEvents():
+          time_stamp = log.SessionTimeToFileTime(record.time_stamp)
+          if start_time is None or time_stamp < start_time:
+            start_time = time_stamp
+          if end_time is None or time_stamp > end_time:
+            end_time = time_stamp
+          keys.add((record.provider_id, record.event_type))
+        if keys:
+          entries.append(BufferEntry(index, etl_buffer.file_offset,
+                                     etl_buffer.processor, start_time,
+                                     end_time, frozenset(keys)))
+      return cls(log.buffer_size, entries, source_size, source_mtime)
+    finally:
+      log.Close()
+
+  @classmethod
+  def Load(cls, path):
+    """Loads an index from a sidecar file.
+
+    Args:
+      path: the path of the sidecar file.
+
+    Returns:
+      A new EtlIndex.
+
+    Raises:
+      IOError: the file can't be read.
+      EtlFileError: the file is not a valid index.
+    """
+    with open(path, 'rb') as index_file:
+      data = index_file.read()
+
+    if len(data) < _HEADER.size:
+      raise etl.EtlFileError('%s is too short to be an index.' % path)
+    (magic, version, source_size, source_mtime, buffer_size, buffer_count,
+     key_count) = _HEADER.unpack_from(data)
+    if magic != _MAGIC or version != _VERSION:
+      raise etl.EtlFileError('%s is not a version %d index.' %
+                             (path, _VERSION))
+
+    try:
+      offset = _HEADER.size
+      keys = []
+      for unused_i in xrange(key_count):
+        keys.append(_KEY.unpack_from(data, offset))
+        offset += _KEY.size
+
+      entries = []
+      for unused_i in xrange(buffer_count):
+        (file_offset, start_time, end_time, processor,
+         buffer_key_count) = _BUFFER.unpack_from(data, offset)
+        offset += _BUFFER.size
+        key_indexes = struct.unpack_from('<%dH' % buffer_key_count, data,
+                                         offset)
+        offset += 2 * buffer_key_count
+        entries.append(BufferEntry(file_offset // buffer_size, file_offset,
+                                   processor, start_time, end_time,
+                                   frozenset(keys[i] for i in key_indexes)))
+    except (struct.error, IndexError):
+      raise etl.EtlFileError('%s is a malformed index.' % path)
+
+    return cls(buffer_size, entries, source_size, source_mtime)
+
+  def Save(self, path):
+    """Writes the index to a sidecar file.
+
+    Args:
+      path: the path of the sidecar file.
+
+    Raises:
+      IOError: the file can't be written.
+    """
+    key_indexes = {}
+    for entry in self.entries:
+      for key in entry.keys:
+        key_indexes.setdefault(key, len(key_indexes))
+    keys = sorted(key_indexes, key=key_indexes.get)
+
+    chunks = [_HEADER.pack(_MAGIC, _VERSION, self.source_size,
+                           self.source_mtime, self.buffer_size,
+                           len(self.entries), len(keys))]
+    for raw_guid, event_type in keys:
+      chunks.append(_KEY.pack(raw_guid, event_type))
+    for entry in self.entries:
+      chunks.append(_BUFFER.pack(entry.file_offset, entry.start_time,
+                                 entry.end_time, entry.processor,
+                                 len(entry.keys)))
+      chunks.append(struct.pack('<%dH' % len(entry.keys),
+                                *sorted(key_indexes[k] for k in entry.keys)))
+
+    with open(path, 'wb') as index_file:
+      index_file.write(''.join(chunks))
+
+  def IsCurrent(self, path):
+    """Returns whether the index is up to date with the log file at path."""
+    try:
+      return _GetSourceStamp(path) == (self.source_size, self.source_mtime)
+    except OSError:
+      return False
+
+  def FindBuffers(self, start_time=None, end_time=None, events=None,
+                  processors=None):
+    """Finds the buffers that may hold events matching all the criteria.
+
+    The buffers found may also hold events that don't match, so the events
+    read from them still need to be filtered to get exact results.
+
+    Args:
+      start_time: if not None, the start of the time range, in seconds since
+          1.1.1970.
+      end_time: if not None, the end of the time range, in seconds since
+          1.1.1970.
+      events: if not None, a list of (guid, event_type) tuples such as
+          image.Event.Load, where guid is the string GUID of the provider.
+      processors: if not None, a list of processor numbers.
+
+    Returns:
+      A list of the indexes of the buffers, in file order.
+    """
+    start = None
+    if start_time is not None:
+      start = util.TimeToFileTime(start_time) - _TIME_SLACK
+    end = None
+    if end_time is not None:
+      end = util.TimeToFileTime(end_time) + _TIME_SLACK
+    keys = None
+    if events is not None:
+      keys = frozenset((etl.GuidToBytes(guid), event_type)
+                       for guid, event_type in events)
+    if processors is not None:
+      processors = frozenset(processors)
+
+    indexes = []
+    for entry in self.entries:
+      if start is not None and entry.end_time < start:
+        continue
+      if end is not None and entry.start_time > end:
+        continue
+      if keys is not None and keys.isdisjoint(entry.keys):
+        continue
+      if processors is not None and entry.processor not in processors:
+        continue
+      indexes.append(entry.index)
+    return indexes
+
+
+def _GetSourceStamp(path):
+  stat = os.stat(path)
+  return stat.st_size, int(stat.st_mtime * 10000000)
+
+
+def GetSidecarPath(path):
+  """Returns the path of the sidecar file for the log file at path."""
+  return path + SIDECAR_EXTENSION
+
+
+def GetIndex(path):
+  """Returns the index of a log file, building it if necessary.
+
+  The index is loaded from the log's sidecar file if that is up to date.
+  Otherwise it is built, and saved to the sidecar file when possible.
+
+  Args:
+    path: the path of the log file.
+
+  Returns:
+    An EtlIndex.
+
+  Raises:
+    EtlFileError: the file is not a valid log file.
+  """
+  sidecar_path = GetSidecarPath(path)
+  if os.path.exists(sidecar_path):
+    try:
+      index = EtlIndex.Load(sidecar_path)
+      if index.IsCurrent(path):
+        return index
+    except (IOError, etl.EtlFileError):
+      logging.warning('Ignoring unreadable index %s.', sidecar_path)
+
+  index = EtlIndex.Build(path)
+  try:
+    index.Save(sidecar_path)
+  except IOError:
+    logging.warning('Unable to save index %s.', sidecar_path)
+  return index
@@ -19,10 +19,10 @@ contain.
 """
 
 import ctypes as ct
-import ctypes.wintypes as wt
-import exceptions
 from guiddef import GUID
-import winerror
+from native import (ERROR_SUCCESS, FILETIME, FUNCTYPE, GetFunction,
+                    GetLastError, HANDLE, LARGE_INTEGER, LONG, ULONG,
+                    WindowsError, WORD)
 
 
 TRACEHANDLE = ct.c_uint64
@@ -441,39 +441,39 @@ TRACE_HEADER_FLAG_USE_MOF_PTR = 0x00100000  # MOF data are dereferenced
 
 
 class WNODE_HEADER(ct.Structure):
-  _fields_ = [('BufferSize', ct.c_ulong),
-              ('ProviderId', ct.c_ulong),
+  _fields_ = [('BufferSize', ULONG),
+              ('ProviderId', ULONG),
               ('HistoricalContext', ct.c_uint64),
-              ('TimeStamp', wt.LARGE_INTEGER),
+              ('TimeStamp', LARGE_INTEGER),
               ('Guid', GUID),
-              ('ClientContext', ct.c_ulong),
-              ('Flags', ct.c_ulong)]
+              ('ClientContext', ULONG),
+              ('Flags', ULONG)]
 
 
 class EVENT_TRACE_PROPERTIES(ct.Structure):
   _fields_ = [('Wnode', WNODE_HEADER),
-              ('BufferSize', ct.c_ulong),
-              ('MinimumBuffers', ct.c_ulong),
-              ('MaximumBuffers', ct.c_ulong),
-              ('MaximumFileSize', ct.c_ulong),
-              ('LogFileMode', ct.c_ulong),
-              ('FlushTimer', ct.c_ulong),
-              ('EnableFlags', ct.c_ulong),
-              ('AgeLimit', ct.c_long),
-              ('NumberOfBuffers', ct.c_ulong),
-              ('FreeBuffers', ct.c_ulong),
-              ('EventsLost', ct.c_ulong),
-              ('BuffersWritten', ct.c_ulong),
-              ('LogBuffersLost', ct.c_ulong),
-              ('RealTimeBuffersLost', ct.c_ulong),
-              ('LoggerThreadId', wt.HANDLE),
-              ('LogFileNameOffset', ct.c_ulong),
-              ('LoggerNameOffset', ct.c_ulong)]
+              ('BufferSize', ULONG),
+              ('MinimumBuffers', ULONG),
+              ('MaximumBuffers', ULONG),
+              ('MaximumFileSize', ULONG),
+              ('LogFileMode', ULONG),
+              ('FlushTimer', ULONG),
+              ('EnableFlags', ULONG),
+              ('AgeLimit', LONG),
+              ('NumberOfBuffers', ULONG),
+              ('FreeBuffers', ULONG),
+              ('EventsLost', ULONG),
+              ('BuffersWritten', ULONG),
+              ('LogBuffersLost', ULONG),
+              ('RealTimeBuffersLost', ULONG),
+              ('LoggerThreadId', HANDLE),
+              ('LogFileNameOffset', ULONG),
+              ('LoggerNameOffset', ULONG)]
 
 
 class TRACE_GUID_REGISTRATION(ct.Structure):
   _fields_ = [('Guid', ct.POINTER(GUID)),
-               ('RegHandle', wt.HANDLE)]
+               ('RegHandle', HANDLE)]
 
 
 class EVENT_TRACE_HEADER_CLASS(ct.Structure):
@@ -487,28 +487,28 @@ class EVENT_TRACE_HEADER(ct.Structure):
               ('HeaderType', ct.c_ubyte),
               ('MarkerFlags', ct.c_ubyte),
               ('Class', EVENT_TRACE_HEADER_CLASS),
-              ('ThreadId', ct.c_ulong),
-              ('ProcessId', ct.c_ulong),
-              ('TimeStamp', wt.LARGE_INTEGER),
+              ('ThreadId', ULONG),
+              ('ProcessId', ULONG),
+              ('TimeStamp', LARGE_INTEGER),
               ('Guid', GUID),
-              ('ClientContext', ct.c_ulong),
-              ('Flags', ct.c_ulong)]
+              ('ClientContext', ULONG),
+              ('Flags', ULONG)]
 
 
 class MOF_FIELD(ct.Structure):
   _fields_ = [('DataPtr', ct.c_ulonglong),
-              ('Length', ct.c_ulong),
-              ('DataType', ct.c_ulong)]
+              ('Length', ULONG),
+              ('DataType', ULONG)]
 
 
 class EVENT_TRACE(ct.Structure):
   _fields_ = [('Header', EVENT_TRACE_HEADER),
-              ('InstanceId', ct.c_ulong),
-              ('ParentInstanceId', ct.c_ulong),
+              ('InstanceId', ULONG),
+              ('ParentInstanceId', ULONG),
               ('ParentGuid', GUID),
               ('MofData', ct.c_void_p),
-              ('MofLength', ct.c_ulong),
-              ('ClientContext', ct.c_ulong)]
+              ('MofLength', ULONG),
+              ('ClientContext', ULONG)]
 
 LP_EVENT_TRACE = ct.POINTER(EVENT_TRACE)
 
@@ -528,8 +528,8 @@ class EVENT_HEADER(ct.Structure):
                 ('HeaderType', ct.c_ushort),
                 ('Flags', ct.c_ushort),
                 ('EventProperty', ct.c_ushort),
-                ('ThreadId', ct.c_ulong),
-                ('ProcessId', ct.c_ulong),
+                ('ThreadId', ULONG),
+                ('ProcessId', ULONG),
                 ('TimeStamp', ct.c_ulonglong),
                 ('ProviderId', GUID),
                 ('EventDescriptor', EVENT_DESCRIPTOR),
@@ -539,7 +539,7 @@ class EVENT_HEADER(ct.Structure):
 
 class EVENT_RECORD(ct.Structure):
     _fields_ = [('EventHeader', EVENT_HEADER),
-                ('BufferContext', ct.c_ulong),
+                ('BufferContext', ULONG),
                 ('ExtendedDataCount', ct.c_ushort),
                 ('UserDataLength', ct.c_ushort),
                 ('ExtendedData', ct.c_void_p),
@@ -550,51 +550,51 @@ LP_EVENT_RECORD = ct.POINTER(EVENT_RECORD)
 
 
 class SYSTEMTIME(ct.Structure):
-  _fields_ = [('wYear', wt.WORD),
-              ('wMonth', wt.WORD),
-              ('wDayOfWeek', wt.WORD),
-              ('wDay', wt.WORD),
-              ('wHour', wt.WORD),
-              ('wMinute', wt.WORD),
-              ('wSecond', wt.WORD),
-              ('wMilliseconds', wt.WORD)]
+  _fields_ = [('wYear', WORD),
+              ('wMonth', WORD),
+              ('wDayOfWeek', WORD),
+              ('wDay', WORD),
+              ('wHour', WORD),
+              ('wMinute', WORD),
+              ('wSecond', WORD),
+              ('wMilliseconds', WORD)]
 
 
 class TIME_ZONE_INFORMATION(ct.Structure):
-  _fields_ = [('Bias', ct.c_long),
+  _fields_ = [('Bias', LONG),
               ('StandardName', ct.c_wchar * 32),
               ('StandardDate', SYSTEMTIME),
-              ('StandardBias', ct.c_long),
+              ('StandardBias', LONG),
               ('DaylightName', ct.c_wchar * 32),
               ('DaylightDate', SYSTEMTIME),
-              ('DaylightBias', ct.c_long)]
+              ('DaylightBias', LONG)]
 
 
 class TRACE_LOGFILE_HEADER(ct.Structure):
-  _fields_ = [('BufferSize', ct.c_ulong),
+  _fields_ = [('BufferSize', ULONG),
               ('MajorVersion', ct.c_byte),
               ('MinorVersion', ct.c_byte),
               ('SubVersion', ct.c_byte),
               ('SubMinorVersion', ct.c_byte),
-              ('ProviderVersion', ct.c_ulong),
-              ('NumberOfProcessors', ct.c_ulong),
-              ('EndTime', wt.LARGE_INTEGER),
-              ('TimerResolution', ct.c_ulong),
-              ('MaximumFileSize', ct.c_ulong),
-              ('LogFileMode', ct.c_ulong),
-              ('BuffersWritten', ct.c_ulong),
-              ('StartBuffers', ct.c_ulong),
-              ('PointerSize', ct.c_ulong),
-              ('EventsLost', ct.c_ulong),
-              ('CpuSpeedInMHz', ct.c_ulong),
+              ('ProviderVersion', ULONG),
+              ('NumberOfProcessors', ULONG),
+              ('EndTime', LARGE_INTEGER),
+              ('TimerResolution', ULONG),
+              ('MaximumFileSize', ULONG),
+              ('LogFileMode', ULONG),
+              ('BuffersWritten', ULONG),
+              ('StartBuffers', ULONG),
+              ('PointerSize', ULONG),
+              ('EventsLost', ULONG),
+              ('CpuSpeedInMHz', ULONG),
               ('LoggerName', ct.c_wchar_p),
               ('LogFileName', ct.c_wchar_p),
               ('TimeZone', TIME_ZONE_INFORMATION),
-              ('BootTime', wt.LARGE_INTEGER),
-              ('PerfFreq', wt.LARGE_INTEGER),
-              ('StartTime', wt.LARGE_INTEGER),
-              ('ReservedFlags', ct.c_ulong),
-              ('BuffersLost', ct.c_ulong)]
+              ('BootTime', LARGE_INTEGER),
+              ('PerfFreq', LARGE_INTEGER),
+              ('StartTime', LARGE_INTEGER),
+              ('ReservedFlags', ULONG),
+              ('BuffersLost', ULONG)]
 
 
 # This must be "forward declared", because of the callback type below,
@@ -604,10 +604,10 @@ class EVENT_TRACE_LOGFILE(ct.Structure):
 
 
 # The type for event trace callbacks.
-EVENT_CALLBACK = ct.WINFUNCTYPE(None, ct.POINTER(EVENT_TRACE))
-EVENT_RECORD_CALLBACK = ct.WINFUNCTYPE(None, ct.POINTER(EVENT_RECORD))
-EVENT_TRACE_BUFFER_CALLBACK = ct.WINFUNCTYPE(ct.c_ulong,
-                                             ct.POINTER(EVENT_TRACE_LOGFILE))
+EVENT_CALLBACK = FUNCTYPE(None, ct.POINTER(EVENT_TRACE))
+EVENT_RECORD_CALLBACK = FUNCTYPE(None, ct.POINTER(EVENT_RECORD))
+EVENT_TRACE_BUFFER_CALLBACK = FUNCTYPE(ULONG,
+                                       ct.POINTER(EVENT_TRACE_LOGFILE))
 
 
 class _U(ct.Union):
@@ -620,122 +620,122 @@ EVENT_TRACE_LOGFILE._fields_ = [
     ('LogFileName', ct.c_wchar_p),
     ('LoggerName', ct.c_wchar_p),
     ('CurrentTime', ct.c_longlong),
-    ('BuffersRead', ct.c_ulong),
-    ('ProcessTraceMode', ct.c_ulong),
+    ('BuffersRead', ULONG),
+    ('ProcessTraceMode', ULONG),
     ('CurrentEvent', EVENT_TRACE),
     ('LogfileHeader', TRACE_LOGFILE_HEADER),
     ('BufferCallback', EVENT_TRACE_BUFFER_CALLBACK),
-    ('BufferSize', ct.c_ulong),
-    ('Filled', ct.c_ulong),
-    ('EventsLost', ct.c_ulong),
+    ('BufferSize', ULONG),
+    ('Filled', ULONG),
+    ('EventsLost', ULONG),
     ('u', _U),
-    ('IsKernelTrace', ct.c_ulong),
+    ('IsKernelTrace', ULONG),
     ('Context', ct.c_void_p)]
 
 
 def CheckWinError(result, func, arguments):
-  if result != winerror.ERROR_SUCCESS:
-    raise exceptions.WindowsError(result)
+  if result != ERROR_SUCCESS:
+    raise WindowsError(result)
 
 
-StartTrace = ct.windll.advapi32.StartTraceW
+StartTrace = GetFunction('advapi32', 'StartTraceW')
 StartTrace.argtypes = [ct.POINTER(TRACEHANDLE),
                        ct.c_wchar_p,
                        ct.POINTER(EVENT_TRACE_PROPERTIES)]
-StartTrace.restype = ct.c_ulong
+StartTrace.restype = ULONG
 StartTrace.errcheck = CheckWinError
 
 
-ControlTrace = ct.windll.advapi32.ControlTraceW
+ControlTrace = GetFunction('advapi32', 'ControlTraceW')
 ControlTrace.argtypes = [TRACEHANDLE,
                          ct.c_wchar_p,
                          ct.POINTER(EVENT_TRACE_PROPERTIES),
-                         ct.c_ulong]
-ControlTrace.restype = ct.c_ulong
+                         ULONG]
+ControlTrace.restype = ULONG
 ControlTrace.errcheck = CheckWinError
 
 
-EnableTrace = ct.windll.advapi32.EnableTrace
-EnableTrace.argtypes = [ct.c_ulong,
-                        ct.c_ulong,
-                        ct.c_ulong,
+EnableTrace = GetFunction('advapi32', 'EnableTrace')
+EnableTrace.argtypes = [ULONG,
+                        ULONG,
+                        ULONG,
                         ct.POINTER(GUID),
                         TRACEHANDLE]
-EnableTrace.restype = ct.c_ulong
+EnableTrace.restype = ULONG
 EnableTrace.errcheck = CheckWinError
 
 
-WMIDPREQUEST = ct.WINFUNCTYPE(ct.c_ulong,
-                              ct.c_ulong,
-                              ct.c_void_p,
-                              ct.c_ulong,
-                              ct.c_void_p)
+WMIDPREQUEST = FUNCTYPE(ULONG,
+                        ULONG,
+                        ct.c_void_p,
+                        ULONG,
+                        ct.c_void_p)
 
 
-RegisterTraceGuids = ct.windll.advapi32.RegisterTraceGuidsW
+RegisterTraceGuids = GetFunction('advapi32', 'RegisterTraceGuidsW')
 RegisterTraceGuids.argtypes = [WMIDPREQUEST,   # RequestAddress
                                ct.c_void_p,  # RequestContext
                                ct.POINTER(GUID),  # ControlGuid
-                               ct.c_ulong,  # GuidCount
+                               ULONG,  # GuidCount
                                # TraceGuidReg
                                ct.POINTER(TRACE_GUID_REGISTRATION),
                                ct.c_wchar_p,  # MofImagePath
                                ct.c_wchar_p,  # MofResourceName
                                ct.POINTER(TRACEHANDLE)]  # RegistrationHandle
-RegisterTraceGuids.restype = ct.c_ulong
+RegisterTraceGuids.restype = ULONG
 RegisterTraceGuids.errcheck = CheckWinError
 
 
-UnregisterTraceGuids = ct.windll.advapi32.UnregisterTraceGuids
+UnregisterTraceGuids = GetFunction('advapi32', 'UnregisterTraceGuids')
 UnregisterTraceGuids.argtypes = [TRACEHANDLE]
-UnregisterTraceGuids.restype = ct.c_ulong
+UnregisterTraceGuids.restype = ULONG
 UnregisterTraceGuids.errcheck = CheckWinError
 
 
-GetTraceLoggerHandle = ct.windll.advapi32.GetTraceLoggerHandle
+GetTraceLoggerHandle = GetFunction('advapi32', 'GetTraceLoggerHandle')
 GetTraceLoggerHandle.argtypes = [ct.c_void_p]
 GetTraceLoggerHandle.restype = TRACEHANDLE
 
 
-GetTraceEnableFlags = ct.windll.advapi32.GetTraceEnableFlags
+GetTraceEnableFlags = GetFunction('advapi32', 'GetTraceEnableFlags')
 GetTraceEnableFlags.argtypes = [TRACEHANDLE]
-GetTraceEnableFlags.restype = ct.c_ulong
+GetTraceEnableFlags.restype = ULONG
 
 
-GetTraceEnableLevel = ct.windll.advapi32.GetTraceEnableLevel
+GetTraceEnableLevel = GetFunction('advapi32', 'GetTraceEnableLevel')
 GetTraceEnableLevel.argtypes = [TRACEHANDLE]
 GetTraceEnableLevel.restype = ct.c_ubyte
 
 
-TraceEvent = ct.windll.advapi32.TraceEvent
+TraceEvent = GetFunction('advapi32', 'TraceEvent')
 TraceEvent.argtypes = [TRACEHANDLE, ct.POINTER(EVENT_TRACE_HEADER)]
-TraceEvent.restype = ct.c_ulong
+TraceEvent.restype = ULONG
 TraceEvent.errcheck = CheckWinError
 
 
 def CheckTraceHandle(result, func, arguments):
-  if result == ct.c_ulong(-1).value:
-    raise exceptions.WindowsError(ct.GetLastError())
+  if result == ULONG(-1).value:
+    raise WindowsError(GetLastError())
 
   return result
 
 
-OpenTrace = ct.windll.advapi32.OpenTraceW
+OpenTrace = GetFunction('advapi32', 'OpenTraceW')
 OpenTrace.argtypes = [ct.POINTER(EVENT_TRACE_LOGFILE)]
 OpenTrace.restype = TRACEHANDLE
 OpenTrace.errcheck = CheckTraceHandle
 
 
-ProcessTrace = ct.windll.advapi32.ProcessTrace
+ProcessTrace = GetFunction('advapi32', 'ProcessTrace')
 ProcessTrace.argtypes = [ct.POINTER(TRACEHANDLE),
-                         ct.c_ulong,
-                         ct.POINTER(wt.FILETIME),
-                         ct.POINTER(wt.FILETIME)]
-ProcessTrace.restype = ct.c_ulong
+                         ULONG,
+                         ct.POINTER(FILETIME),
+                         ct.POINTER(FILETIME)]
+ProcessTrace.restype = ULONG
 ProcessTrace.errcheck = CheckWinError
 
 
-CloseTrace = ct.windll.advapi32.CloseTrace
+CloseTrace = GetFunction('advapi32', 'CloseTrace')
 CloseTrace.argtypes = [TRACEHANDLE]
-CloseTrace.restype = ct.c_ulong
+CloseTrace.restype = ULONG
 CloseTrace.errcheck = CheckWinError
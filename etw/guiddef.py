@@ -32,7 +32,8 @@ class GUID(ctypes.Structure):
       for i in range(8):
         self.Data4[i] = g[3 + i]
 
-  _fields_ = [("Data1", ctypes.c_ulong),
+  # Data1 is a ULONG, which is 32 bits on every platform.
+  _fields_ = [("Data1", ctypes.c_uint32),
               ("Data2", ctypes.c_ushort),
               ("Data3", ctypes.c_ushort),
               ("Data4", ctypes.c_ubyte * 8)]
@@ -0,0 +1,460 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Counters for the events a TraceEventSource consumes.
+
+Set a TraceStatistics on an event source with SetStatistics, and it counts
+the events and payload bytes dispatched per provider, the time spent
+decoding each EventClass and in each handler, the exceptions they raise,
+and the buffers delivered. WatchSession additionally polls the lost event
+and lost buffer counts of a running realtime session.
+
+Snapshot returns the counters as a dict, and FormatPrometheus formats them
+in the Prometheus text exposition format, so ingestion lag can be alerted on:
+
+  statistics = instrumentation.TraceStatistics()
+  statistics.WatchSession('My Session')
+  source.SetStatistics(statistics)
+  ...
+  print instrumentation.FormatPrometheus(statistics.Snapshot())
+
+Only events that have handlers are counted, as the others are skipped on
+their header alone. When events are dispatched from several threads, as by
+a PipelineTraceEventSource with several workers, the counts are approximate.
+"""
+from ctypes import POINTER
+from etw import controller
+from etw import etl
+from etw import evntrace
+import logging
+import threading
+import time
+import timeit
+
+
+# The default number of seconds between polls of a session's counters.
+DEFAULT_POLL_INTERVAL = 10.0
+
+# The default number of polls a SessionMonitor keeps.
+DEFAULT_HISTORY_SIZE = 360
+
+_LP_EVENT_TRACE = POINTER(evntrace.EVENT_TRACE)
+_LP_EVENT_RECORD = POINTER(evntrace.EVENT_RECORD)
+
+_clock = timeit.default_timer
+
+
+def _GetPayloadLength(event_trace):
+  """Returns the payload length of an event, in any of its formats."""
+  if isinstance(event_trace, etl.EventRecord):
+    return event_trace.user_data_length
+  elif isinstance(event_trace, _LP_EVENT_RECORD):
+    return event_trace.contents.UserDataLength
+  elif isinstance(event_trace, _LP_EVENT_TRACE):
+    return event_trace.contents.MofLength
+  return 0
+
+
+def GetDecoderName(event_class, version):
+  """Returns a name for an EventClass, as module.Class/version.
+
+  The name includes the version, as each version of an event usually has an
+  EventClass of its own, with the same class name.
+  """
+  return '%s.%s/%d' % (event_class.__module__.split('.')[-1],
+                       event_class.__name__, version)
+
+
+def GetHandlerName(handler):
+  """Returns a name for a bound handler method, as Class.Method."""
+  instance = getattr(handler, '__self__', None)
+  name = getattr(handler, '__name__', repr(handler))
+  if instance is None:
+    return name
+  return '%s.%s' % (type(instance).__name__, name)
+
+
+class _Counter(object):
+  """Counts the calls to a decoder or handler, and the time they take."""
+  __slots__ = ('count', 'seconds', 'exceptions')
+
+  def __init__(self):
+    self.count = 0
+    self.seconds = 0.0
+    self.exceptions = 0
+
+  def Snapshot(self):
+    return {'count': self.count,
+            'seconds': self.seconds,
+            'exceptions': self.exceptions}
+
+
+class _ProviderCounter(object):
+  """Counts the events of a provider, and their payload bytes."""
+  __slots__ = ('events', 'bytes')
+
+  def __init__(self):
+    self.events = 0
+    self.bytes = 0
+
+
+class _TimedDecoder(object):
+  """Stands in for an EventClass in the dispatch index of a source."""
+
+  def __init__(self, event_class, counter, provider_counter):
+    self._event_class = event_class
+    self._counter = counter
+    self._provider_counter = provider_counter
+
+  def __call__(self, session, event_trace, lazy=False):
+    provider_counter = self._provider_counter
+    provider_counter.events += 1
+    provider_counter.bytes += _GetPayloadLength(event_trace)
+    counter = self._counter
+    start = _clock()
+    try:
+      return self._event_class(session, event_trace, lazy)
+    except:
+      counter.exceptions += 1
+      raise
+    finally:
+      counter.count += 1
+      counter.seconds += _clock() - start
+
+
+class _TimedHandler(object):
+  """Stands in for a handler method, and times its calls."""
+
+  def __init__(self, handler, counter):
+    self._handler = handler
+    self._counter = counter
+
+  def __call__(self, event_data):
+    counter = self._counter
+    start = _clock()
+    try:
+      self._handler(event_data)
+    except:
+      counter.exceptions += 1
+      raise
+    finally:
+      counter.count += 1
+      counter.seconds += _clock() - start
+
+
+class SessionMonitor(object):
+  """Polls the lost event and buffer counts of a running trace session.
+
+  Attributes:
+    name: the name of the session.
+    history: a list of (time, events lost, realtime buffers lost, buffers
+        written) tuples, one per poll, oldest first.
+  """
+
+  def __init__(self, name, interval=DEFAULT_POLL_INTERVAL,
+               history_size=DEFAULT_HISTORY_SIZE):
+    """Creates an idle monitor.
+
+    Args:
+      name: the name of the session to poll.
+      interval: the number of seconds between polls once started.
+      history_size: the largest number of polls kept in history.
+    """
+    self.name = name
+    self.history = []
+    self._interval = interval
+    self._history_size = history_size
+    self._stopped = threading.Event()
+    self._thread = None
+
+  def Poll(self):
+    """Queries the session's counters, and adds them to the history."""
+    properties = controller.QueryTrace(self.name).get().contents
+    self.history.append((time.time(), properties.EventsLost,
+                         properties.RealTimeBuffersLost,
+                         properties.BuffersWritten))
+    del self.history[:-self._history_size]
+
+  def Start(self):
+    """Starts polling on a background thread."""
+    self._stopped.clear()
+    self._thread = threading.Thread(target=self._Run,
+                                    name='SessionMonitor %s' % self.name)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def Stop(self):
+    """Stops polling."""
+    self._stopped.set()
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+
+  def _Run(self):
+    while not self._stopped.is_set():
+      try:
+        self.Poll()
+      except:
+        # The session may not have started yet, or may be gone.
+        logging.exception('Exception querying session %s', self.name)
+      self._stopped.wait(self._interval)
+
+  def Snapshot(self):
+    """Returns the latest counts of the session, as a dict.
+
+    The rates are over the polls in history, and are zero until the session
+    has been polled twice.
+    """
+    result = {'events_lost': 0,
+              'realtime_buffers_lost': 0,
+              'buffers_written': 0,
+              'events_lost_per_second': 0.0,
+              'realtime_buffers_lost_per_second': 0.0}
+    history = self.history[:]
+    if not history:
+      return result
+    last_time, events_lost, buffers_lost, buffers_written = history[-1]
+    result['events_lost'] = events_lost
+    result['realtime_buffers_lost'] = buffers_lost
+    result['buffers_written'] = buffers_written
+    first_time, first_events_lost, first_buffers_lost, _ = history[0]
+    if last_time > first_time:
+      span = last_time - first_time
+      result['events_lost_per_second'] = (
+          (events_lost - first_events_lost) / span)
+      result['realtime_buffers_lost_per_second'] = (
+          (buffers_lost - first_buffers_lost) / span)
+    return result
+
+
+class TraceStatistics(object):
+  """Counts the events, buffers, decode and handler time of event sources.
+
+  Attributes:
+    start_time: the time the counters were last reset.
+    buffer_count: the number of buffer callbacks.
+  """
+
+  def __init__(self):
+    self.start_time = time.time()
+    self.buffer_count = 0
+    # Keyed by the raw provider GUID, the decoder name and the handler name.
+    self._providers = {}
+    self._decoders = {}
+    self._handlers = {}
+    self._monitors = []
+
+  def Reset(self):
+    """Zeroes all the counters.
+
+    The counters are zeroed in place, so the sources the statistics are set
+    on keep updating them.
+    """
+    self.start_time = time.time()
+    self.buffer_count = 0
+    for counter in self._providers.values():
+      counter.events = 0
+      counter.bytes = 0
+    for counter in self._decoders.values() + self._handlers.values():
+      counter.count = 0
+      counter.seconds = 0.0
+      counter.exceptions = 0
+
+  def WatchSession(self, name, interval=DEFAULT_POLL_INTERVAL):
+    """Starts polling the lost event counts of a running session.
+
+    Args:
+      name: the name of the session, as passed to OpenRealtimeSession.
+      interval: the number of seconds between polls.
+
+    Returns:
+      The SessionMonitor polling the session.
+    """
+    monitor = SessionMonitor(name, interval)
+    monitor.Start()
+    self._monitors.append(monitor)
+    return monitor
+
+  def Close(self):
+    """Stops polling the watched sessions."""
+    for monitor in self._monitors:
+      monitor.Stop()
+
+  def WrapDecoder(self, key, event_class, name):
+    """Returns a callable that counts and times the decoding of events.
+
+    Args:
+      key: the (raw guid, version, kind) of the events.
+      event_class: the EventClass to decode them with, which may already be
+          wrapped by another instrument.
+      name: the name of the EventClass, from GetDecoderName.
+    """
+    provider_counter = self._providers.get(key[0], None)
+    if provider_counter is None:
+      provider_counter = self._providers[key[0]] = _ProviderCounter()
+    counter = self._decoders.get(name, None)
+    if counter is None:
+      counter = self._decoders[name] = _Counter()
+    return _TimedDecoder(event_class, counter, provider_counter)
+
+  def WrapHandler(self, handler, name):
+    """Returns a callable that counts and times the calls to a handler.
+
+    Args:
+      handler: the bound handler method, which may already be wrapped by
+          another instrument.
+      name: the name of the handler, from GetHandlerName.
+    """
+    counter = self._handlers.get(name, None)
+    if counter is None:
+      counter = self._handlers[name] = _Counter()
+    return _TimedHandler(handler, counter)
+
+  def CountBuffer(self):
+    """Counts a buffer callback."""
+    self.buffer_count += 1
+
+  def Snapshot(self):
+    """Returns the current counters as a dict.
+
+    Returns:
+      A dict with the following items:
+        time: the time of the snapshot.
+        elapsed: the number of seconds since the counters were reset.
+        buffers: the number of buffer callbacks.
+        exceptions: the number of exceptions raised by decoders and
+            handlers.
+        providers: a dict from provider GUID, in registry format, to a dict
+            of events, bytes, events_per_second and bytes_per_second.
+        decoders: a dict from decoder name, see GetDecoderName, to a dict of count, seconds
+            and exceptions.
+        handlers: a dict from handler name to a dict of count, seconds and
+            exceptions.
+        sessions: a dict from the name of each watched session to the
+            snapshot of its SessionMonitor.
+    """
+    now = time.time()
+    elapsed = now - self.start_time
+    rate = elapsed and 1.0 / elapsed
+    providers = {}
+    for raw_guid, counter in self._providers.items():
+      providers[etl.GuidToString(raw_guid)] = {
+          'events': counter.events,
+          'bytes': counter.bytes,
+          'events_per_second': counter.events * rate,
+          'bytes_per_second': counter.bytes * rate}
+    decoders = {}
+    for name, counter in self._decoders.items():
+      decoders[name] = counter.Snapshot()
+    handlers = {}
+    for name, counter in self._handlers.items():
+      handlers[name] = counter.Snapshot()
+    exceptions = sum(counter['exceptions'] for counter in
+                     decoders.values() + handlers.values())
+    sessions = {}
+    for monitor in self._monitors:
+      sessions[monitor.name] = monitor.Snapshot()
+    return {'time': now,
+            'elapsed': elapsed,
+            'buffers': self.buffer_count,
+            'exceptions': exceptions,
+            'providers': providers,
+            'decoders': decoders,
+            'handlers': handlers,
+            'sessions': sessions}
+
+
+def _FormatLabel(value):
+  return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+      '\n', r'\n')
+
+
+def _FormatValue(value):
+  if isinstance(value, float):
+    return repr(value)
+  return '%d' % value
+
+
+def _FormatMetric(lines, name, metric_type, help_text, label, values):
+  """Appends a metric to lines, with one sample per (label value, value)."""
+  lines.append('# HELP %s %s' % (name, help_text))
+  lines.append('# TYPE %s %s' % (name, metric_type))
+  if label is None:
+    for unused_label, value in values:
+      lines.append('%s %s' % (name, _FormatValue(value)))
+    return
+  for label_value, value in sorted(values):
+    lines.append('%s{%s="%s"} %s' % (name, label, _FormatLabel(label_value),
+                                     _FormatValue(value)))
+
+
+def FormatPrometheus(snapshot, prefix='etw'):
+  """Formats a TraceStatistics snapshot in the Prometheus text format.
+
+  The counters are exported as counters, so their rates are computed by the
+  Prometheus server, while the lost counts of watched sessions are exported
+  as gauges, as they restart with the session.
+
+  Args:
+    snapshot: a dict returned by TraceStatistics.Snapshot.
+    prefix: the prefix of the metric names.
+
+  Returns:
+    The metrics, as a string.
+  """
+  lines = []
+  def Metric(name, metric_type, help_text, label, values):
+    _FormatMetric(lines, '%s_%s' % (prefix, name), metric_type, help_text,
+                  label, values)
+
+  providers = snapshot['providers'].items()
+  Metric('events_total', 'counter', 'Events dispatched, by provider.',
+         'provider', [(guid, p['events']) for guid, p in providers])
+  Metric('event_bytes_total', 'counter',
+         'Payload bytes of the events dispatched, by provider.',
+         'provider', [(guid, p['bytes']) for guid, p in providers])
+
+  decoders = snapshot['decoders'].items()
+  Metric('decode_total', 'counter', 'Events decoded, by event class.',
+         'event_class', [(name, d['count']) for name, d in decoders])
+  Metric('decode_seconds_total', 'counter',
+         'Time spent decoding events, by event class.',
+         'event_class', [(name, d['seconds']) for name, d in decoders])
+
+  handlers = snapshot['handlers'].items()
+  Metric('handler_calls_total', 'counter', 'Calls to handlers, by handler.',
+         'handler', [(name, h['count']) for name, h in handlers])
+  Metric('handler_seconds_total', 'counter',
+         'Time spent in handlers, by handler.',
+         'handler', [(name, h['seconds']) for name, h in handlers])
+
+  Metric('exceptions_total', 'counter',
+         'Exceptions raised by decoders and handlers.',
+         None, [(None, snapshot['exceptions'])])
+  Metric('buffers_total', 'counter', 'Buffer callbacks.',
+         None, [(None, snapshot['buffers'])])
+
+  sessions = snapshot['sessions'].items()
+  if sessions:
+    Metric('session_events_lost', 'gauge',
+           'Events lost by the session, as of the last poll.',
+           'session', [(name, s['events_lost']) for name, s in sessions])
+    Metric('session_realtime_buffers_lost', 'gauge',
+           'Realtime buffers lost by the session, as of the last poll.',
+           'session', [(name, s['realtime_buffers_lost'])
+                       for name, s in sessions])
+    Metric('session_buffers_written', 'gauge',
+           'Buffers written by the session, as of the last poll.',
+           'session', [(name, s['buffers_written']) for name, s in sessions])
+  return '\n'.join(lines) + '\n'
@@ -0,0 +1,135 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""The native bindings of the etw package, behind a platform backend.
+
+The structures, descriptors and log file parsing of the package are plain
+python and ctypes, and work on any host. Only the Event Tracing for Windows
+APIs themselves need Windows. This module binds those through a
+backend, so that the rest of the package imports anywhere:
+
+  WindowsBackend binds the APIs in the system DLLs with ctypes.windll.
+  OfflineBackend stands in on other hosts. Its functions can be declared
+  like ctypes functions, but raise NotImplementedError when called.
+
+The module also declares the Windows types the structures are made of with
+their Windows sizes, which differ from the native C types of some other
+hosts: a ULONG, for instance, is 32 bits on 64 bit Linux too.
+"""
+import ctypes
+import exceptions
+import sys
+
+
+# The Win32 error codes the package uses, from winerror.h.
+ERROR_SUCCESS = 0
+ERROR_INVALID_PARAMETER = 87
+
+# The Windows data types, with their Windows sizes.
+BYTE = ctypes.c_uint8
+WORD = ctypes.c_uint16
+USHORT = ctypes.c_uint16
+ULONG = ctypes.c_uint32
+LONG = ctypes.c_int32
+ULONGLONG = ctypes.c_uint64
+LARGE_INTEGER = ctypes.c_int64
+HANDLE = ctypes.c_void_p
+
+
+class FILETIME(ctypes.Structure):
+  _fields_ = [('dwLowDateTime', ctypes.c_uint32),
+              ('dwHighDateTime', ctypes.c_uint32)]
+
+
+try:
+  WindowsError = exceptions.WindowsError
+except AttributeError:
+  class WindowsError(OSError):
+    """Stands in for the WindowsError of Windows hosts."""
+
+
+class WindowsBackend(object):
+  """Binds the native APIs on Windows hosts.
+
+  Attributes:
+    FUNCTYPE: the factory of callback function types, for the stdcall
+        calling convention.
+  """
+  is_native = True
+  FUNCTYPE = staticmethod(getattr(ctypes, 'WINFUNCTYPE', None))
+
+  def GetFunction(self, dll_name, function_name):
+    """Returns a ctypes function exported by a system DLL."""
+    return getattr(getattr(ctypes.windll, dll_name), function_name)
+
+  def GetLastError(self):
+    return ctypes.GetLastError()
+
+
+class _UnavailableFunction(object):
+  """Stands in for a ctypes function of a DLL that isn't available.
+
+  Its argtypes, restype and errcheck can be set like those of a ctypes
+  function, so bindings can be declared as usual.
+  """
+
+  def __init__(self, dll_name, function_name):
+    self.__name__ = function_name
+    self._dll_name = dll_name
+    self.argtypes = None
+    self.restype = None
+    self.errcheck = None
+
+  def __call__(self, *args):
+    raise NotImplementedError('%s!%s is only available on Windows.' %
+                              (self._dll_name, self.__name__))
+
+
+class OfflineBackend(object):
+  """Stands in for the native APIs on hosts without them.
+
+  Attributes:
+    FUNCTYPE: the factory of callback function types. Callbacks are never
+        called, but their types are part of structures.
+  """
+  is_native = False
+  FUNCTYPE = staticmethod(ctypes.CFUNCTYPE)
+
+  def GetFunction(self, dll_name, function_name):
+    """Returns a stand in for a function, that raises NotImplementedError."""
+    return _UnavailableFunction(dll_name, function_name)
+
+  def GetLastError(self):
+    return 0
+
+
+if sys.platform == 'win32':
+  backend = WindowsBackend()
+else:
+  backend = OfflineBackend()
+
+
+def GetFunction(dll_name, function_name):
+  """Returns a function exported by a system DLL, from the backend."""
+  return backend.GetFunction(dll_name, function_name)
+
+
+def FUNCTYPE(restype, *argtypes):
+  """Returns the type of callbacks to the native APIs."""
+  return backend.FUNCTYPE(restype, *argtypes)
+
+
+def GetLastError():
+  """Returns the last error of the calling thread, from the backend."""
+  return backend.GetLastError()
@@ -0,0 +1,248 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Decodes log files in a pool of processes.
+
+A log file is a sequence of fixed-size buffers, so it can be split into shards
+of whole buffers, which are decoded independently by worker processes.
+
+For the ordinary consumers, the workers decode the events that have handlers,
+sort them by time stamp, and send them back. The shards are then merged in
+time stamp order, and dispatched to the handlers in this process.
+
+Consumers that declare themselves order independent are instead pickled and
+sent to the workers, each of which runs a copy of the consumer on its shard,
+with the buffer callbacks of EtlFileEventSource. The copies are sent back, and
+once all the sessions are consumed, combined with the consumer's Reduce
+method.
+
+Note that on Windows, the pool re-imports the main module in each worker, so
+scripts using this module must guard their entry point with
+if __name__ == '__main__'.
+"""
+from etw import consumer
+from etw import etl
+from etw.descriptors import event
+import logging
+import multiprocessing
+import operator
+
+
+# The default number of buffers in each shard of a log file.
+DEFAULT_BUFFERS_PER_SHARD = 256
+
+
+def _CopyRecord(record):
+  """Returns a copy of an etl.EventRecord that holds just its payload.
+
+  The buffer the record was read from may be memory mapped, and can't be
+  pickled.
+  """
+  data = record.user_data
+  if isinstance(data, memoryview):
+    data = data.tobytes()
+  else:
+    data = str(data)
+  return etl.EventRecord(record.header_type, record.provider_id,
+                         record.version, record.event_type, record.level,
+                         record.keyword, record.process_id, record.thread_id,
+                         record.time_stamp, record.processor, data, 0,
+                         len(data))
+
+
+def _DecodeShard(shard):
+  """Decodes the events in a set of buffers of a log file.
+
+  This runs in the worker processes.
+
+  Args:
+    shard: a (path, raw_time, use_mmap, buffers, wanted, decode, event_filter,
+        lazy, consumers) tuple, where buffers is the list of the indexes of
+        the buffers to read, and wanted is the set of (raw guid, version,
+        event_type) keys of the events to return. If decode is False, the
+        events are returned as etl.EventRecords rather than decoded.
+        event_filter is the EventFilter the events must pass, or None, and
+        consumers is a list of order independent consumers to run, with the
+        lazy option of the source.
+
+  Returns:
+    An (events, consumers) tuple. The events are (raw_time_stamp, key,
+    event) tuples, sorted by time stamp, where key is the (raw guid,
+    version, event_type) of the event.
+
+  Raises:
+    TraceCancelledError: processing was terminated by an exception in one of
+        the consumers.
+  """
+  (path, raw_time, use_mmap, buffers, wanted, decode, event_filter, lazy,
+   consumers) = shard
+  log = etl.EtlFile(path, raw_time, use_mmap)
+  try:
+    log.SelectBuffers(buffers)
+    source = consumer.EtlFileEventSource(consumers, raw_time, lazy=lazy)
+    source.SetFilter(event_filter)
+    events = []
+    # Maps the keys of the wanted events to their EventClass.
+    class_cache = {}
+    for etl_buffer in log.IterBuffers():
+      for record in etl_buffer.IterEvents():
+        if consumers:
+          source._ProcessEtlEventCallback(log, record)
+
+        key = record.provider_id, record.version, record.event_type
+        if key not in wanted:
+          continue
+        if event_filter is not None and not event_filter.MatchRecord(log,
+                                                                     record):
+          continue
+        if not decode:
+          events.append((record.time_stamp, key, _CopyRecord(record)))
+          continue
+        event_class = class_cache.get(key, None)
+        if event_class is None:
+          event_class = class_cache[key] = event.EventClass.Get(
+              etl.GuidToString(key[0]), key[1], key[2])
+        events.append((record.time_stamp, key, event_class(log, record)))
+      if consumers and not source._ProcessBufferCallback(log, etl_buffer):
+        raise consumer.TraceCancelledError('Processing of %s was cancelled.' %
+                                           path)
+    if consumers:
+      try:
+        source._FlushBatches()
+      except:
+        logging.exception('Exception in batch handler, terminating parsing')
+        raise consumer.TraceCancelledError('Processing of %s was cancelled.' %
+                                           path)
+  finally:
+    log.Close()
+
+  events.sort(key=operator.itemgetter(0))
+  return events, consumers
+
+
+class ParallelEtlEventSource(consumer.EtlFileEventSource):
+  """A log file consumer that decodes each file in a pool of processes.
+
+  Events are dispatched to the ordinary consumers in time stamp order, which
+  is stricter than the file order of EtlFileEventSource. Their buffer
+  callbacks are not made, but those of the order independent consumers are,
+  in the workers. The filter set with SetFilter, and the buffers selected by
+  OpenFileSession, apply to the workers as well.
+
+  All the events that have handlers are read before any of them are
+  dispatched, so they all have to fit in memory at once. They're decoded in
+  the workers, unless the source is lazy, or has statistics or a profiler
+  set. The workers then only select and sort the events, which are decoded
+  in this process, so that their decoding is counted and timed. The order
+  independent consumers aren't counted or timed.
+  """
+
+  def __init__(self, handlers=[], raw_time=False, use_mmap=False,
+               processes=None, buffers_per_shard=DEFAULT_BUFFERS_PER_SHARD,
+               lazy=False):
+    """Creates an idle consumer.
+
+    Args:
+      handlers: an optional list of handlers to consume the log(s).
+          Each handler should be an object derived from EventConsumer.
+      raw_time: if True, consume logs with the raw time option. This allows
+          converting stamps recorded in events to wall-clock time.
+      use_mmap: if True, the workers memory map the log files rather than
+          reading them a buffer at a time.
+      processes: the number of worker processes. By default, this is the
+          number of processors.
+      buffers_per_shard: the number of buffers decoded by a worker at once.
+      lazy: if True, the events handed to the handlers decode their fields
+          the first time they're read, rather than up front.
+    """
+    # The order independent consumers run in the workers, so they're kept
+    # out of the handlers of the dispatch index.
+    self._independent = [h for h in handlers if h.order_independent]
+    super(ParallelEtlEventSource, self).__init__(
+        [h for h in handlers if not h.order_independent], raw_time, use_mmap,
+        lazy=lazy)
+    self._processes = processes
+    self._buffers_per_shard = buffers_per_shard
+
+  def AddHandler(self, handler):
+    """Add a new handler to this consumer.
+
+    Args:
+      handler: the handler to add.
+    """
+    if handler.order_independent:
+      self._independent.append(handler)
+    else:
+      super(ParallelEtlEventSource, self).AddHandler(handler)
+
+  def Consume(self):
+    """Consume all open sessions.
+
+    Raises:
+      TraceCancelledError: processing was terminated by an exception in a
+          handler.
+    """
+    index = self._GetDispatchIndex()
+    wanted = frozenset(index)
+    decode = not (self._lazy or self._GetInstruments())
+    independent = self._independent
+    # The copies of the order independent consumers sent back by the
+    # workers. The consumers are only reduced once all the sessions are
+    # consumed, so that the workers of each session start from the same
+    # state.
+    copies = [[] for handler in independent]
+
+    pool = multiprocessing.Pool(self._processes)
+    try:
+      for session in self._trace_sessions:
+        buffers = session.selected_buffers
+        if buffers is None:
+          buffers = range(session.buffer_count)
+        size = self._buffers_per_shard
+        shards = [(session.path, self._raw_time, self._use_mmap,
+                   buffers[start:start + size], wanted, decode, self._filter,
+                   self._lazy, independent)
+                  for start in xrange(0, len(buffers), size)]
+        results = pool.map(_DecodeShard, shards)
+
+        # Each shard is sorted already, which the merge sort takes advantage
+        # of. It's also stable, so events with equal time stamps stay in file
+        # order.
+        events = []
+        for shard_events, consumers in results:
+          events.extend(shard_events)
+          for i, copy in enumerate(consumers):
+            copies[i].append(copy)
+        events.sort(key=operator.itemgetter(0))
+        self._DispatchEvents(session, index, decode, events)
+    finally:
+      pool.close()
+      pool.join()
+
+    for handler, handler_copies in zip(independent, copies):
+      handler.Reduce(handler_copies)
+
+  def _DispatchEvents(self, session, index, decoded, events):
+    try:
+      for unused_time_stamp, key, event_obj in events:
+        event_class, handlers = index[key]
+        if not decoded:
+          event_obj = event_class(session, event_obj, self._lazy)
+        for handler in handlers:
+          handler(event_obj)
+      self._FlushBatches()
+    except:
+      logging.exception('Exception in handler, terminating parsing')
+      raise consumer.TraceCancelledError('Processing of %s was cancelled.' %
+                                         session.path)
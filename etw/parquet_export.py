@@ -0,0 +1,201 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Exports decoded log events as Apache Arrow record batches and Parquet files.
+
+The events of each EventClass are collected into columnar.Table rows, and
+turned into Arrow record batches of a bounded size as they fill up. The
+values of variable size columns are interned per batch, and each batch gets
+its own dictionary of them, so a log of any size can be exported in memory
+bounded by the batch size. The schema of each batch is
+derived from the EventClass' _fields_, after the process_id, thread_id,
+raw_time_stamp and time_stamp header columns.
+
+ExportParquet writes the batches of each EventClass to its own Parquet file,
+one row group per batch, with row group statistics on the header columns.
+This lets later queries on time, process or thread skip most row groups.
+
+This module requires pyarrow, and NumPy, which pyarrow depends on.
+"""
+from etw import columnar
+from etw.descriptors import field
+
+try:
+  import pyarrow
+  import pyarrow.parquet
+except ImportError:
+  pyarrow = None
+
+
+# The default number of events in a record batch, and in a row group.
+DEFAULT_BATCH_SIZE = 65536
+
+# The columns to keep row group statistics for.
+STATISTICS_COLUMNS = [name for name, f in columnar.HEADER_COLUMNS]
+
+# The names of the Arrow types for the struct formats of fixed size columns.
+_FIXED_TYPES = {
+  '?': 'bool_',
+  'b': 'int8',
+  'B': 'uint8',
+  'h': 'int16',
+  'H': 'uint16',
+  'i': 'int32',
+  'I': 'uint32',
+  'q': 'int64',
+  'Q': 'uint64',
+  'd': 'float64',
+}
+
+# The names of the Arrow types for variable size fields, and the functions
+# that convert their values. Fields that aren't listed are stored as binary.
+_VARIABLE_TYPES = {
+  field.String: ('binary', str),
+  field.WString: ('string', unicode),
+  field.CountedWString: ('string', unicode),
+  field.CountedBlob: ('binary', str),
+  field.Sid: ('string', unicode),
+}
+
+
+def _CheckPyArrow():
+  if pyarrow is None:
+    raise ImportError('pyarrow is required to export events.')
+
+
+class RecordBatchBuilder(object):
+  """Builds Arrow record batches out of the events of an EventClass.
+
+  Attributes:
+    event_class: the EventClass whose events are collected.
+    schema: the pyarrow.Schema of the record batches.
+  """
+
+  def __init__(self, event_class):
+    """Creates a builder for the events of event_class.
+
+    Raises:
+      ImportError: pyarrow is not installed.
+    """
+    _CheckPyArrow()
+    self.event_class = event_class
+    self._table = columnar.Table(event_class)
+    fields = dict(getattr(event_class, '_fields_', []))
+    # (name, StringTable, arrow type, convert) tuples for variable columns.
+    self._variable = []
+    arrow_fields = []
+    for name, struct_format in self._table.columns:
+      string_table = self._table.strings.get(name, None)
+      if string_table is None:
+        arrow_type = getattr(pyarrow, _FIXED_TYPES[struct_format])()
+      else:
+        type_name, convert = _VARIABLE_TYPES.get(fields[name], ('binary', str))
+        arrow_type = getattr(pyarrow, type_name)()
+        self._variable.append((name, string_table, arrow_type, convert))
+      arrow_fields.append(pyarrow.field(name, arrow_type))
+    self.schema = pyarrow.schema(arrow_fields)
+
+  @property
+  def row_count(self):
+    """The number of events collected since the last batch was built."""
+    return self._table.row_count
+
+  def Add(self, log_session, record):
+    """Decodes an event and adds it to the next batch.
+
+    Args:
+      log_session: the etl.EtlFile the event was read from.
+      record: the etl.EventRecord to decode.
+    """
+    self._table.Add(log_session, record)
+
+  def Flush(self):
+    """Returns the collected events as a pyarrow.RecordBatch.
+
+    The events are removed from the builder, along with the values of the
+    variable size columns, which the rows of the next batch intern afresh.
+    """
+    rows = self._table.TakeArray()
+    columns = {}
+    for name, string_table, arrow_type, convert in self._variable:
+      # None, such as a NULL SID, is a null rather than converted.
+      dictionary = pyarrow.array([None if v is None else convert(v)
+                                  for v in string_table.values],
+                                 type=arrow_type)
+      string_table.Clear()
+      columns[name] = dictionary.take(pyarrow.array(rows[name].copy()))
+
+    arrays = []
+    for arrow_field in self.schema:
+      array = columns.get(arrow_field.name, None)
+      if array is None:
+        array = pyarrow.array(rows[arrow_field.name].copy(),
+                              type=arrow_field.type)
+      arrays.append(array)
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+
+def IterRecordBatches(source, event_classes, batch_size=DEFAULT_BATCH_SIZE):
+  """Decodes the events of the given classes into Arrow record batches.
+
+  Args:
+    source: an EtlFileEventSource with open file sessions.
+    event_classes: the EventClass subclasses to decode.
+    batch_size: the maximum number of events in a batch.
+
+  Yields:
+    (event_class, pyarrow.RecordBatch) tuples. The batches of each class are
+    yielded in log order, and all have the same schema.
+
+  Raises:
+    ImportError: pyarrow is not installed.
+  """
+  builders = dict((event_class, RecordBatchBuilder(event_class))
+                  for event_class in event_classes)
+  for event_class, session, record in columnar.IterClassEvents(source,
+                                                               event_classes):
+    builder = builders[event_class]
+    builder.Add(session, record)
+    if builder.row_count >= batch_size:
+      yield event_class, builder.Flush()
+  for event_class, builder in builders.iteritems():
+    if builder.row_count:
+      yield event_class, builder.Flush()
+
+
+def ExportParquet(source, outputs, batch_size=DEFAULT_BATCH_SIZE):
+  """Writes the events of the given classes to Parquet files.
+
+  Args:
+    source: an EtlFileEventSource with open file sessions.
+    outputs: a map from each EventClass subclass to export, to the path of
+        the Parquet file to write its events to.
+    batch_size: the maximum number of events in a row group.
+
+  Raises:
+    ImportError: pyarrow is not installed.
+  """
+  _CheckPyArrow()
+  writers = {}
+  try:
+    for event_class, path in outputs.iteritems():
+      schema = RecordBatchBuilder(event_class).schema
+      writers[event_class] = pyarrow.parquet.ParquetWriter(
+          path, schema, write_statistics=STATISTICS_COLUMNS)
+    for event_class, batch in IterRecordBatches(source, outputs.keys(),
+                                                batch_size):
+      writers[event_class].write_table(pyarrow.Table.from_batches([batch]))
+  finally:
+    for writer in writers.itervalues():
+      writer.close()
@@ -0,0 +1,313 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Decodes and dispatches events on worker threads, off the ETW callbacks.
+
+TraceEventSource decodes each event and calls its handlers inside the event
+callback, on the thread ProcessTrace runs on. While a handler runs, ETW can't
+deliver any more buffers to the session, and a realtime session that falls
+behind loses buffers.
+
+PipelineTraceEventSource only reads the header of each event in the callback.
+Events with handlers that pass the filter are copied, header and payload, into
+a preallocated ring_buffer.RingBuffer, and the callback returns. A reader
+thread takes the events out of the ring, and decodes and dispatches them,
+either itself or on a pool of worker threads. When the ring is full, events
+are dropped and counted rather than holding up the callback.
+
+With a single worker, which is the default, handlers see events in the order
+they were delivered, and ProcessBuffer and the batch handlers are called at
+buffer boundaries, as usual. The ETW buffer is only valid during the buffer
+callback, though, so ProcessBuffer is passed None for it. With more workers, handlers are called from
+several threads at once and out of order, so they must be thread safe.
+"""
+from ctypes import c_void_p, memmove, sizeof, string_at
+from etw import consumer
+from etw import etl
+from etw import evntrace
+from etw import ring_buffer
+import logging
+import Queue
+import struct
+import threading
+
+
+# The number of decoded events that can wait for the workers, when there
+# are several. When they fall behind, the ring fills up.
+_WORKER_QUEUE_SIZE = 1024
+
+# The records in the ring are either events, followed by their payload, or
+# mark the end of a buffer. They're laid out as the record type, the index
+# of the session, and the header fields of the event: header type, version,
+# event type, level, processor, process ID, thread ID, time stamp, provider
+# GUID and keyword.
+_RECORD = struct.Struct('<BBHHHBBIIq16sQ')
+_EVENT = 0
+_BUFFER_END = 1
+
+_POINTER_FORMAT = 'Q' if sizeof(c_void_p) == 8 else 'I'
+
+# The structs that read all the header fields of an event, along with the
+# location of its payload. The buffer context of an event starts with the
+# number of the processor it was logged on.
+_EVENT_TRACE_FIELDS = consumer._HeaderStruct(
+    evntrace.EVENT_TRACE,
+    [('Header.HeaderType', 'B'),
+     ('Header.Class.Type', 'B'),
+     ('Header.Class.Level', 'B'),
+     ('Header.Class.Version', 'H'),
+     ('Header.ThreadId', 'I'),
+     ('Header.ProcessId', 'I'),
+     ('Header.TimeStamp', 'q'),
+     ('Header.Guid', '16s'),
+     ('MofData', _POINTER_FORMAT),
+     ('MofLength', 'I'),
+     ('ClientContext', 'B')])
+_EVENT_RECORD_FIELDS = consumer._HeaderStruct(
+    evntrace.EVENT_RECORD,
+    [('EventHeader.HeaderType', 'H'),
+     ('EventHeader.ThreadId', 'I'),
+     ('EventHeader.ProcessId', 'I'),
+     ('EventHeader.TimeStamp', 'q'),
+     ('EventHeader.ProviderId', '16s'),
+     ('EventHeader.EventDescriptor.Id', 'H'),
+     ('EventHeader.EventDescriptor.Version', 'B'),
+     ('EventHeader.EventDescriptor.Level', 'B'),
+     ('EventHeader.EventDescriptor.Keyword', 'Q'),
+     ('BufferContext', 'B'),
+     ('UserDataLength', 'H'),
+     ('UserData', _POINTER_FORMAT)])
+
+
+class PipelineTraceEventSource(consumer.TraceEventSource):
+  """A TraceEventSource that dispatches events off the ETW callback thread."""
+
+  def __init__(self, handlers=[], raw_time=False, new_format=True,
+               lazy=False, workers=1,
+               ring_size=ring_buffer.DEFAULT_CAPACITY):
+    """Creates an idle consumer.
+
+    Args:
+      handlers: an optional list of handlers to consume the log(s).
+          Each handler should be an object derived from EventConsumer.
+      raw_time: if True, consume logs with the raw time option. This allows
+          converting stamps recorded in events to wall-clock time.
+      lazy: if True, the events handed to the handlers decode their fields
+          the first time they're read, rather than up front.
+      workers: the number of threads that dispatch events.
+      ring_size: the size in bytes of the ring that holds the events waiting
+          to be dispatched.
+    """
+    super(PipelineTraceEventSource, self).__init__(handlers, raw_time,
+                                                   new_format, lazy)
+    self._worker_count = workers
+    if workers > 1:
+      self._batch_lock = threading.Lock()
+    self._ring_size = ring_size
+    self._ring = None
+    # The sessions that events have arrived on, which are referred to by
+    # their index in the ring.
+    self._sessions = []
+    self._session_indexes = {}
+    # Holds (session, record) tuples for the workers, where record is an
+    # etl.EventRecord, or None at the end of a buffer.
+    self._pending = None
+
+  @property
+  def records_dropped(self):
+    """The number of records dropped because the ring was full.
+
+    The records are the events, and the marks of the ends of buffers, whose
+    ProcessBuffer and batch flush are then skipped.
+    """
+    if self._ring is None:
+      return 0
+    return self._ring.overflow_count
+
+  def Consume(self):
+    """Consume all open sessions.
+
+    Returns once all the events have been dispatched.
+
+    Note: if any of the open sessions are realtime sessions, this function
+      will not return until Close() is called to close the realtime session.
+    """
+    # Build the dispatch index before there are several threads to race for
+    # it.
+    self._GetDispatchIndex()
+    self._ring = ring_buffer.RingBuffer(self._ring_size)
+    reader = threading.Thread(target=self._Read,
+                              name='PipelineTraceEventSource reader')
+    workers = []
+    if self._worker_count > 1:
+      self._pending = Queue.Queue(_WORKER_QUEUE_SIZE)
+      workers = [threading.Thread(target=self._Work,
+                                  name='PipelineTraceEventSource %d' % i)
+                 for i in range(self._worker_count)]
+    for thread in [reader] + workers:
+      thread.daemon = True
+      thread.start()
+    try:
+      self._ProcessTrace()
+    finally:
+      self._ring.Close()
+      reader.join()
+      for unused_thread in workers:
+        self._pending.put(None)
+      for thread in workers:
+        thread.join()
+      self._pending = None
+
+    try:
+      self._FlushBatches()
+    except:
+      logging.exception("Exception in batch handler")
+      self._stop = True
+
+  def ProcessEvent(self, session, event_trace):
+    """Copies a single event into the ring, if it has handlers.
+
+    Args:
+      session: the _TraceLogSession on which this event occurred.
+      event_trace: a POINTER(EVENT_TRACE) for the current event.
+    """
+    (header_type, kind, level, version, thread_id, process_id, time_stamp,
+     guid, mof_data, mof_length, processor) = _EVENT_TRACE_FIELDS.unpack(
+        string_at(event_trace, _EVENT_TRACE_FIELDS.size))
+    self._Enqueue(session, header_type, guid, version, kind, level, None,
+                  process_id, thread_id, time_stamp, processor, mof_data,
+                  mof_length)
+
+  def ProcessEventRecord(self, session, event_record):
+    """Copies a single event into the ring, if it has handlers.
+
+    Args:
+      session: the _TraceLogSession on which this event occurred.
+      event_trace: a POINTER(EVENT_RECORD) for the current event.
+    """
+    (header_type, thread_id, process_id, time_stamp, guid, kind, version,
+     level, keyword, processor, user_data_length,
+     user_data) = _EVENT_RECORD_FIELDS.unpack(
+        string_at(event_record, _EVENT_RECORD_FIELDS.size))
+    self._Enqueue(session, header_type, guid, version, kind, level, keyword,
+                  process_id, thread_id, time_stamp, processor, user_data,
+                  user_data_length)
+
+  def _Enqueue(self, session, header_type, guid, version, kind, level,
+               keyword, process_id, thread_id, time_stamp, processor,
+               user_data, user_data_length):
+    if (guid, version, kind) not in self._GetDispatchIndex():
+      return
+    event_filter = self._filter
+    if event_filter is not None:
+      if not event_filter.Match(session, guid, level, keyword, process_id,
+                                thread_id, time_stamp):
+        return
+
+    ring = self._ring
+    offset = ring.Reserve(_RECORD.size + user_data_length)
+    if offset is None:
+      return
+    _RECORD.pack_into(ring.buffer, offset, _EVENT,
+                      self._GetSessionIndex(session), header_type, version,
+                      kind, level, processor, process_id, thread_id,
+                      time_stamp, guid, keyword or 0)
+    # The payload is only valid for the duration of the callback.
+    if user_data_length:
+      memmove(ring.address + offset + _RECORD.size, user_data,
+              user_data_length)
+    ring.Commit()
+
+  def _ProcessBufferCallback(self, session, buffer):
+    if self._statistics is not None:
+      self._statistics.CountBuffer()
+    if not self._stop:
+      ring = self._ring
+      index = self._GetSessionIndex(session)
+      offset = ring.Reserve(_RECORD.size)
+      # If the ring is full, the batches will be flushed at the end of a
+      # later buffer.
+      if offset is not None:
+        _RECORD.pack_into(ring.buffer, offset, _BUFFER_END, index, 0, 0, 0, 0,
+                          0, 0, 0, 0, '', 0)
+        ring.Commit()
+
+    if self._stop:
+      return 0
+    else:
+      return 1
+
+  def _GetSessionIndex(self, session):
+    index = self._session_indexes.get(session, None)
+    if index is None:
+      index = len(self._sessions)
+      self._sessions.append(session)
+      self._session_indexes[session] = index
+    return index
+
+  def _Read(self):
+    """Takes the events out of the ring, and dispatches them."""
+    ring = self._ring
+    pending = self._pending
+    while True:
+      view = ring.Read()
+      if view is None:
+        return
+      (record_type, index, header_type, version, kind, level, processor,
+       process_id, thread_id, time_stamp, guid,
+       keyword) = _RECORD.unpack_from(view)
+      if record_type == _EVENT:
+        data = view[_RECORD.size:].tobytes()
+      ring.Release()
+      if self._stop:
+        # Drain the ring without dispatching.
+        continue
+
+      session = self._sessions[index]
+      if record_type == _EVENT:
+        item = session, etl.EventRecord(header_type, guid, version, kind,
+                                        level, keyword, process_id,
+                                        thread_id, time_stamp, processor,
+                                        data, 0, len(data))
+      else:
+        item = session, None
+      if pending is None:
+        self._Dispatch(item)
+      else:
+        pending.put(item)
+
+  def _Work(self):
+    pending = self._pending
+    while True:
+      item = pending.get()
+      if item is None:
+        return
+      if not self._stop:
+        self._Dispatch(item)
+
+  def _Dispatch(self, item):
+    session, record = item
+    try:
+      if record is None:
+        self._FlushBatches()
+        self.ProcessBuffer(session, None)
+      else:
+        event_class, handlers = self._GetDispatchIndex()[
+            (record.provider_id, record.version, record.event_type)]
+        event_obj = event_class(session, record, self._lazy)
+        for handler in handlers:
+          handler(event_obj)
+    except:
+      logging.exception("Exception in handler, terminating parsing")
+      self._stop = True
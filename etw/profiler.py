@@ -0,0 +1,227 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Profiles the handlers and event class decoders of a TraceEventSource.
+
+Set a HandlerProfiler on an event source with SetProfiler, and it records
+the calls to each handler method and each EventClass decode: their count,
+their cumulative and maximum wall time, and a histogram of their latency.
+The results are available from GetEntries, and PrintProfile prints them as
+a table, as the source does when it's closed if given a file to print to:
+
+  source.SetProfiler(profiler.HandlerProfiler(sample_interval=100),
+                     sys.stderr)
+
+To keep the overhead low enough to leave on in production, the profiler
+can time only one in sample_interval calls to each function. All calls are
+still counted, and the cumulative time is estimated from the sampled calls.
+"""
+import bisect
+import operator
+import sys
+import timeit
+
+
+# The upper bounds, in seconds, of the buckets of the latency histograms.
+# The last bucket holds the calls slower than the last bound.
+DEFAULT_BUCKET_BOUNDS = (1e-6, 2e-6, 5e-6, 1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4,
+                         1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2, 1e-1, 1.0)
+
+# Maps the sort keys of PrintProfile to the attributes they sort on.
+_SORT_ATTRIBUTES = {
+  'total': 'total_seconds',
+  'max': 'max_seconds',
+  'mean': 'mean_seconds',
+  'count': 'count',
+}
+
+_clock = timeit.default_timer
+
+
+class ProfileEntry(object):
+  """The profile of a handler or decoder.
+
+  Attributes:
+    name: the name of the handler, as Class.Method, or of the decoder, as
+        module.Class/version.
+    kind: 'handler' or 'decode'.
+    count: the number of calls.
+    sampled_count: the number of calls that were timed.
+    sampled_seconds: the total wall time of the timed calls.
+    max_seconds: the wall time of the slowest timed call.
+    histogram: the number of timed calls in each latency bucket.
+  """
+
+  def __init__(self, name, kind, bucket_bounds):
+    self.name = name
+    self.kind = kind
+    self.count = 0
+    self.sampled_count = 0
+    self.sampled_seconds = 0.0
+    self.max_seconds = 0.0
+    self.histogram = [0] * (len(bucket_bounds) + 1)
+    self._bucket_bounds = bucket_bounds
+
+  def AddSample(self, seconds):
+    """Records the wall time of a timed call."""
+    self.sampled_count += 1
+    self.sampled_seconds += seconds
+    if seconds > self.max_seconds:
+      self.max_seconds = seconds
+    self.histogram[bisect.bisect_left(self._bucket_bounds, seconds)] += 1
+
+  @property
+  def mean_seconds(self):
+    """The mean wall time of the timed calls."""
+    if not self.sampled_count:
+      return 0.0
+    return self.sampled_seconds / self.sampled_count
+
+  @property
+  def total_seconds(self):
+    """The estimated cumulative wall time of all the calls."""
+    return self.mean_seconds * self.count
+
+  def GetPercentile(self, percentile):
+    """Returns an upper bound of the latency of a percentile of the calls.
+
+    Args:
+      percentile: the percentile, between 0 and 100.
+
+    Returns:
+      The upper bound of the histogram bucket the percentile falls in, or
+      max_seconds for the last bucket. Zero if no call was timed.
+    """
+    if not self.sampled_count:
+      return 0.0
+    rank = self.sampled_count * percentile / 100.0
+    seen = 0
+    for i, count in enumerate(self.histogram):
+      seen += count
+      if count and seen >= rank:
+        if i < len(self._bucket_bounds):
+          return min(self._bucket_bounds[i], self.max_seconds)
+        break
+    return self.max_seconds
+
+
+class _ProfiledCall(object):
+  """Stands in for a handler or decoder, and profiles its calls."""
+  __slots__ = ('_func', '_entry', '_sample_interval', '_countdown')
+
+  def __init__(self, func, entry, sample_interval):
+    self._func = func
+    self._entry = entry
+    self._sample_interval = sample_interval
+    self._countdown = 1
+
+  def __call__(self, *args):
+    self._entry.count += 1
+    self._countdown -= 1
+    if self._countdown:
+      return self._func(*args)
+
+    self._countdown = self._sample_interval
+    start = _clock()
+    try:
+      return self._func(*args)
+    finally:
+      self._entry.AddSample(_clock() - start)
+
+
+class HandlerProfiler(object):
+  """Profiles the calls to handlers and decoders of the sources it's set on.
+  """
+
+  def __init__(self, sample_interval=1,
+               bucket_bounds=DEFAULT_BUCKET_BOUNDS):
+    """Creates an empty profile.
+
+    Args:
+      sample_interval: time one in this many calls to each function,
+          starting with the first.
+      bucket_bounds: the upper bounds of the latency histogram buckets, in
+          seconds, in increasing order.
+    """
+    self._sample_interval = sample_interval
+    self._bucket_bounds = tuple(bucket_bounds)
+    # Keyed by (kind, name).
+    self._entries = {}
+
+  def _GetEntry(self, kind, name):
+    entry = self._entries.get((kind, name), None)
+    if entry is None:
+      entry = ProfileEntry(name, kind, self._bucket_bounds)
+      self._entries[(kind, name)] = entry
+    return entry
+
+  def WrapDecoder(self, key, event_class, name):
+    """Returns a callable that profiles the decoding of events.
+
+    Args:
+      key: the (raw guid, version, kind) of the events.
+      event_class: the EventClass to decode them with, which may already be
+          wrapped by another instrument.
+      name: the name of the EventClass, from
+          instrumentation.GetDecoderName.
+    """
+    return _ProfiledCall(event_class, self._GetEntry('decode', name),
+                         self._sample_interval)
+
+  def WrapHandler(self, handler, name):
+    """Returns a callable that profiles the calls to a handler.
+
+    Args:
+      handler: the bound handler method, which may already be wrapped by
+          another instrument.
+      name: the name of the handler, from instrumentation.GetHandlerName.
+    """
+    return _ProfiledCall(handler, self._GetEntry('handler', name),
+                         self._sample_interval)
+
+  def GetEntries(self, sort_key='total'):
+    """Returns the ProfileEntry of each function called at least once.
+
+    Args:
+      sort_key: 'total', 'max', 'mean' or 'count', what to sort the entries
+          on in decreasing order.
+    """
+    entries = [entry for entry in self._entries.values() if entry.count]
+    entries.sort(key=operator.attrgetter(_SORT_ATTRIBUTES[sort_key]),
+                 reverse=True)
+    return entries
+
+
+def PrintProfile(profile, sort_key='total', output=sys.stdout):
+  """Prints a profile as a table, with one row per handler or decoder.
+
+  Times are in microseconds. The total time is estimated from the sampled
+  calls, and the percentiles are the upper bounds of histogram buckets.
+
+  Args:
+    profile: the HandlerProfiler to print.
+    sort_key: 'total', 'max', 'mean' or 'count', what to sort the rows on in
+        decreasing order.
+    output: the file to print to.
+  """
+  output.write('%-7s %10s %10s %12s %10s %10s %10s %10s  %s\n' %
+               ('Kind', 'Calls', 'Sampled', 'Total (us)', 'Mean', 'P50',
+                'P99', 'Max', 'Function'))
+  for entry in profile.GetEntries(sort_key):
+    output.write('%-7s %10d %10d %12.0f %10.1f %10.1f %10.1f %10.1f  %s\n' %
+                 (entry.kind, entry.count, entry.sampled_count,
+                  entry.total_seconds * 1e6, entry.mean_seconds * 1e6,
+                  entry.GetPercentile(50) * 1e6,
+                  entry.GetPercentile(99) * 1e6, entry.max_seconds * 1e6,
+                  entry.name))
@@ -16,7 +16,7 @@
 from ctypes import addressof, byref, cast, pointer, sizeof
 from ctypes import POINTER, Structure
 import evntrace
-import winerror
+import native
 
 class MofEvent(object):
   """A utility class to wrap trace event structures"""
@@ -181,7 +181,7 @@ class TraceProvider(object):
     elif request == evntrace.WMI_DISABLE_EVENTS:
       return self._DisableEvents()
 
-    return winerror.ERROR_INVALID_PARAMETER
+    return native.ERROR_INVALID_PARAMETER
 
   def _EnableEvents(self, buffer):
     # We're in a control callback and events were just enabled
@@ -190,7 +190,7 @@ class TraceProvider(object):
     self._enable_level = evntrace.GetTraceEnableLevel(self._session_handle)
     self._enable_flags = evntrace.GetTraceEnableFlags(self._session_handle)
     self.OnEventsEnabled()
-    return winerror.ERROR_SUCCESS
+    return native.ERROR_SUCCESS
 
   def _DisableEvents(self):
     # We're in a control callback and events were just disabled.
@@ -198,4 +198,4 @@ class TraceProvider(object):
     self._enable_level = 0
     self._enable_flags = 0
     self._session_handle = None
-    return winerror.ERROR_SUCCESS
+    return native.ERROR_SUCCESS
@@ -0,0 +1,194 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A preallocated ring of variable size records, for one producer thread and
+one consumer thread.
+
+The ring is a fixed bytearray. The producer reserves room for a record,
+writes it in place, with struct.pack_into or ctypes.memmove at the address of
+the ring, and commits it. The consumer reads each record as a memoryview of
+the ring, and releases it once it's done with it, which frees its room.
+
+Each record is stored as a 4 byte length followed by its data, padded to a
+multiple of 8 bytes. A record never wraps around the end of the ring: when
+it doesn't fit in the space left at the end, that space is skipped, as
+marked by a length of _WRAP.
+
+The producer and the consumer each only move one of the two positions in the
+ring, so the records themselves are passed without locks. A threading.Event
+is only set to wake the consumer when it has run out of records to read.
+
+Records that don't fit in the free space are dropped, and counted, rather
+than waited on.
+"""
+import ctypes
+import struct
+import threading
+
+
+# The default capacity of a ring, in bytes.
+DEFAULT_CAPACITY = 16 * 1024 * 1024
+
+_LENGTH = struct.Struct('<I')
+_WRAP = 0xFFFFFFFF
+
+
+def _RecordSize(length):
+  return (_LENGTH.size + length + 7) & ~7
+
+
+class RingBuffer(object):
+  """A fixed capacity ring of records.
+
+  Attributes:
+    buffer: the bytearray holding the records.
+    address: the address of buffer, for ctypes.memmove.
+    capacity: the size of buffer.
+    overflow_count: the number of records dropped because the ring was full.
+    overflow_bytes: the total length of those records.
+  """
+
+  def __init__(self, capacity=DEFAULT_CAPACITY):
+    """Allocates an empty ring.
+
+    Args:
+      capacity: the size of the ring in bytes, which is rounded up to a
+          multiple of 8.
+    """
+    capacity = (capacity + 7) & ~7
+    self.buffer = bytearray(capacity)
+    # Exporting the buffer to ctypes also keeps it from ever being resized.
+    self._c_buffer = (ctypes.c_char * capacity).from_buffer(self.buffer)
+    self.address = ctypes.addressof(self._c_buffer)
+    self.capacity = capacity
+    self._view = memoryview(self.buffer)
+    # The total number of bytes committed by the producer, and released by
+    # the consumer. Their difference is the number of bytes in use.
+    self._head = 0
+    self._tail = 0
+    # Where the head and tail move to on the next commit and release.
+    self._next_head = None
+    self._next_tail = None
+    self._closed = False
+    self._waiting = False
+    self._ready = threading.Event()
+    self.overflow_count = 0
+    self.overflow_bytes = 0
+
+  def Reserve(self, length):
+    """Reserves room for a record. Only the producer may call this.
+
+    The record is written at the offset returned, and then committed. A
+    record must be committed before the next one is reserved.
+
+    Args:
+      length: the length of the record.
+
+    Returns:
+      The offset of the record in buffer, or None if there isn't enough free
+      space in the ring, in which case the record is counted as dropped.
+    """
+    capacity = self.capacity
+    head = self._head
+    position = head % capacity
+    size = _RecordSize(length)
+    skip = 0
+    if position + size > capacity:
+      skip = capacity - position
+    if head + skip + size - self._tail > capacity:
+      self.overflow_count += 1
+      self.overflow_bytes += length
+      return None
+
+    if skip:
+      _LENGTH.pack_into(self.buffer, position, _WRAP)
+      position = 0
+    _LENGTH.pack_into(self.buffer, position, length)
+    self._next_head = head + skip + size
+    return position + _LENGTH.size
+
+  def Commit(self):
+    """Makes the reserved record available to the consumer."""
+    self._head = self._next_head
+    if self._waiting:
+      self._ready.set()
+
+  def Write(self, data):
+    """Reserves, writes and commits a record.
+
+    Args:
+      data: the contents of the record, as a string.
+
+    Returns:
+      True if the record was written, or False if it was dropped.
+    """
+    offset = self.Reserve(len(data))
+    if offset is None:
+      return False
+    self._view[offset:offset + len(data)] = data
+    self.Commit()
+    return True
+
+  def Close(self):
+    """Tells the consumer no more records will be written."""
+    self._closed = True
+    self._ready.set()
+
+  def Read(self, timeout=None):
+    """Returns the next record. Only the consumer may call this.
+
+    The record must be released before the next one is read.
+
+    Args:
+      timeout: the longest time to wait for a record, in seconds, or None to
+          wait until there is one or the ring is closed.
+
+    Returns:
+      A memoryview of the record's data, which is only valid until it's
+      released. None if the ring is closed and empty, or if the timeout
+      expired.
+    """
+    while self._tail == self._head:
+      if self._closed:
+        return None
+      # Announce that we're waiting before checking again, so a commit in
+      # between sets the event.
+      self._ready.clear()
+      self._waiting = True
+      if self._tail == self._head and not self._closed:
+        self._ready.wait(timeout)
+      self._waiting = False
+      if timeout is not None and self._tail == self._head:
+        return None
+
+    capacity = self.capacity
+    tail = self._tail
+    position = tail % capacity
+    length, = _LENGTH.unpack_from(self.buffer, position)
+    if length == _WRAP:
+      tail += capacity - position
+      position = 0
+      length, = _LENGTH.unpack_from(self.buffer, position)
+    self._next_tail = tail + _RecordSize(length)
+    start = position + _LENGTH.size
+    return self._view[start:start + length]
+
+  def Release(self):
+    """Frees the room of the record last read."""
+    self._tail = self._next_tail
+
+  @property
+  def used(self):
+    """The number of bytes taken up by records that haven't been released."""
+    return self._head - self._tail
@@ -0,0 +1,346 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Writes synthetic log (.etl) files, for tests and benchmarks.
+
+The files have the layout etl.EtlFile reads: a logfile header event, then
+fixed size buffers of 8 byte aligned events. Payloads are encoded from the
+_fields_ of the registered EventClass subclasses, for 32 or 64 bit pointers,
+so every descriptor can be exercised without a log captured on Windows.
+
+Kernel events are written with a system header, keyed by their hook id, and
+other events with a full header, keyed by their GUID. GenerateLog picks
+events and their field values with a seeded random generator, so the same
+arguments always produce the same file:
+
+  synthetic.GenerateLog('test.etl', 100000, pointer_size=8, seed=1)
+"""
+from etw import etl
+from etw.descriptors import event
+from etw.descriptors import field
+# Import the descriptors so their event classes are registered. The registry
+# descriptors refer to event types their Event class doesn't define, so they
+# can't be imported.
+from etw.descriptors import fileio
+from etw.descriptors import image
+from etw.descriptors import pagefault
+from etw.descriptors import process
+from etw.descriptors import thread
+import random
+import struct
+
+
+# The defaults of the logs written.
+DEFAULT_BUFFER_SIZE = 64 * 1024
+DEFAULT_START_TIME = 129000000000000000  # A FILETIME in 2009.
+DEFAULT_QPC_FREQUENCY = 10000000
+DEFAULT_START_QPC = 5000
+
+# The size of the WMI_BUFFER_HEADER at the start of every buffer.
+BUFFER_HEADER_SIZE = 72
+
+_BUFFER_HEADER = struct.Struct('<IIIiqqQBBHIIHH16x')
+_SYSTEM_HEADER = struct.Struct('<HBBHHIIqII')
+_FULL_HEADER = struct.Struct('<HBBBBHIIq16sII')
+
+# Maps the raw GUIDs of the kernel event groups to the group.
+_KERNEL_GROUPS = dict((etl.GuidToBytes(guid), group)
+                      for group, guid in etl._GROUP_GUIDS.items())
+
+# The strings and SIDs random field values are picked from.
+_NAMES = ['ntdll', 'kernel32', 'user32', 'chrome', 'msvcrt', 'advapi32',
+          'ws2_32', 'shell32']
+_SIDS = ['S-1-5-18', 'S-1-5-19', 'S-1-5-21-3623811015-3361044348-30300820-1013']
+
+
+def _Pad8(data):
+  return data + '\0' * (-len(data) % 8)
+
+
+def LogfileHeader(pointer_size=4, buffer_size=DEFAULT_BUFFER_SIZE,
+                  start_time=DEFAULT_START_TIME,
+                  qpc_frequency=DEFAULT_QPC_FREQUENCY, processor_count=1):
+  """Returns the payload of the logfile header event of a log.
+
+  Args:
+    pointer_size: 4 or 8, the pointer size of the system the log is from.
+    buffer_size: the size of the log's buffers.
+    start_time: the start time of the log, as a FILETIME.
+    qpc_frequency: the frequency of the QPC clock the log's events are
+        stamped with.
+    processor_count: the number of processors of the system.
+  """
+  header = struct.pack('<IBBBBIIqIIIIIIII', buffer_size, 6, 1, 0, 0, 0,
+                       processor_count, 0, 156250, 0, 1, 1, 0, pointer_size,
+                       0, 2000)
+  header += '\0' * (2 * pointer_size + 172)
+  header = _Pad8(header)
+  header += struct.pack('<qqqII', 0, qpc_frequency, start_time, 1, 0)
+  return header
+
+
+def SystemEvent(hook_id, version, pid, tid, time_stamp, payload,
+                pointer_size=4):
+  """Returns a kernel event with a system header, padded to 8 bytes."""
+  if pointer_size == 8:
+    header_type = etl.TRACE_HEADER_TYPE_SYSTEM64
+  else:
+    header_type = etl.TRACE_HEADER_TYPE_SYSTEM32
+  size = _SYSTEM_HEADER.size + len(payload)
+  return _Pad8(_SYSTEM_HEADER.pack(version, header_type, 0xC0, size, hook_id,
+                                   tid, pid, time_stamp, 0, 0) + payload)
+
+
+def FullEvent(raw_guid, event_type, version, pid, tid, time_stamp, payload,
+              pointer_size=4, level=0):
+  """Returns an event with a full EVENT_TRACE_HEADER, padded to 8 bytes."""
+  if pointer_size == 8:
+    header_type = etl.TRACE_HEADER_TYPE_FULL_HEADER64
+  else:
+    header_type = etl.TRACE_HEADER_TYPE_FULL_HEADER32
+  size = _FULL_HEADER.size + len(payload)
+  return _Pad8(_FULL_HEADER.pack(size, header_type, 0xC0, event_type, level,
+                                 version, tid, pid, time_stamp, raw_guid, 0,
+                                 0) + payload)
+
+
+def Buffer(events, buffer_size=DEFAULT_BUFFER_SIZE, processor=0):
+  """Returns a buffer holding events, padded to buffer_size."""
+  data = ''.join(events)
+  saved_offset = BUFFER_HEADER_SIZE + len(data)
+  if saved_offset > buffer_size:
+    raise ValueError('The events take up more than a buffer.')
+  header = _BUFFER_HEADER.pack(buffer_size, saved_offset, saved_offset, 0, 0,
+                               0, 0, processor, 0, 0, 0, saved_offset, 0, 0)
+  return header + data + '\xff' * (buffer_size - saved_offset)
+
+
+def _EncodeSid(sid, pointer_size):
+  """Encodes a SID in registry format, as it follows two pointers."""
+  pointer_format = '<Q' if pointer_size == 8 else '<I'
+  if sid is None:
+    return struct.pack(pointer_format, 0)
+  parts = sid.split('-')
+  revision, authority = int(parts[1]), int(parts[2])
+  sub_authorities = [int(part) for part in parts[3:]]
+  return (struct.pack(pointer_format, 1) + struct.pack(pointer_format, 0) +
+          struct.pack('<BB', revision, len(sub_authorities)) +
+          struct.pack('>Q', authority)[2:] +
+          struct.pack('<%dI' % len(sub_authorities), *sub_authorities))
+
+
+def EncodeField(field_type, value, pointer_size=4):
+  """Returns the bytes of a field value in an event payload.
+
+  Args:
+    field_type: the field function, as listed in an EventClass's _fields_.
+    value: the value of the field. Strings are unicode, SIDs are in
+        registry format, and times are raw session time stamps.
+    pointer_size: the pointer size of the log.
+
+  Raises:
+    ValueError: the field type isn't supported.
+  """
+  formats = getattr(field_type, 'struct_formats', None)
+  if formats is not None:
+    return struct.pack('<' + formats[pointer_size == 8], value)
+  if field_type is field.WString:
+    return value.encode('utf-16-le') + '\0\0'
+  if field_type is field.String:
+    return value.encode('latin-1') + '\0'
+  if field_type is field.CountedWString:
+    data = value.encode('utf-16-le')
+    return struct.pack('<H', len(data)) + data
+  if field_type is field.CountedBlob:
+    return struct.pack('<I', len(value)) + value
+  if field_type is field.Sid:
+    return _EncodeSid(value, pointer_size)
+  raise ValueError('Unsupported field type %s.' % field_type.__name__)
+
+
+def EncodePayload(event_class, values, pointer_size=4):
+  """Returns the payload of an event.
+
+  Args:
+    event_class: the EventClass subclass of the event.
+    values: a dict from field name to value, for each of the class' fields.
+    pointer_size: the pointer size of the log.
+  """
+  return ''.join(EncodeField(field_type, values[name], pointer_size)
+                 for name, field_type in event_class._fields_)
+
+
+def RandomValue(field_type, generator, pointer_size=4):
+  """Returns a random value of a field type, to pass to EncodeField."""
+  formats = getattr(field_type, 'struct_formats', None)
+  if formats is not None:
+    field_format = formats[pointer_size == 8]
+    if field_format == '?':
+      return generator.random() < 0.5
+    if field_type is field.Pointer:
+      return generator.randrange(0x10000, 1 << (8 * pointer_size - 4), 0x1000)
+    if field_type is field.WmiTime:
+      return DEFAULT_START_TIME + generator.randrange(1 << 32)
+    bits = 8 * struct.calcsize(field_format)
+    if field_format.islower():
+      return generator.randrange(-(1 << (bits - 1)), 1 << (bits - 1))
+    return generator.randrange(1 << bits)
+  if field_type in (field.WString, field.CountedWString):
+    return u'\\Device\\HarddiskVolume1\\Windows\\System32\\%s.dll' % (
+        generator.choice(_NAMES))
+  if field_type is field.String:
+    return u'%s.exe' % generator.choice(_NAMES)
+  if field_type is field.CountedBlob:
+    return ''.join(chr(generator.randrange(256))
+                   for unused_i in range(generator.randrange(32)))
+  if field_type is field.Sid:
+    return generator.choice(_SIDS)
+  raise ValueError('Unsupported field type %s.' % field_type.__name__)
+
+
+def RandomValues(event_class, generator, pointer_size=4):
+  """Returns a dict of random values for the fields of an EventClass."""
+  return dict((name, RandomValue(field_type, generator, pointer_size))
+              for name, field_type in event_class._fields_)
+
+
+class EtlWriter(object):
+  """Writes events to a log file, a buffer at a time.
+
+  Events are stamped with QPC time stamps, starting at DEFAULT_START_QPC.
+  The logfile header event is written when the writer is created.
+
+  Attributes:
+    event_count: the number of events written, not counting the header.
+    payload_bytes: the total size of their payloads.
+  """
+
+  def __init__(self, output, pointer_size=4, buffer_size=DEFAULT_BUFFER_SIZE,
+               start_time=DEFAULT_START_TIME,
+               qpc_frequency=DEFAULT_QPC_FREQUENCY, processor_count=1):
+    """Starts a log.
+
+    Args:
+      output: the file to write the log to.
+      pointer_size: 4 or 8, the pointer size of the system the log is from.
+      buffer_size: the size of the log's buffers.
+      start_time: the start time of the log, as a FILETIME.
+      qpc_frequency: the frequency of the QPC clock.
+      processor_count: the number of processors the buffers are spread over.
+    """
+    self._output = output
+    self._pointer_size = pointer_size
+    self._buffer_size = buffer_size
+    self._processor_count = processor_count
+    self._events = []
+    self._used = BUFFER_HEADER_SIZE
+    self._buffer_count = 0
+    self.event_count = 0
+    self.payload_bytes = 0
+    header = LogfileHeader(pointer_size, buffer_size, start_time,
+                           qpc_frequency, processor_count)
+    self._Add(SystemEvent(etl.EVENT_TRACE_GROUP_HEADER, 2, 0, 0,
+                          DEFAULT_START_QPC, header, pointer_size))
+
+  def AddEvent(self, guid, version, event_type, values, pid=4, tid=8,
+               time_stamp=DEFAULT_START_QPC):
+    """Adds an event.
+
+    Args:
+      guid: the string GUID of the event's provider or MOF class.
+      version: the version of the event.
+      event_type: the type of the event.
+      values: a dict from field name to value, for each of the fields of the
+          EventClass registered for the event. See EncodePayload.
+      pid: the ID of the process that logged the event.
+      tid: the ID of the thread that logged the event.
+      time_stamp: the QPC time stamp of the event.
+    """
+    event_class = event.EventClass.Get(guid, version, event_type)
+    payload = EncodePayload(event_class, values, self._pointer_size)
+    raw_guid = etl.GuidToBytes(guid)
+    group = _KERNEL_GROUPS.get(raw_guid, None)
+    hook_id = None if group is None else group | event_type
+    if group is None or hook_id == etl._PROCESS_LOAD_IMAGE:
+      data = FullEvent(raw_guid, event_type, version, pid, tid, time_stamp,
+                       payload, self._pointer_size)
+    else:
+      data = SystemEvent(hook_id, version, pid, tid, time_stamp, payload,
+                         self._pointer_size)
+    self._Add(data)
+    self.event_count += 1
+    self.payload_bytes += len(payload)
+
+  def _Add(self, data):
+    if self._used + len(data) > self._buffer_size:
+      self._Flush()
+    self._events.append(data)
+    self._used += len(data)
+
+  def _Flush(self):
+    if self._events:
+      processor = self._buffer_count % self._processor_count
+      self._output.write(Buffer(self._events, self._buffer_size, processor))
+      self._buffer_count += 1
+    self._events = []
+    self._used = BUFFER_HEADER_SIZE
+
+  def Close(self):
+    """Writes out the last buffer."""
+    self._Flush()
+
+
+def GetEventKeys():
+  """Returns the (guid, version, event type) of every registered event, in
+  sorted order."""
+  return sorted(key for key, unused_event_class in event.EventClass.GetAll())
+
+
+def GenerateLog(path, event_count, pointer_size=4, seed=0, event_keys=None,
+                buffer_size=DEFAULT_BUFFER_SIZE, processor_count=1):
+  """Writes a log of random events, the same for the same arguments.
+
+  Args:
+    path: the path of the log to write.
+    event_count: the number of events to write.
+    pointer_size: 4 or 8, the pointer size of the log.
+    seed: the seed of the random generator.
+    event_keys: a list of the (guid, version, event type) of the events to
+        pick from, defaults to GetEventKeys().
+    buffer_size: the size of the log's buffers.
+    processor_count: the number of processors the buffers are spread over.
+
+  Returns:
+    The EtlWriter the log was written with.
+  """
+  generator = random.Random(seed)
+  if event_keys is None:
+    event_keys = GetEventKeys()
+  output = open(path, 'wb')
+  try:
+    writer = EtlWriter(output, pointer_size, buffer_size,
+                       processor_count=processor_count)
+    time_stamp = DEFAULT_START_QPC
+    for unused_i in xrange(event_count):
+      guid, version, event_type = generator.choice(event_keys)
+      event_class = event.EventClass.Get(guid, version, event_type)
+      time_stamp += generator.randrange(1, 1000)
+      writer.AddEvent(guid, version, event_type,
+                      RandomValues(event_class, generator, pointer_size),
+                      generator.randrange(4, 4096, 4),
+                      generator.randrange(4, 4096, 4), time_stamp)
+    writer.Close()
+  finally:
+    output.close()
+  return writer
@@ -31,3 +31,8 @@ def FileTimeToTime(file_time):
   time_stamp_100ns = file_time
   time_stamp_s = float(time_stamp_100ns) * FILETIME_TO_SECONDS_MULTIPLIER
   return time_stamp_s - FILETIME_EPOCH_DELTA_S
+
+
+def TimeToFileTime(time_stamp):
+  """Converts a python-compatible time to a Win32 FILETIME."""
+  return int(round((time_stamp + FILETIME_EPOCH_DELTA_S) * 10000000))
@@ -29,6 +29,9 @@ setup(name = 'ETW',
       author_email = 'siggi@chromium.org',
       url = 'http://code.google.com/p/sawbuck',
       packages = ['etw', 'etw.descriptors'],
+      entry_points = {
+        'console_scripts': ['etw-census = etw.census:main'],
+      },
       tests_require = ["nose>=0.9.2"],
       test_suite = 'nose.collector',
       license = 'Apache 2.0')
@@ -14,6 +14,7 @@
 # limitations under the License.
 """Unit test for the etw.descriptors.binary_buffer module."""
 import ctypes
+import struct
 import unittest
 from etw.descriptors import binary_buffer
 
@@ -147,26 +148,30 @@ class BinaryBufferReaderTest(unittest.TestCase):
         ctypes.cast(data, ctypes.c_void_p).value, ctypes.sizeof(data))
     self.assertEqual(u'Hello!', reader.ReadWString())
 
+  def testReadWStrings(self):
+    """Test that ReadWString consumes the whole string and terminator."""
+    data = ctypes.create_unicode_buffer(u'Hello!\0World', 13)
+    reader = binary_buffer.BinaryBufferReader(
+        ctypes.cast(data, ctypes.c_void_p).value, ctypes.sizeof(data))
+    self.assertEqual(u'Hello!', reader.ReadWString())
+    self.assertEqual(7 * ctypes.sizeof(ctypes.c_wchar), reader._offset)
+    self.assertEqual(u'World', reader.ReadWString())
+
   POINTER_SIZE_32 = 4
-  MAX_SID_SIZE = 68
-  WIN_WORLD_SID = 1
+  # The binary form of the well known World SID, S-1-1-0.
+  WORLD_SID = '\x01\x01\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00'
 
   def testReadSid(self):
     """Test buffer reader ReadSid."""
-    data = ctypes.c_buffer(2 * self.POINTER_SIZE_32 + self.MAX_SID_SIZE)
     # The first pointer preceding a Sid must be non-NULL.
-    data[0] = "1"
+    data = ctypes.create_string_buffer(
+        struct.pack('<II', 1, 0) + self.WORLD_SID, 20)
     ptr = ctypes.cast(data, ctypes.c_void_p)
-    sid_ptr = ctypes.cast(ptr.value + 2 * self.POINTER_SIZE_32, ctypes.c_void_p)
-
-    size = ctypes.c_int()
-    size.value = self.MAX_SID_SIZE
-    self.assertNotEqual(0, ctypes.windll.advapi32.CreateWellKnownSid(
-        self.WIN_WORLD_SID, None, sid_ptr, ctypes.byref(size)))
 
     reader = binary_buffer.BinaryBufferReader(ptr.value, ctypes.sizeof(data))
     sid = reader.ReadSid(False)
     self.assertTrue(sid.IsValid())
+    self.assertEqual('S-1-1-0', str(sid))
 
     # Now try and read a non-Sid, which is preceded by a NULL pointer.
     data = ctypes.c_buffer(self.POINTER_SIZE_32)
@@ -175,5 +180,166 @@ class BinaryBufferReaderTest(unittest.TestCase):
     self.assertEqual(None, reader.ReadSid(False))
 
 
+class BinaryDataReaderTest(unittest.TestCase):
+  def testConsume(self):
+    """Test data reader Consume."""
+    reader = binary_buffer.BinaryDataReader('\0' * 10)
+    reader.Consume(5)
+    self.assertRaises(binary_buffer.BufferOverflowError,
+                      reader.Consume, 6)
+
+  def testOffsetAndLength(self):
+    """Test reading a window of the data."""
+    data = struct.pack('<IIi', 1, 2, -3)
+    reader = binary_buffer.BinaryDataReader(data, 4, 4)
+    self.assertEqual(2, reader.ReadUInt32())
+    self.assertRaises(binary_buffer.BufferOverflowError, reader.ReadInt8)
+    self.assertRaises(binary_buffer.BufferOverflowError,
+                      binary_buffer.BinaryDataReader, data, 8, 8)
+
+  def testReadIntegers(self):
+    """Test data reader integer reads."""
+    data = struct.pack('<bBhHiIqQb', -1, 2, -3, 4, -5, 6, -7, 8, 1)
+    for buffer_type in (str, bytearray, memoryview):
+      reader = binary_buffer.BinaryDataReader(buffer_type(data))
+      self.assertEqual(-1, reader.ReadInt8())
+      self.assertEqual(2, reader.ReadUInt8())
+      self.assertEqual(-3, reader.ReadInt16())
+      self.assertEqual(4, reader.ReadUInt16())
+      self.assertEqual(-5, reader.ReadInt32())
+      self.assertEqual(6, reader.ReadUInt32())
+      self.assertEqual(-7, reader.ReadInt64())
+      self.assertEqual(8, reader.ReadUInt64())
+      self.assertTrue(reader.ReadBoolean())
+      self.assertRaises(binary_buffer.BufferOverflowError, reader.ReadUInt8)
+
+  def testRead(self):
+    """Test data reader Read."""
+    reader = binary_buffer.BinaryDataReader(struct.pack('<i', -4321))
+    self.assertEqual(-4321, reader.Read(ctypes.c_int))
+    self.assertRaises(binary_buffer.BufferOverflowError,
+                      reader.Read, ctypes.c_int)
+
+  def testReadString(self):
+    """Test data reader string reads."""
+    data = ('Hello!\0' + u'Hello!\0'.encode('utf-16-le') +
+            struct.pack('<H', 4) + u'Hi'.encode('utf-16-le'))
+    for buffer_type in (str, bytearray, memoryview):
+      reader = binary_buffer.BinaryDataReader(buffer_type(data))
+      self.assertEqual('Hello!', reader.ReadString())
+      self.assertEqual(u'Hello!', reader.ReadWString())
+      self.assertEqual(u'Hi', reader.ReadCountedWString())
+
+    # The terminator of a wide string must be aligned.
+    for buffer_type in (str, memoryview):
+      reader = binary_buffer.BinaryDataReader(buffer_type('a\0\0b\0\0'))
+      self.assertEqual(u'a\u6200', reader.ReadWString())
+
+    # Unterminated strings overflow.
+    reader = binary_buffer.BinaryDataReader('Hello!')
+    self.assertRaises(binary_buffer.BufferOverflowError, reader.ReadString)
+    reader = binary_buffer.BinaryDataReader(memoryview('H\0e\0'))
+    self.assertRaises(binary_buffer.BufferOverflowError, reader.ReadWString)
+
+  def testReadSid(self):
+    """Test data reader ReadSid, for both pointer sizes."""
+    sid = struct.pack('>BBHI', 1, 2, 0, 5) + struct.pack('<II', 32, 544)
+    data = struct.pack('<II', 1, 0) + sid + struct.pack('<QQ', 1, 0) + sid
+    reader = binary_buffer.BinaryDataReader(bytearray(data))
+    first = reader.ReadSid(False)
+    second = reader.ReadSid(True)
+    self.assertEqual('S-1-5-32-544', str(first))
+    # Identical SIDs are interned.
+    self.assertTrue(first is second)
+
+    reader = binary_buffer.BinaryDataReader(struct.pack('<I', 0))
+    self.assertEqual(None, reader.ReadSid(False))
+    reader = binary_buffer.BinaryDataReader(struct.pack('<II', 1, 0) + sid[:9])
+    self.assertRaises(binary_buffer.BufferOverflowError, reader.ReadSid, False)
+    reader = binary_buffer.BinaryDataReader(
+        struct.pack('<II', 1, 0) + '\x02' + sid[1:])
+    self.assertRaises(binary_buffer.BufferDataError, reader.ReadSid, False)
+
+
+class SidTest(unittest.TestCase):
+  def testSid(self):
+    """Test the string form, accessors and comparison of Sids."""
+    data = (struct.pack('>BBHI', 1, 3, 0, 5) +
+            struct.pack('<III', 21, 3623811015, 1013))
+    sid = binary_buffer.Sid(data)
+    self.assertTrue(sid.IsValid())
+    self.assertEqual('S-1-5-21-3623811015-1013', str(sid))
+    self.assertEqual(u'S-1-5-21-3623811015-1013', unicode(sid))
+    self.assertEqual(20, sid.GetLength())
+    self.assertEqual(3, sid.GetSubAuthorityCount())
+    self.assertEqual((0, 0, 0, 0, 0, 5), sid.GetSidIdentifierAuthority())
+    self.assertEqual(1013, sid.GetSubAuthority(2))
+    self.assertRaises(IndexError, sid.GetSubAuthority, 3)
+
+    self.assertEqual(sid, binary_buffer.Sid(data))
+    self.assertEqual(hash(sid), hash(binary_buffer.Sid(data)))
+    self.assertNotEqual(sid, binary_buffer.Sid(data[:-4]))
+    self.assertFalse(binary_buffer.Sid(data[:-4]).IsValid())
+    interned = binary_buffer.Sid.Intern(data)
+    self.assertTrue(interned is binary_buffer.Sid.Intern(data))
+    # Sids are only interned while they're referred to.
+    del interned
+    self.assertFalse(data in binary_buffer.Sid._interned)
+
+    # Authorities that don't fit in 32 bits are written in hex.
+    sid = binary_buffer.Sid(struct.pack('>BBHI', 1, 0, 1, 2))
+    self.assertEqual('S-1-0x000100000002', str(sid))
+
+
+class InternTableTest(unittest.TestCase):
+  def tearDown(self):
+    binary_buffer.SetInternTable(None)
+
+  def testIntern(self):
+    """Test the LRU eviction and statistics of a table."""
+    table = binary_buffer.InternTable(max_size=2)
+    self.assertEqual(u'a', table.Intern(1, 'a\0', lambda raw: u'a'))
+    self.assertEqual('b', table.Intern(0, 'b', str))
+    # A hit makes a value the most recently used one.
+    self.assertEqual(u'a', table.Intern(1, 'a\0', None))
+    self.assertEqual('c', table.Intern(0, 'c', str))
+    self.assertEqual(2, len(table))
+    self.assertEqual((1, 3, 1), (table.hits, table.misses, table.evictions))
+    self.assertEqual(0.25, table.hit_rate)
+    # 'b' was evicted, so it's decoded again.
+    self.assertEqual(u'B', table.Intern(0, 'b', lambda raw: u'B'))
+
+    table.Clear()
+    self.assertEqual((0, 0.0), (len(table), table.hit_rate))
+
+    self.assertRaises(ValueError, binary_buffer.InternTable, 0)
+    table = binary_buffer.InternTable(max_size=1)
+    self.assertEqual('a', table.Intern(0, 'a', str))
+    self.assertEqual('b', table.Intern(0, 'b', str))
+    self.assertEqual((1, 1), (len(table), table.evictions))
+
+  def testReaders(self):
+    """Test that readers return interned strings and SIDs."""
+    sid = struct.pack('>BBHI', 1, 1, 0, 5) + struct.pack('<I', 18)
+    event_data = ('foo\0' + u'bar\0'.encode('utf-16-le') +
+                  struct.pack('<H', 6) + u'bar'.encode('utf-16-le') +
+                  struct.pack('<II', 1, 0) + sid)
+    table = binary_buffer.InternTable()
+    binary_buffer.SetInternTable(table)
+    self.assertTrue(binary_buffer.GetInternTable() is table)
+
+    values = []
+    for i in range(2):
+      reader = binary_buffer.BinaryDataReader(bytearray(event_data))
+      values.append((reader.ReadString(), reader.ReadWString(),
+                     reader.ReadCountedWString(), reader.ReadSid(False)))
+    self.assertEqual(('foo', u'bar', u'bar'), values[0][:3])
+    self.assertEqual('S-1-5-18', str(values[0][3]))
+    for first, second in zip(*values):
+      self.assertTrue(first is second)
+    # Wide strings with the same bytes share an entry.
+    self.assertEqual((5, 3), (table.hits, table.misses))
+
+
 if __name__ == '__main__':
   unittest.main()
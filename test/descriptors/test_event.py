@@ -15,8 +15,10 @@
 """Unit test for the etw.descriptors.event module."""
 import ctypes
 import datetime
+import struct
 import time
 import unittest
+from etw import etl
 from etw import evntrace
 from etw import util
 from etw.descriptors import binary_buffer
@@ -115,6 +117,112 @@ class EventClassTest(unittest.TestCase):
     self.assertRaises(binary_buffer.BufferOverflowError, TestEventClass,
                       mock_session, mock_event_trace)
 
+  def _Record(self, data):
+    return etl.EventRecord(etl.TRACE_HEADER_TYPE_SYSTEM32, '\0' * 16, 0, 0, 0,
+                           0, 5678, 8765, 123456789, 0, data, 0, len(data))
+
+  def _IsDecoded(self, obj, name):
+    # Bypass __getattr__, which would decode the field.
+    try:
+      object.__getattribute__(obj, name)
+      return True
+    except AttributeError:
+      return False
+
+  def testSlots(self):
+    """Test that event objects store their fields in slots."""
+    class TestEventClass(event.EventClass):
+      _fields_ = [('FieldA', field.Int32),
+                  ('FieldB', field.String)]
+
+    class DerivedEventClass(TestEventClass):
+      _fields_ = [('FieldA', field.Int32),
+                  ('FieldC', field.Int32)]
+
+    self.assertEqual(('FieldA', 'FieldB'), TestEventClass.__slots__)
+    self.assertEqual(('FieldC',), DerivedEventClass.__slots__)
+
+    data = struct.pack('<i4si', 1234, 'Foo\0', 5)
+    obj = TestEventClass(MockSession(), self._Record(data))
+    self.assertFalse(hasattr(obj, '__dict__'))
+    self.assertEqual(obj.process_id, 5678)
+    self.assertEqual(obj.FieldB, 'Foo')
+    self.assertRaises(AttributeError, setattr, obj, 'FieldD', 1)
+
+  def testCompiledFields(self):
+    """Test decoding runs of fixed size fields around variable size fields."""
+    class TestEventClass(event.EventClass):
+      _fields_ = [('FieldA', field.UInt32),
+                  ('FieldB', field.Pointer),
+                  ('FieldC', field.Boolean),
+                  ('FieldD', field.String),
+                  ('FieldE', field.Int8),
+                  ('FieldF', field.WmiTime)]
+
+    decoder = TestEventClass.GetFieldDecoder(False)
+    self.assertEqual(3, len(decoder))
+
+    mock_session = MockSession()
+    for is_64_bit_log, pointer_format in ((False, 'I'), (True, 'Q')):
+      mock_session.is_64_bit_log = is_64_bit_log
+      data = struct.pack('<I%s?6sbQ' % pointer_format, 1234, 0xCAFE, True,
+                         'Hello\0', -5, 123456789)
+      obj = TestEventClass(mock_session, self._Record(data))
+      self.assertEqual(obj.process_id, 5678)
+      self.assertEqual(obj.FieldA, 1234)
+      self.assertEqual(obj.FieldB, 0xCAFE)
+      self.assertEqual(obj.FieldC, True)
+      self.assertEqual(obj.FieldD, 'Hello')
+      self.assertEqual(obj.FieldE, -5)
+      self.assertEqual(obj.FieldF, util.FileTimeToTime(123456789))
+
+  def testCompiledFieldsOverflow(self):
+    """Test that a run of fixed size fields checks for overflow."""
+    class TestEventClass(event.EventClass):
+      _fields_ = [('FieldA', field.Int32),
+                  ('FieldB', field.Int32)]
+
+    self.assertRaises(binary_buffer.BufferOverflowError, TestEventClass,
+                      MockSession(), self._Record(struct.pack('<i', 1234)))
+
+  def testLazyFields(self):
+    """Test decoding fields on demand."""
+    class TestEventClass(event.EventClass):
+      _fields_ = [('FieldA', field.UInt32),
+                  ('FieldB', field.String),
+                  ('FieldC', field.Int8),
+                  ('FieldD', field.String),
+                  ('FieldE', field.WmiTime)]
+
+    data = struct.pack('<I6sb4sQ', 1234, 'Hello\0', -5, 'Foo\0', 123456789)
+    obj = TestEventClass(MockSession(), self._Record(data), lazy=True)
+    self.assertFalse(self._IsDecoded(obj, 'FieldA'))
+    self.assertEqual(obj.process_id, 5678)
+
+    # Reading a field past a variable size field resolves the fields in
+    # between.
+    self.assertEqual(obj.FieldE, util.FileTimeToTime(123456789))
+    self.assertTrue(self._IsDecoded(obj, 'FieldD'))
+    self.assertFalse(self._IsDecoded(obj, 'FieldA'))
+    self.assertEqual(obj.FieldA, 1234)
+    self.assertEqual(obj.FieldB, 'Hello')
+    self.assertEqual(obj.FieldC, -5)
+    self.assertRaises(AttributeError, getattr, obj, 'FieldF')
+
+  def testLazyFieldsOverflow(self):
+    """Test that lazily decoded fields check for overflow."""
+    class TestEventClass(event.EventClass):
+      _fields_ = [('FieldA', field.Int32),
+                  ('FieldB', field.String),
+                  ('FieldC', field.Int32)]
+
+    data = struct.pack('<i4s', 1234, 'Foo\0')
+    obj = TestEventClass(MockSession(), self._Record(data), lazy=True)
+    self.assertEqual(obj.FieldA, 1234)
+    self.assertRaises(binary_buffer.BufferOverflowError, getattr, obj,
+                      'FieldC')
+    self.assertEqual(obj.FieldB, 'Foo')
+
 
 class EventCategoryTest(unittest.TestCase):
   def testCreation(self):
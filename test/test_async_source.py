@@ -0,0 +1,156 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit test for the etw.async_source module."""
+from etw import async_source
+from etw import EtlFileEventSource, TraceEventSource
+from etw import etl
+from etw.descriptors import image
+from test import test_etl
+import os
+import tempfile
+import threading
+import unittest
+
+try:
+  asyncio = async_source._ImportAsyncio()
+except ImportError:
+  asyncio = None
+
+
+class EventQueueTest(unittest.TestCase):
+  def testDropOldest(self):
+    """Test that a full queue drops its oldest events."""
+    queue = async_source.EventQueue(4, async_source.DROP_OLDEST)
+    for i in range(10):
+      queue.Put(i)
+    queue.Close()
+    self.assertEqual([[6, 7, 8, 9]], list(queue))
+    self.assertEqual(6, queue.dropped_count)
+
+  def testSample(self):
+    """Test that a full queue keeps a sample of the new events."""
+    queue = async_source.EventQueue(4, async_source.SAMPLE,
+                                    sample_interval=3)
+    for i in range(10):
+      queue.Put(i)
+    queue.Close()
+    self.assertEqual([[2, 3, 6, 9]], list(queue))
+    self.assertEqual(6, queue.dropped_count)
+
+  def testBlock(self):
+    """Test that a full queue holds up the thread putting events."""
+    queue = async_source.EventQueue(4, async_source.BLOCK, batch_size=3)
+
+    def Produce():
+      for i in range(100):
+        queue.Put(i)
+      queue.Close()
+    producer = threading.Thread(target=Produce)
+    producer.start()
+    batches = list(queue)
+    producer.join()
+
+    self.assertEqual(range(100), sum(batches, []))
+    self.assertTrue(all(len(batch) <= 3 for batch in batches))
+    self.assertEqual(0, queue.dropped_count)
+
+  def testBatches(self):
+    """Test that partial batches wait for a flush."""
+    queue = async_source.EventQueue(batch_size=3)
+    for i in range(4):
+      queue.Put(i)
+    self.assertEqual([0, 1, 2], queue.GetBatch(0))
+    self.assertEqual([], queue.GetBatch(0))
+    queue.Flush()
+    self.assertEqual([3], queue.GetBatch(0))
+    self.assertRaises(ValueError, async_source.EventQueue, policy='wait')
+
+
+class AsyncEventSourceTest(unittest.TestCase):
+  def setUp(self):
+    header_event = test_etl._SystemEvent(etl.EVENT_TRACE_GROUP_HEADER, 2, 0, 0,
+                                         test_etl._START_QPC,
+                                         test_etl._LogfileHeader(4))
+    buffers = [test_etl._Buffer([header_event,
+                                 test_etl._ImageLoad(10, test_etl._START_QPC,
+                                                     u'foo.dll')]),
+               test_etl._Buffer([test_etl._ImageLoad(11, test_etl._START_QPC,
+                                                     u'bar.dll')])]
+    fd, self._path = tempfile.mkstemp('.etl', 'AsyncEventSourceTest')
+    os.write(fd, ''.join(buffers))
+    os.close(fd)
+
+  def tearDown(self):
+    os.remove(self._path)
+
+  def _Open(self, loop=None, use_mmap=False):
+    source = EtlFileEventSource(use_mmap=use_mmap, lazy=True)
+    source.OpenFileSession(self._path)
+    return async_source.AsyncEventSource(source, [image.Event.Load],
+                                         loop=loop)
+
+  def testIterate(self):
+    """Test taking batches of events on another thread."""
+    source = self._Open()
+    source.Start()
+    file_names = [e.FileName for batch in source for e in batch]
+    source.Close()
+    self.assertEqual([u'foo.dll', u'bar.dll'], file_names)
+    self.assertEqual(0, source.dropped_count)
+
+  def testTakeAfterClose(self):
+    """Test decoding events of a memory mapped log after it's closed."""
+    source = self._Open(use_mmap=True)
+    source.Start()
+    source._thread.join()
+    source.Close()
+    file_names = [e.FileName for batch in source for e in batch]
+    self.assertEqual([u'foo.dll', u'bar.dll'], file_names)
+
+  @unittest.skipIf(asyncio is None, 'asyncio is not available.')
+  def testAsyncIterate(self):
+    """Test taking batches of events on an event loop."""
+    loop = asyncio.new_event_loop()
+    source = self._Open(loop)
+    source.Start()
+    file_names = []
+    try:
+      while True:
+        batch = loop.run_until_complete(source.__anext__())
+        file_names.extend(e.FileName for e in batch)
+    except async_source._StopAsyncIteration:
+      pass
+    source.Close()
+    loop.close()
+    self.assertEqual([u'foo.dll', u'bar.dll'], file_names)
+
+  def testBlockRealtime(self):
+    """Test that realtime sessions can't be held up by a full queue."""
+    class RealtimeSession(object):
+      is_realtime = True
+
+      def Close(self):
+        pass
+
+    source = TraceEventSource()
+    source._trace_sessions.append(RealtimeSession())
+    self.assertRaises(ValueError, async_source.AsyncEventSource, source,
+                      policy=async_source.BLOCK)
+    async_source.AsyncEventSource(source)
+    source.Close()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,97 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit test for the etw.census module."""
+from etw import census
+from etw import EtlFileEventSource
+from etw import etl
+from etw import util
+from etw.descriptors import image
+from test import test_etl
+import os
+import StringIO
+import tempfile
+import unittest
+
+
+class CensusTest(unittest.TestCase):
+  def setUp(self):
+    qpc = test_etl._START_QPC
+    freq = test_etl._QPC_FREQUENCY
+    header_event = test_etl._SystemEvent(etl.EVENT_TRACE_GROUP_HEADER, 2, 0, 0,
+                                         qpc, test_etl._LogfileHeader(4))
+    buffers = [test_etl._Buffer([header_event,
+                                 test_etl._ImageLoad(10, qpc + 2 * freq,
+                                                     u'a.dll')]),
+               test_etl._Buffer([test_etl._ImageLoad(10, qpc + freq,
+                                                     u'bb.dll'),
+                                 test_etl._ImageLoad(11, qpc + 4 * freq,
+                                                     u'c.dll')], processor=1)]
+    fd, self._path = tempfile.mkstemp('.etl', 'CensusTest')
+    os.write(fd, ''.join(buffers))
+    os.close(fd)
+    self._start_time = util.FileTimeToTime(test_etl._START_TIME)
+
+  def tearDown(self):
+    os.remove(self._path)
+
+  def testCensus(self):
+    """Test the statistics of a census."""
+    for raw_time in (False, True):
+      source = EtlFileEventSource(raw_time=raw_time)
+      source.OpenFileSession(self._path)
+      result = census.TakeCensus(source)
+      source.Close()
+
+      self.assertEqual(4, result.event_count)
+      self.assertAlmostEqual(self._start_time, result.start_time, 5)
+      self.assertAlmostEqual(self._start_time + 4, result.end_time, 5)
+
+      stats = dict((s.guid, s) for s in result.GetEventStats())
+      load = stats[image.Event.GUID]
+      self.assertEqual((2, 10, 3), (load.version, load.event_type, load.count))
+      # Each payload has 44 bytes of fields, and a terminated file name.
+      self.assertEqual(3 * 44 + 2 * (6 + 7 + 6), load.byte_count)
+      self.assertAlmostEqual(self._start_time + 1, load.first_time, 5)
+      self.assertAlmostEqual(self._start_time + 4, load.last_time, 5)
+      self.assertEqual('Load', load.name)
+
+      processes = dict((s.process_id, s) for s in result.GetProcessStats())
+      self.assertEqual([0, 10, 11], sorted(processes))
+      self.assertEqual(2, processes[10].count)
+      self.assertEqual({0: 0.25, 10: 0.5, 11: 0.25},
+                       result.GetProcessRates())
+
+  def testPrintCensus(self):
+    """Test printing a census."""
+    source = EtlFileEventSource()
+    source.OpenFileSession(self._path)
+    result = census.TakeCensus(source)
+    source.Close()
+
+    output = StringIO.StringIO()
+    census.PrintCensus(result, 'count', output)
+    lines = output.getvalue().splitlines()
+    self.assertEqual('4 events over 4.000000 s', lines[0])
+    self.assertTrue(lines[3].startswith(image.Event.GUID))
+    self.assertTrue(lines[3].endswith('  Load'))
+    self.assertEqual(['10', '2'], lines[-3].split()[:2])
+
+    empty = StringIO.StringIO()
+    census.PrintCensus(census.Census(), output=empty)
+    self.assertTrue(empty.getvalue().startswith('0 events'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,102 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit test for the etw.columnar module."""
+from etw import columnar
+from etw import EtlFileEventSource
+from etw import etl
+from etw import util
+from etw.descriptors import image
+from etw.descriptors import process
+from test import test_etl
+import os
+import tempfile
+import unittest
+
+
+class ColumnarTest(unittest.TestCase):
+  def setUp(self):
+    header_event = test_etl._SystemEvent(etl.EVENT_TRACE_GROUP_HEADER, 2, 0, 0,
+                                         test_etl._START_QPC,
+                                         test_etl._LogfileHeader(4))
+    time_stamps = [test_etl._START_QPC + i * test_etl._QPC_FREQUENCY
+                   for i in range(1, 4)]
+    buffers = [test_etl._Buffer([header_event,
+                                 test_etl._ImageLoad(10, time_stamps[0],
+                                                     u'foo.dll'),
+                                 test_etl._ImageLoad(10, time_stamps[1],
+                                                     u'bar.dll')]),
+               test_etl._Buffer([test_etl._ImageLoad(11, time_stamps[2],
+                                                     u'foo.dll')])]
+    fd, self._path = tempfile.mkstemp('.etl', 'ColumnarTest')
+    os.write(fd, ''.join(buffers))
+    os.close(fd)
+    self._source = EtlFileEventSource()
+    self._source.OpenFileSession(self._path)
+
+  def tearDown(self):
+    self._source.Close()
+    os.remove(self._path)
+
+  def testCollectTables(self):
+    """Test collecting events into packed rows and string tables."""
+    tables = columnar.CollectTables(
+        self._source, [image.Image.Load, process.Process.TypeGroup1])
+    table = tables[image.Image.Load]
+    self.assertEqual(3, table.row_count)
+    self.assertEqual(('ImageBase', 'Q'), table.columns[4])
+    self.assertEqual([u'foo.dll', u'bar.dll'],
+                     table.strings['FileName'].values)
+    self.assertEqual(0, tables[process.Process.TypeGroup1].row_count)
+
+  def testDecodeColumns(self):
+    """Test decoding events into structured arrays."""
+    if columnar.numpy is None:
+      return
+
+    columns = columnar.DecodeColumns(self._source, [image.Image.Load])
+    array, strings = columns[image.Image.Load]
+    self.assertEqual([10, 10, 11], list(array['process_id']))
+    self.assertEqual([0x400000] * 3, list(array['ImageBase']))
+    self.assertEqual(util.FileTimeToTime(test_etl._START_TIME) + 1,
+                     array['time_stamp'][0])
+    self.assertEqual([u'foo.dll', u'bar.dll', u'foo.dll'],
+                     [strings['FileName'][i] for i in array['FileName']])
+
+  def testRowsMatchEvents(self):
+    """Test that the rows hold the same values as the decoded events."""
+    tables = columnar.CollectTables(self._source, [image.Image.Load])
+    table = tables[image.Image.Load]
+    self._source.Close()
+    self._source = EtlFileEventSource()
+    self._source.OpenFileSession(self._path)
+    events = [event_class(session, record)
+              for event_class, session, record in
+              columnar.IterClassEvents(self._source, [image.Image.Load])]
+    self.assertEqual(table.row_count, len(events))
+
+    row_size = len(table._rows) / table.row_count
+    for index, event_obj in enumerate(events):
+      row = table._row.unpack_from(table._rows, index * row_size)
+      for column, (name, unused_format) in enumerate(table.columns):
+        if column < len(columnar.HEADER_COLUMNS):
+          continue
+        value = row[column]
+        if name in table.strings:
+          value = table.strings[name].values[value]
+        self.assertEqual(getattr(event_obj, name), value)
+
+
+if __name__ == '__main__':
+  unittest.main()
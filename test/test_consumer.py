@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from etw import TraceEventSource, EventConsumer, EventHandler
+from etw import etl
 from etw.descriptors import image
 import exceptions
 import os
@@ -35,6 +36,42 @@ class TraceConsumerTest(unittest.TestCase):
     """Test creating a consumer."""
     consumer = TraceEventSource()
 
+  def testDispatchIndex(self):
+    """Test indexing the handled events by raw GUID, version and type."""
+    class TestConsumer(EventConsumer):
+      @EventHandler(image.Event.Load)
+      def OnImageLoad(self, event_data):
+        pass
+
+    consumer = TraceEventSource()
+    self.assertEqual({}, consumer._GetDispatchIndex())
+
+    consumer.AddHandler(TestConsumer())
+    index = consumer._GetDispatchIndex()
+    event_class, handlers = index[(etl.GuidToBytes(image.Event.GUID), 2,
+                                   image.Event.Load[1])]
+    self.assertEqual(image.Image.Load, event_class)
+    self.assertEqual(1, len(handlers))
+    self.assertFalse((etl.GuidToBytes(image.Event.GUID), 2,
+                      image.Event.UnLoad[1]) in index)
+
+  def testHandlerCache(self):
+    """Test caching the bound handlers of each event."""
+    class TestConsumer(EventConsumer):
+      @EventHandler(image.Event.Load)
+      def OnImageLoad(self, event_data):
+        pass
+
+    handler = TestConsumer()
+    consumer = TraceEventSource([handler])
+    handlers = consumer._GetHandlers(*image.Event.Load)
+    self.assertEqual((handler.OnImageLoad,), handlers)
+    self.assertTrue(handlers is consumer._GetHandlers(*image.Event.Load))
+    self.assertEqual((), consumer._GetHandlers(*image.Event.UnLoad))
+
+    consumer.AddHandler(TestConsumer())
+    self.assertEqual(2, len(consumer._GetHandlers(*image.Event.Load)))
+
   def testOpenFileSession(self):
     """Test opening a file session."""
     consumer = TraceEventSource()
@@ -0,0 +1,273 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit test for the etw.etl module."""
+from etw import BatchEventHandler, EtlFileEventSource, EventConsumer
+from etw import EventFilter, EventHandler
+from etw import etl
+from etw import synthetic
+from etw import util
+from etw.descriptors import image
+import os
+import struct
+import tempfile
+import unittest
+
+
+_BUFFER_SIZE = 4096
+_QPC_FREQUENCY = 10000000
+_START_TIME = 129000000000000000  # A FILETIME in 2009.
+_START_QPC = 5000
+
+
+def _LogfileHeader(pointer_size):
+  return synthetic.LogfileHeader(pointer_size, _BUFFER_SIZE, _START_TIME,
+                                 _QPC_FREQUENCY, 2)
+
+
+def _SystemEvent(hook_id, version, pid, tid, time_stamp, payload):
+  return synthetic.SystemEvent(hook_id, version, pid, tid, time_stamp,
+                               payload)
+
+
+def _Buffer(events, processor=0):
+  return synthetic.Buffer(events, _BUFFER_SIZE, processor)
+
+
+def _ImageLoad(pid, time_stamp, file_name):
+  payload = struct.pack('<IIIIIIIIIII', 0x400000, 0x1000, pid, 0, 0, 0,
+                        0x400000, 0, 0, 0, 0)
+  payload += file_name.encode('utf-16-le') + '\0\0'
+  return _SystemEvent(etl.EVENT_TRACE_GROUP_IMAGE | 10, 2, pid, 1,
+                      time_stamp, payload)
+
+
+class EtlFileTest(unittest.TestCase):
+  def setUp(self):
+    header_event = _SystemEvent(etl.EVENT_TRACE_GROUP_HEADER, 2, 0, 0,
+                                _START_QPC, _LogfileHeader(4))
+    buffers = [_Buffer([header_event,
+                        _ImageLoad(10, _START_QPC + _QPC_FREQUENCY,
+                                   u'foo.dll')]),
+               _Buffer([_ImageLoad(11, _START_QPC + 2 * _QPC_FREQUENCY,
+                                   u'bar.dll')], processor=1)]
+    fd, self._path = tempfile.mkstemp('.etl', 'EtlFileTest')
+    os.write(fd, ''.join(buffers))
+    os.close(fd)
+
+  def tearDown(self):
+    os.remove(self._path)
+
+  def testHeader(self):
+    """Test parsing the logfile header."""
+    log = etl.EtlFile(self._path)
+    self.assertEqual(_BUFFER_SIZE, log.buffer_size)
+    self.assertEqual(4, log.pointer_size)
+    self.assertFalse(log.is_64_bit_log)
+    self.assertEqual(2, log.number_of_processors)
+    log.Close()
+
+  def testIterEvents(self):
+    """Test reading the events of a log."""
+    log = etl.EtlFile(self._path)
+    records = list(log.IterEvents())
+    log.Close()
+
+    self.assertEqual(3, len(records))
+    self.assertEqual('{68fdd900-4a3e-11d1-84f4-0000f80464e3}',
+                     records[0].guid)
+    self.assertEqual(image.Event.GUID, records[1].guid)
+    self.assertEqual(10, records[1].event_type)
+    self.assertEqual(2, records[1].version)
+    self.assertEqual(10, records[1].process_id)
+    self.assertEqual(1, records[2].processor)
+    self.assertEqual(_START_TIME + 10000000, records[1].time_stamp)
+
+  def testMappedEvents(self):
+    """Test reading the events of a memory mapped log."""
+    log = etl.EtlFile(self._path)
+    payloads = [r.user_data for r in log.IterEvents()]
+    log.Close()
+
+    log = etl.EtlFile(self._path, use_mmap=True)
+    records = list(log.IterEvents())
+    self.assertEqual(len(payloads), len(records))
+    for payload, record in zip(payloads, records):
+      self.assertTrue(isinstance(record.user_data, memoryview))
+      self.assertEqual(payload, record.user_data.tobytes())
+    log.Close()
+
+  def testRawTime(self):
+    """Test that raw time stamps convert to the same times."""
+    log = etl.EtlFile(self._path)
+    cooked = [log.SessionTimeToTime(r.time_stamp) for r in log.IterEvents()]
+    log.Close()
+
+    log = etl.EtlFile(self._path, raw_time=True)
+    raw = [log.SessionTimeToTime(r.time_stamp) for r in log.IterEvents()]
+    log.Close()
+
+    self.assertEqual(util.FileTimeToTime(_START_TIME) + 1, cooked[1])
+    for cooked_time, raw_time in zip(cooked, raw):
+      self.assertAlmostEqual(cooked_time, raw_time, 3)
+
+  def testNotALog(self):
+    """Test opening a file that isn't a log."""
+    fd, path = tempfile.mkstemp('.etl', 'EtlFileTest')
+    os.write(fd, 'Not a log file.')
+    os.close(fd)
+    try:
+      self.assertRaises(etl.EtlFileError, etl.EtlFile, path)
+    finally:
+      os.remove(path)
+
+  def testShortEvent(self):
+    """Test that an event smaller than its header is rejected."""
+    header_event = _SystemEvent(etl.EVENT_TRACE_GROUP_HEADER, 2, 0, 0,
+                                _START_QPC, _LogfileHeader(4))
+    short_event = _ImageLoad(10, _START_QPC + _QPC_FREQUENCY, u'foo.dll')
+    # Claim a size of 8 bytes, which is smaller than the system header.
+    short_event = short_event[:4] + struct.pack('<H', 8) + short_event[6:]
+    fd, path = tempfile.mkstemp('.etl', 'EtlFileTest')
+    os.write(fd, _Buffer([header_event, short_event]))
+    os.close(fd)
+    log = etl.EtlFile(path)
+    records = []
+    try:
+      try:
+        for record in log.IterEvents():
+          records.append(record)
+        self.fail('The short event was not rejected.')
+      except etl.EtlFileError:
+        pass
+      # Only the logfile header is read before the short event.
+      self.assertEqual(1, len(records))
+    finally:
+      log.Close()
+      os.remove(path)
+
+  def testConsume(self):
+    """Test dispatching the events of a log to a consumer."""
+    class TestConsumer(EventConsumer):
+      def __init__(self):
+        super(TestConsumer, self).__init__()
+        self.file_names = []
+
+      @EventHandler(image.Event.Load)
+      def OnImageLoad(self, event_data):
+        self.file_names.append(event_data.FileName)
+
+    for use_mmap in (False, True):
+      for lazy in (False, True):
+        consumer = TestConsumer()
+        source = EtlFileEventSource([consumer], use_mmap=use_mmap, lazy=lazy)
+        source.OpenFileSession(self._path)
+        source.Consume()
+        source.Close()
+        self.assertEqual([u'foo.dll', u'bar.dll'], consumer.file_names)
+
+  def testBatchConsume(self):
+    """Test dispatching batches of events to a consumer."""
+    class TestConsumer(EventConsumer):
+      def __init__(self):
+        super(TestConsumer, self).__init__()
+        self.batches = []
+
+      @BatchEventHandler(image.Event.Load, batch_size=2)
+      def OnImageLoads(self, events):
+        self.batches.append([event_data.FileName for event_data in events])
+
+    # Batches end with each buffer, unless the events are time ordered.
+    for time_ordered, batches in ((False, [[u'foo.dll'], [u'bar.dll']]),
+                                  (True, [[u'foo.dll', u'bar.dll']])):
+      consumer = TestConsumer()
+      source = EtlFileEventSource([consumer], time_ordered=time_ordered)
+      source.OpenFileSession(self._path)
+      source.Consume()
+      source.Close()
+      self.assertEqual(batches, consumer.batches)
+
+  def testFilter(self):
+    """Test filtering events on their header."""
+    class TestConsumer(EventConsumer):
+      def __init__(self):
+        super(TestConsumer, self).__init__()
+        self.file_names = []
+
+      @EventHandler(image.Event.Load)
+      def OnImageLoad(self, event_data):
+        self.file_names.append(event_data.FileName)
+
+    start_time = util.FileTimeToTime(_START_TIME)
+    filters = [(EventFilter(process_ids=[11]), [u'bar.dll']),
+               (EventFilter(end_time=start_time + 1.5), [u'foo.dll']),
+               (EventFilter(providers=[image.Event.GUID], max_level=0),
+                [u'foo.dll', u'bar.dll']),
+               (EventFilter(thread_ids=[2]), [])]
+    for event_filter, file_names in filters:
+      consumer = TestConsumer()
+      source = EtlFileEventSource([consumer])
+      source.SetFilter(event_filter)
+      source.OpenFileSession(self._path)
+      source.Consume()
+      self.assertEqual(file_names, consumer.file_names)
+      self.assertEqual(len(file_names),
+                       len([r for s, r in source.IterEvents()
+                            if r.guid == image.Event.GUID]))
+      source.Close()
+
+  def testMergeEvents(self):
+    """Test merging the events of several logs in time stamp order."""
+    header_event = _SystemEvent(etl.EVENT_TRACE_GROUP_HEADER, 2, 0, 0,
+                                _START_QPC, _LogfileHeader(4))
+    # The second buffer of this log holds events older than the first one.
+    buffers = [_Buffer([header_event,
+                        _ImageLoad(12, _START_QPC + 4, u'4.dll')]),
+               _Buffer([_ImageLoad(12, _START_QPC + 3, u'3.dll'),
+                        _ImageLoad(12, _START_QPC + 5, u'5.dll')], 1)]
+    fd, path = tempfile.mkstemp('.etl', 'EtlFileTest')
+    os.write(fd, ''.join(buffers))
+    os.close(fd)
+    try:
+      for raw_time in (False, True):
+        logs = [etl.EtlFile(self._path, raw_time), etl.EtlFile(path, raw_time)]
+        pids = [record.process_id
+                for log, record in etl.MergeEvents(logs, read_ahead=2)]
+        self.assertEqual([0, 0, 12, 12, 12, 10, 11], pids)
+        for log in logs:
+          log.Close()
+
+      class TestConsumer(EventConsumer):
+        def __init__(self):
+          super(TestConsumer, self).__init__()
+          self.file_names = []
+
+        @EventHandler(image.Event.Load)
+        def OnImageLoad(self, event_data):
+          self.file_names.append(event_data.FileName)
+
+      consumer = TestConsumer()
+      source = EtlFileEventSource([consumer], time_ordered=True)
+      source.OpenFileSession(path)
+      source.OpenFileSession(self._path)
+      source.Consume()
+      source.Close()
+      self.assertEqual([u'3.dll', u'4.dll', u'5.dll', u'foo.dll', u'bar.dll'],
+                       consumer.file_names)
+    finally:
+      os.remove(path)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,142 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit test for the etw.etl_index module."""
+from etw import EtlFileEventSource, EventConsumer, EventHandler
+from etw import etl
+from etw import etl_index
+from etw import util
+from etw.descriptors import image
+from etw.descriptors import process
+from test import test_etl
+import os
+import tempfile
+import unittest
+
+
+class EtlIndexTest(unittest.TestCase):
+  def setUp(self):
+    qpc = test_etl._START_QPC
+    freq = test_etl._QPC_FREQUENCY
+    header_event = test_etl._SystemEvent(etl.EVENT_TRACE_GROUP_HEADER, 2, 0, 0,
+                                         qpc, test_etl._LogfileHeader(4))
+    buffers = [test_etl._Buffer([header_event]),
+               test_etl._Buffer([test_etl._ImageLoad(10, qpc + freq, u'1.dll'),
+                                 test_etl._ImageLoad(10, qpc + 2 * freq,
+                                                     u'2.dll')]),
+               test_etl._Buffer([test_etl._ImageLoad(11, qpc + 3 * freq,
+                                                     u'3.dll')], processor=1),
+               test_etl._Buffer([])]
+    fd, self._path = tempfile.mkstemp('.etl', 'EtlIndexTest')
+    os.write(fd, ''.join(buffers))
+    os.close(fd)
+    self._start_time = util.FileTimeToTime(test_etl._START_TIME)
+
+  def tearDown(self):
+    for path in (self._path, etl_index.GetSidecarPath(self._path)):
+      if os.path.exists(path):
+        os.remove(path)
+
+  def testBuild(self):
+    """Test building the index of a log."""
+    index = etl_index.EtlIndex.Build(self._path)
+    self.assertEqual(test_etl._BUFFER_SIZE, index.buffer_size)
+    # The last buffer is empty, so it isn't indexed.
+    self.assertEqual([0, 1, 2], [e.index for e in index.entries])
+    entry = index.entries[1]
+    self.assertEqual(test_etl._BUFFER_SIZE, entry.file_offset)
+    self.assertEqual(0, entry.processor)
+    self.assertEqual(test_etl._START_TIME + 10000000, entry.start_time)
+    self.assertEqual(test_etl._START_TIME + 20000000, entry.end_time)
+    self.assertEqual(frozenset([(etl.GuidToBytes(image.Event.GUID), 10)]),
+                     entry.keys)
+    self.assertEqual(1, index.entries[2].processor)
+    self.assertTrue(index.IsCurrent(self._path))
+
+  def testSaveLoad(self):
+    """Test that an index survives a round trip through a sidecar file."""
+    index = etl_index.EtlIndex.Build(self._path)
+    sidecar_path = etl_index.GetSidecarPath(self._path)
+    index.Save(sidecar_path)
+    loaded = etl_index.EtlIndex.Load(sidecar_path)
+
+    self.assertEqual(index.buffer_size, loaded.buffer_size)
+    self.assertEqual(index.source_size, loaded.source_size)
+    self.assertEqual(index.source_mtime, loaded.source_mtime)
+    self.assertEqual(len(index.entries), len(loaded.entries))
+    for entry, loaded_entry in zip(index.entries, loaded.entries):
+      for name in etl_index.BufferEntry.__slots__:
+        self.assertEqual(getattr(entry, name), getattr(loaded_entry, name))
+
+    with open(sidecar_path, 'wb') as sidecar:
+      sidecar.write('Not an index.')
+    self.assertRaises(etl.EtlFileError, etl_index.EtlIndex.Load, sidecar_path)
+    # GetIndex rebuilds over an unreadable sidecar.
+    self.assertEqual(3, len(etl_index.GetIndex(self._path).entries))
+    self.assertEqual(3,
+                     len(etl_index.EtlIndex.Load(sidecar_path).entries))
+
+  def testSaveWideEventType(self):
+    """Test saving the 16 bit event Ids of manifest events."""
+    index = etl_index.EtlIndex.Build(self._path)
+    key = ('\x01' * 16, 300)
+    index.entries[1].keys = index.entries[1].keys | frozenset([key])
+    sidecar_path = etl_index.GetSidecarPath(self._path)
+    index.Save(sidecar_path)
+    loaded = etl_index.EtlIndex.Load(sidecar_path)
+    self.assertTrue(key in loaded.entries[1].keys)
+
+  def testFindBuffers(self):
+    """Test looking up buffers by time, event and processor."""
+    index = etl_index.EtlIndex.Build(self._path)
+    start = self._start_time
+    self.assertEqual([0, 1, 2], index.FindBuffers())
+    self.assertEqual([1], index.FindBuffers(start + 1.5, start + 1.8))
+    self.assertEqual([1, 2], index.FindBuffers(start + 2, start + 3))
+    self.assertEqual([2], index.FindBuffers(start_time=start + 2.5))
+    self.assertEqual([0], index.FindBuffers(end_time=start + 0.5))
+    self.assertEqual([1, 2], index.FindBuffers(events=[image.Event.Load]))
+    self.assertEqual([], index.FindBuffers(events=[process.Event.Start]))
+    self.assertEqual([2], index.FindBuffers(events=[image.Event.Load],
+                                            processors=[1]))
+
+  def testOpenFileSession(self):
+    """Test reading the buffers in a time range."""
+    class TestConsumer(EventConsumer):
+      def __init__(self):
+        super(TestConsumer, self).__init__()
+        self.file_names = []
+
+      @EventHandler(image.Event.Load)
+      def OnImageLoad(self, event_data):
+        self.file_names.append(event_data.FileName)
+
+    consumer = TestConsumer()
+    source = EtlFileEventSource([consumer])
+    source.OpenFileSession(self._path, start_time=self._start_time + 2.5)
+    source.Consume()
+    source.Close()
+    self.assertEqual([u'3.dll'], consumer.file_names)
+    self.assertTrue(os.path.exists(etl_index.GetSidecarPath(self._path)))
+
+    consumer = TestConsumer()
+    source = EtlFileEventSource([consumer])
+    source.OpenFileSession(self._path, events=[image.Event.Load])
+    source.Consume()
+    source.Close()
+    self.assertEqual([u'1.dll', u'2.dll', u'3.dll'], consumer.file_names)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,121 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit test for the etw.instrumentation module."""
+from etw import BatchEventHandler, EventConsumer, EventHandler
+from etw import EtlFileEventSource
+from etw import etl
+from etw import instrumentation
+from etw.consumer import TraceCancelledError
+from etw.descriptors import image
+from test import test_etl
+import os
+import tempfile
+import time
+import unittest
+
+
+class _TestConsumer(EventConsumer):
+  def __init__(self, fail=False):
+    self._fail = fail
+
+  @EventHandler(image.Event.Load)
+  def OnImageLoad(self, event_data):
+    if self._fail:
+      raise RuntimeError('Failed')
+
+  @BatchEventHandler(image.Event.Load)
+  def OnImageLoads(self, events):
+    pass
+
+
+class TraceStatisticsTest(unittest.TestCase):
+  def setUp(self):
+    qpc = test_etl._START_QPC
+    header_event = test_etl._SystemEvent(etl.EVENT_TRACE_GROUP_HEADER, 2, 0, 0,
+                                         qpc, test_etl._LogfileHeader(4))
+    buffers = [test_etl._Buffer([header_event,
+                                 test_etl._ImageLoad(10, qpc, u'a.dll')]),
+               test_etl._Buffer([test_etl._ImageLoad(10, qpc, u'bb.dll')])]
+    fd, self._path = tempfile.mkstemp('.etl', 'TraceStatisticsTest')
+    os.write(fd, ''.join(buffers))
+    os.close(fd)
+
+  def tearDown(self):
+    os.remove(self._path)
+
+  def _Consume(self, statistics, consumer):
+    source = EtlFileEventSource([consumer])
+    source.SetStatistics(statistics)
+    source.OpenFileSession(self._path)
+    try:
+      source.Consume()
+    finally:
+      source.Close()
+
+  def testSnapshot(self):
+    """Test counting the events, buffers, decoders and handlers."""
+    statistics = instrumentation.TraceStatistics()
+    self._Consume(statistics, _TestConsumer())
+
+    snapshot = statistics.Snapshot()
+    self.assertEqual(2, snapshot['buffers'])
+    self.assertEqual(0, snapshot['exceptions'])
+    provider = snapshot['providers'][image.Event.GUID]
+    self.assertEqual(2, provider['events'])
+    # Each payload has 44 bytes of fields, and a terminated file name.
+    self.assertEqual(2 * 44 + 2 * (6 + 7), provider['bytes'])
+    self.assertEqual(2, snapshot['decoders']['image.Load/2']['count'])
+    handlers = snapshot['handlers']
+    self.assertEqual(2, handlers['_TestConsumer.OnImageLoad']['count'])
+    # One batch at the end of each buffer.
+    self.assertEqual(2, handlers['_TestConsumer.OnImageLoads']['count'])
+
+    statistics.Reset()
+    self.assertEqual(0, statistics.Snapshot()['buffers'])
+
+  def testExceptions(self):
+    """Test counting the exceptions raised by handlers."""
+    statistics = instrumentation.TraceStatistics()
+    self.assertRaises(TraceCancelledError, self._Consume, statistics,
+                      _TestConsumer(fail=True))
+    snapshot = statistics.Snapshot()
+    self.assertEqual(1, snapshot['exceptions'])
+    self.assertEqual(1, snapshot['handlers']['_TestConsumer.OnImageLoad'][
+        'exceptions'])
+
+  def testFormatPrometheus(self):
+    """Test formatting a snapshot in the Prometheus text format."""
+    statistics = instrumentation.TraceStatistics()
+    self._Consume(statistics, _TestConsumer())
+    snapshot = statistics.Snapshot()
+    monitor = instrumentation.SessionMonitor('Test "Session"')
+    monitor.history = [(time.time(), 3, 1, 20)]
+    snapshot['sessions'][monitor.name] = monitor.Snapshot()
+
+    lines = instrumentation.FormatPrometheus(snapshot).splitlines()
+    self.assertTrue('# TYPE etw_events_total counter' in lines)
+    self.assertTrue('etw_events_total{provider="%s"} 2' % image.Event.GUID
+                    in lines)
+    self.assertTrue('etw_buffers_total 2' in lines)
+    self.assertTrue(
+        'etw_handler_calls_total{handler="_TestConsumer.OnImageLoad"} 2'
+        in lines)
+    self.assertTrue('# TYPE etw_session_events_lost gauge' in lines)
+    self.assertTrue(r'etw_session_events_lost{session="Test \"Session\""} 3'
+                    in lines)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,52 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit test for the etw.native module."""
+from etw import evntrace
+from etw import native
+from etw.guiddef import GUID
+import ctypes
+import unittest
+
+
+class NativeTest(unittest.TestCase):
+  def testTypeSizes(self):
+    """Test that the Windows types have their Windows sizes."""
+    self.assertEqual(4, ctypes.sizeof(native.ULONG))
+    self.assertEqual(4, ctypes.sizeof(native.LONG))
+    self.assertEqual(8, ctypes.sizeof(native.LARGE_INTEGER))
+    self.assertEqual(8, ctypes.sizeof(native.FILETIME))
+    self.assertEqual(16, ctypes.sizeof(GUID))
+    self.assertEqual(48, ctypes.sizeof(evntrace.EVENT_TRACE_HEADER))
+    self.assertEqual(120, ctypes.sizeof(evntrace.EVENT_TRACE_PROPERTIES))
+
+  def testOfflineBackend(self):
+    """Test that offline functions declare like ctypes ones, but raise."""
+    backend = native.OfflineBackend()
+    function = backend.GetFunction('advapi32', 'StartTraceW')
+    function.argtypes = [ctypes.c_void_p]
+    function.restype = native.ULONG
+    self.assertEqual('StartTraceW', function.__name__)
+    self.assertRaises(NotImplementedError, function, None)
+
+  def testBackend(self):
+    """Test that the backend matches the platform."""
+    if native.backend.is_native:
+      self.assertTrue(isinstance(native.backend, native.WindowsBackend))
+    else:
+      self.assertRaises(NotImplementedError, evntrace.CloseTrace, 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,163 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit test for the etw.parallel module."""
+from etw import BatchEventHandler, EventConsumer, EventHandler
+from etw import EventFilter
+from etw import etl
+from etw import instrumentation
+from etw import parallel
+from etw.descriptors import image
+from test import test_etl
+import os
+import pickle
+import tempfile
+import unittest
+
+
+class _OrderedConsumer(EventConsumer):
+  def __init__(self):
+    self.file_names = []
+    self.batches = []
+
+  @EventHandler(image.Event.Load)
+  def OnImageLoad(self, event_data):
+    self.file_names.append(event_data.FileName)
+
+  @BatchEventHandler(image.Event.Load, batch_size=4)
+  def OnImageLoads(self, events):
+    self.batches.append([event_data.FileName for event_data in events])
+
+
+class _CountingConsumer(EventConsumer):
+  order_independent = True
+
+  def __init__(self):
+    self.count = 0
+    self.batched = 0
+    self.buffers = 0
+
+  @EventHandler(image.Event.Load)
+  def OnImageLoad(self, event_data):
+    self.count += 1
+
+  @BatchEventHandler(image.Event.Load, batch_size=4)
+  def OnImageLoads(self, events):
+    self.batched += len(events)
+
+  def ProcessBuffer(self, session, buffer):
+    self.buffers += 1
+
+  def Reduce(self, consumers):
+    self.count += sum(consumer.count for consumer in consumers)
+    self.batched += sum(consumer.batched for consumer in consumers)
+    self.buffers += sum(consumer.buffers for consumer in consumers)
+
+
+class ParallelEtlEventSourceTest(unittest.TestCase):
+  def setUp(self):
+    header_event = test_etl._SystemEvent(etl.EVENT_TRACE_GROUP_HEADER, 2, 0, 0,
+                                         test_etl._START_QPC,
+                                         test_etl._LogfileHeader(4))
+    # Each buffer holds the events of another processor, so the events in
+    # the later buffers can be older than those in the earlier ones.
+    time_stamps = [[3, 5], [1, 4], [2, 6]]
+    buffers = []
+    for processor, buffer_time_stamps in enumerate(time_stamps):
+      # The odd events are logged by another process.
+      events = [test_etl._ImageLoad(10 + time_stamp % 2,
+                                    test_etl._START_QPC + time_stamp,
+                                    u'%d.dll' % time_stamp)
+                for time_stamp in buffer_time_stamps]
+      if not processor:
+        events.insert(0, header_event)
+      buffers.append(test_etl._Buffer(events, processor))
+    fd, self._path = tempfile.mkstemp('.etl', 'ParallelTest')
+    os.write(fd, ''.join(buffers))
+    os.close(fd)
+
+  def tearDown(self):
+    os.remove(self._path)
+
+  def testConsume(self):
+    """Test merging the shards in time stamp order."""
+    ordered = _OrderedConsumer()
+    counting = _CountingConsumer()
+    source = parallel.ParallelEtlEventSource([ordered, counting],
+                                             processes=2, buffers_per_shard=1)
+    source.OpenFileSession(self._path)
+    source.Consume()
+    source.Close()
+
+    self.assertEqual([u'%d.dll' % i for i in range(1, 7)], ordered.file_names)
+    self.assertEqual([ordered.file_names[:4], ordered.file_names[4:]],
+                     ordered.batches)
+    self.assertEqual(6, counting.count)
+    self.assertEqual(6, counting.batched)
+    self.assertEqual(3, counting.buffers)
+
+  def testConsumeSessions(self):
+    """Test that the consumers are reduced once over several logs."""
+    ordered = _OrderedConsumer()
+    counting = _CountingConsumer()
+    source = parallel.ParallelEtlEventSource([ordered, counting],
+                                             processes=2, buffers_per_shard=2)
+    source.OpenFileSession(self._path)
+    source.OpenFileSession(self._path)
+    source.Consume()
+    source.Close()
+
+    self.assertEqual(12, len(ordered.file_names))
+    self.assertEqual(12, counting.count)
+    self.assertEqual(12, counting.batched)
+    self.assertEqual(6, counting.buffers)
+
+  def testFilter(self):
+    """Test that the filter and the selected buffers apply to the workers."""
+    for lazy in (False, True):
+      ordered = _OrderedConsumer()
+      counting = _CountingConsumer()
+      statistics = instrumentation.TraceStatistics()
+      source = parallel.ParallelEtlEventSource([ordered, counting],
+                                               processes=2,
+                                               buffers_per_shard=1, lazy=lazy)
+      source.SetFilter(EventFilter(process_ids=[10]))
+      source.SetStatistics(statistics)
+      source.OpenFileSession(self._path)
+      # Skip the second buffer, as OpenFileSession does for a time range.
+      source._trace_sessions[0].SelectBuffers([0, 2])
+      source.Consume()
+      source.Close()
+
+      self.assertEqual([u'2.dll', u'6.dll'], ordered.file_names)
+      self.assertEqual(2, counting.count)
+      self.assertEqual(2, counting.batched)
+      self.assertEqual(
+          2, statistics.Snapshot()['decoders']['image.Load/2']['count'])
+
+  def testPickleEvent(self):
+    """Test pickling events of nested event classes."""
+    log = etl.EtlFile(self._path)
+    record = list(log.IterEvents())[1]
+    event_obj = image.Image.Load(log, record, lazy=True)
+    log.Close()
+
+    copy = pickle.loads(pickle.dumps(event_obj, pickle.HIGHEST_PROTOCOL))
+    self.assertTrue(isinstance(copy, image.Image.Load))
+    self.assertEqual(u'3.dll', copy.FileName)
+    self.assertEqual(event_obj.time_stamp, copy.time_stamp)
+
+
+if __name__ == '__main__':
+  unittest.main()
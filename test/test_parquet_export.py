@@ -0,0 +1,131 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit test for the etw.parquet_export module."""
+from etw import EtlFileEventSource
+from etw import etl
+from etw import parquet_export
+from etw import synthetic
+from etw.descriptors import image
+from etw.descriptors import process
+from test import test_etl
+import os
+import tempfile
+import unittest
+
+
+class ParquetExportTest(unittest.TestCase):
+  def setUp(self):
+    header_event = test_etl._SystemEvent(etl.EVENT_TRACE_GROUP_HEADER, 2, 0, 0,
+                                         test_etl._START_QPC,
+                                         test_etl._LogfileHeader(4))
+    events = [test_etl._ImageLoad(10 + i,
+                                  test_etl._START_QPC +
+                                      i * test_etl._QPC_FREQUENCY,
+                                  u'%d.dll' % (i % 2))
+              for i in range(1, 6)]
+    fd, self._path = tempfile.mkstemp('.etl', 'ParquetExportTest')
+    os.write(fd, test_etl._Buffer([header_event] + events))
+    os.close(fd)
+    self._source = EtlFileEventSource()
+    self._source.OpenFileSession(self._path)
+
+  def tearDown(self):
+    self._source.Close()
+    os.remove(self._path)
+
+  def testIterRecordBatches(self):
+    """Test splitting events into record batches."""
+    if parquet_export.pyarrow is None:
+      return
+
+    batches = [batch for event_class, batch in
+               parquet_export.IterRecordBatches(self._source,
+                                                [image.Image.Load], 2)]
+    self.assertEqual([2, 2, 1], [batch.num_rows for batch in batches])
+    self.assertEqual(batches[0].schema, batches[2].schema)
+    file_names = [batch.column(batch.schema.get_field_index('FileName'))
+                  .to_pylist() for batch in batches]
+    self.assertEqual([[u'1.dll', u'0.dll'], [u'1.dll', u'0.dll'], [u'1.dll']],
+                     file_names)
+
+  def testFlushClearsStrings(self):
+    """Test that the strings are only kept until their batch is built."""
+    if parquet_export.pyarrow is None:
+      return
+
+    builder = parquet_export.RecordBatchBuilder(image.Image.Load)
+    for session, record in self._source.IterEvents():
+      if record.event_type == image.Event.Load[1]:
+        builder.Add(session, record)
+        batch = builder.Flush()
+        self.assertEqual(1, batch.num_rows)
+        self.assertEqual(0, len(builder._table.strings['FileName']))
+
+  def testNullValues(self):
+    """Test that NULL SIDs are exported as nulls."""
+    if parquet_export.pyarrow is None:
+      return
+
+    fd, path = tempfile.mkstemp('.etl', 'ParquetExportTest')
+    os.close(fd)
+    source = EtlFileEventSource()
+    try:
+      with open(path, 'wb') as output:
+        writer = synthetic.EtlWriter(output, 4)
+        for sid in (None, 'S-1-5-18', None):
+          writer.AddEvent(process.Event.GUID, 1, process.Event.Start[1],
+                          {'PageDirectoryBase': 0, 'ProcessId': 12,
+                           'ParentId': 4, 'SessionId': 0, 'ExitStatus': 0,
+                           'UserSID': sid, 'ImageFileName': 'foo.exe'})
+        writer.Close()
+      source.OpenFileSession(path)
+      (event_class, batch), = parquet_export.IterRecordBatches(
+          source, [process.Process_V1.TypeGroup1])
+      self.assertEqual([None, u'S-1-5-18', None],
+                       batch.column(batch.schema.get_field_index('UserSID'))
+                           .to_pylist())
+    finally:
+      source.Close()
+      os.remove(path)
+
+  def testExportParquet(self):
+    """Test writing events to a Parquet file with statistics."""
+    if parquet_export.pyarrow is None:
+      return
+
+    fd, path = tempfile.mkstemp('.parquet', 'ParquetExportTest')
+    os.close(fd)
+    try:
+      parquet_export.ExportParquet(self._source, {image.Image.Load: path}, 2)
+      parquet_file = parquet_export.pyarrow.parquet.ParquetFile(path)
+      self.assertEqual(3, parquet_file.num_row_groups)
+      table = parquet_file.read()
+      self.assertEqual(range(11, 16),
+                       table.column('process_id').to_pylist())
+
+      row_group = parquet_file.metadata.row_group(1)
+      for i in range(row_group.num_columns):
+        column = row_group.column(i)
+        if column.path_in_schema == 'process_id':
+          self.assertEqual((13, 14), (column.statistics.min,
+                                      column.statistics.max))
+        elif column.path_in_schema == 'FileName':
+          self.assertFalse(column.is_stats_set)
+    finally:
+      os.remove(path)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,152 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit test for the etw.pipeline module."""
+from etw import BatchEventHandler, EventConsumer, EventHandler
+from etw import etl
+from etw import evntrace
+from etw import pipeline
+from etw import util
+from etw.descriptors import image
+import ctypes
+import struct
+import threading
+import unittest
+
+
+class _Session(object):
+  """Stands in for the session the events arrive on."""
+  is_64_bit_log = False
+
+  def SessionTimeToTime(self, session_time):
+    return util.FileTimeToTime(session_time)
+
+
+class _TestConsumer(EventConsumer):
+  def __init__(self):
+    self.file_names = []
+    self.batches = []
+    self.threads = set()
+    self.buffers = []
+
+  @EventHandler(image.Event.Load)
+  def OnImageLoad(self, event_data):
+    self.file_names.append(event_data.FileName)
+    self.threads.add(threading.current_thread())
+
+  @BatchEventHandler(image.Event.Load, batch_size=3)
+  def OnImageLoads(self, events):
+    self.batches.append(len(events))
+
+  def ProcessBuffer(self, session, buffer):
+    self.buffers.append(buffer)
+
+
+class _TestSource(pipeline.PipelineTraceEventSource):
+  """Delivers a list of events and buffer ends in place of ProcessTrace."""
+
+  def __init__(self, deliveries, *args, **kwargs):
+    super(_TestSource, self).__init__(*args, **kwargs)
+    self._deliveries = deliveries
+    self.callback_threads = set()
+
+  def _ProcessTrace(self):
+    session = _Session()
+    for delivery in self._deliveries:
+      self.callback_threads.add(threading.current_thread())
+      if delivery is None:
+        # The buffer is only valid during the callback.
+        self._ProcessBufferCallback(session, object())
+      else:
+        self._ProcessEventRecordCallback(session, ctypes.pointer(delivery))
+
+
+def _ImageLoadRecord(file_name, payloads):
+  """Builds an EVENT_RECORD, keeping its payload alive in payloads."""
+  payload = struct.pack('<IIIIIIIIIII', 0x400000, 0x1000, 10, 0, 0, 0,
+                        0x400000, 0, 0, 0, 0)
+  payload += file_name.encode('utf-16-le') + '\0\0'
+  payload_buffer = ctypes.create_string_buffer(payload, len(payload))
+  payloads.append(payload_buffer)
+
+  record = evntrace.EVENT_RECORD()
+  header = record.EventHeader
+  header.ProcessId = 10
+  header.ThreadId = 1
+  header.TimeStamp = 129000000000000000
+  # Write the GUID as the 16 bytes ETW lays it out as.
+  ctypes.memmove(ctypes.addressof(header) +
+                 evntrace.EVENT_HEADER.ProviderId.offset,
+                 etl.GuidToBytes(image.Event.GUID), 16)
+  header.EventDescriptor.Id = image.Event.Load[1]
+  header.EventDescriptor.Version = 2
+  record.UserData = ctypes.cast(payload_buffer, ctypes.c_void_p)
+  record.UserDataLength = len(payload)
+  return record
+
+
+class PipelineTraceEventSourceTest(unittest.TestCase):
+  def setUp(self):
+    self._payloads = []
+    self._names = [u'%d.dll' % i for i in range(8)]
+    self._deliveries = [_ImageLoadRecord(name, self._payloads)
+                        for name in self._names]
+    # End a buffer after the first two events.
+    self._deliveries.insert(2, None)
+
+  def testConsume(self):
+    """Test dispatching events on a worker thread."""
+    for lazy in (False, True):
+      consumer = _TestConsumer()
+      source = _TestSource(self._deliveries, [consumer], lazy=lazy)
+      source.Consume()
+
+      self.assertEqual(self._names, consumer.file_names)
+      self.assertEqual(0, source.records_dropped)
+      self.assertTrue(consumer.threads.isdisjoint(source.callback_threads))
+      # The first batch ends with the buffer.
+      self.assertEqual([2, 3, 3], consumer.batches)
+      self.assertEqual([None], consumer.buffers)
+
+  def testWorkers(self):
+    """Test dispatching events on several worker threads."""
+    consumer = _TestConsumer()
+    source = _TestSource(self._deliveries, [consumer], workers=3)
+    source.Consume()
+    self.assertEqual(sorted(self._names), sorted(consumer.file_names))
+    self.assertEqual(8, sum(consumer.batches))
+
+  def testDropped(self):
+    """Test that events are dropped rather than waited on."""
+    class BlockedSource(_TestSource):
+      def _Read(self):
+        # Let the ring fill up before the reader runs.
+        self.delivered.wait()
+        super(BlockedSource, self)._Read()
+
+      def _ProcessTrace(self):
+        super(BlockedSource, self)._ProcessTrace()
+        self.delivered.set()
+
+    consumer = _TestConsumer()
+    # Each event takes up 112 bytes of the ring, and the buffer end 56.
+    source = BlockedSource(self._deliveries, [consumer], ring_size=400)
+    source.delivered = threading.Event()
+    source.Consume()
+    self.assertEqual(self._names[:3], consumer.file_names)
+    self.assertEqual(5, source.records_dropped)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,116 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit test for the etw.profiler module."""
+from etw import EventConsumer, EventHandler
+from etw import EtlFileEventSource
+from etw import etl
+from etw import instrumentation
+from etw import profiler
+from etw.descriptors import image
+from test import test_etl
+import os
+import StringIO
+import tempfile
+import unittest
+
+
+class _TestConsumer(EventConsumer):
+  @EventHandler(image.Event.Load)
+  def OnImageLoad(self, event_data):
+    pass
+
+
+class ProfileEntryTest(unittest.TestCase):
+  def testSamples(self):
+    """Test the histogram and percentiles of an entry."""
+    entry = profiler.ProfileEntry('f', 'handler', (1e-3, 1e-2))
+    for seconds in [5e-4] * 98 + [5e-3, 2.0]:
+      entry.AddSample(seconds)
+    entry.count = 200
+
+    self.assertEqual([98, 1, 1], entry.histogram)
+    self.assertEqual(2.0, entry.max_seconds)
+    self.assertAlmostEqual((2.0 + 5e-3 + 98 * 5e-4) / 100, entry.mean_seconds)
+    self.assertAlmostEqual(2 * (2.0 + 5e-3 + 98 * 5e-4), entry.total_seconds)
+    self.assertEqual(1e-3, entry.GetPercentile(50))
+    self.assertEqual(1e-2, entry.GetPercentile(99))
+    self.assertEqual(2.0, entry.GetPercentile(100))
+
+
+class HandlerProfilerTest(unittest.TestCase):
+  def setUp(self):
+    qpc = test_etl._START_QPC
+    header_event = test_etl._SystemEvent(etl.EVENT_TRACE_GROUP_HEADER, 2, 0, 0,
+                                         qpc, test_etl._LogfileHeader(4))
+    events = [test_etl._ImageLoad(10, qpc, u'%d.dll' % i) for i in range(5)]
+    fd, self._path = tempfile.mkstemp('.etl', 'HandlerProfilerTest')
+    os.write(fd, test_etl._Buffer([header_event] + events))
+    os.close(fd)
+
+  def tearDown(self):
+    os.remove(self._path)
+
+  def testProfile(self):
+    """Test profiling handlers and decoders, and printing at Close."""
+    profile = profiler.HandlerProfiler(sample_interval=2)
+    output = StringIO.StringIO()
+    source = EtlFileEventSource([_TestConsumer()])
+    source.SetProfiler(profile, output)
+    source.OpenFileSession(self._path)
+    source.Consume()
+
+    entries = dict(((entry.kind, entry.name), entry)
+                   for entry in profile.GetEntries('count'))
+    self.assertEqual([('decode', 'image.Load/2'),
+                      ('handler', '_TestConsumer.OnImageLoad')],
+                     sorted(entries))
+    for entry in entries.values():
+      # The first of every two calls is timed.
+      self.assertEqual((5, 3), (entry.count, entry.sampled_count))
+      self.assertEqual(3, sum(entry.histogram))
+
+    self.assertEqual('', output.getvalue())
+    source.Close()
+    lines = output.getvalue().splitlines()
+    self.assertTrue(lines[0].startswith('Kind'))
+    self.assertEqual(3, len(lines))
+    self.assertEqual(['5', '3'], lines[1].split()[1:3])
+    # The profile is printed once only.
+    source.Close()
+    self.assertEqual(3, len(output.getvalue().splitlines()))
+
+  def testWithStatistics(self):
+    """Test profiling and counting the same source together."""
+    profile = profiler.HandlerProfiler()
+    statistics = instrumentation.TraceStatistics()
+    source = EtlFileEventSource([_TestConsumer()])
+    source.SetStatistics(statistics)
+    source.SetProfiler(profile)
+    source.OpenFileSession(self._path)
+    source.Consume()
+    source.Close()
+
+    self.assertEqual([('decode', 'image.Load/2'),
+                      ('handler', '_TestConsumer.OnImageLoad')],
+                     sorted((entry.kind, entry.name)
+                            for entry in profile.GetEntries()))
+    snapshot = statistics.Snapshot()
+    self.assertEqual(5, snapshot['decoders']['image.Load/2']['count'])
+    self.assertEqual(
+        5, snapshot['handlers']['_TestConsumer.OnImageLoad']['count'])
+
+
+if __name__ == '__main__':
+  unittest.main()
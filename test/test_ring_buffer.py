@@ -0,0 +1,89 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit test for the etw.ring_buffer module."""
+from etw import ring_buffer
+import ctypes
+import threading
+import unittest
+
+
+class RingBufferTest(unittest.TestCase):
+  def _ReadAll(self, ring):
+    records = []
+    while True:
+      view = ring.Read(0)
+      if view is None:
+        return records
+      records.append(view.tobytes())
+      ring.Release()
+
+  def testWriteRead(self):
+    """Test passing records through the ring."""
+    ring = ring_buffer.RingBuffer(64)
+    self.assertTrue(ring.Write('hello'))
+    self.assertTrue(ring.Write(''))
+    offset = ring.Reserve(3)
+    ctypes.memmove(ring.address + offset, 'abc', 3)
+    ring.Commit()
+    self.assertEqual(32, ring.used)
+    self.assertEqual(['hello', '', 'abc'], self._ReadAll(ring))
+    self.assertEqual(0, ring.used)
+
+  def testWrapAround(self):
+    """Test that records never wrap around the end of the ring."""
+    ring = ring_buffer.RingBuffer(64)
+    for i in range(10):
+      # Each record takes up 24 bytes, so every other one skips the end.
+      self.assertTrue(ring.Write('%020d' % i))
+      self.assertTrue(ring.Write('%020d' % -i))
+      self.assertEqual(['%020d' % i, '%020d' % -i], self._ReadAll(ring))
+
+  def testOverflow(self):
+    """Test that records that don't fit are dropped and counted."""
+    ring = ring_buffer.RingBuffer(64)
+    self.assertTrue(ring.Write('a' * 28))
+    self.assertTrue(ring.Write('b' * 20))
+    self.assertFalse(ring.Write('c' * 20))
+    self.assertFalse(ring.Write('d' * 100))
+    self.assertEqual(2, ring.overflow_count)
+    self.assertEqual(120, ring.overflow_bytes)
+    self.assertEqual(['a' * 28, 'b' * 20], self._ReadAll(ring))
+
+  def testThreads(self):
+    """Test a producer and a consumer on separate threads."""
+    ring = ring_buffer.RingBuffer(256)
+    records = ['%d' % i * (i % 13) for i in range(5000)]
+
+    def Produce():
+      for record in records:
+        while not ring.Write(record):
+          pass
+      ring.Close()
+    producer = threading.Thread(target=Produce)
+    producer.start()
+    received = []
+    while True:
+      view = ring.Read()
+      if view is None:
+        break
+      received.append(view.tobytes())
+      ring.Release()
+    producer.join()
+
+    self.assertEqual(records, received)
+
+
+if __name__ == '__main__':
+  unittest.main()
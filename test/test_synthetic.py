@@ -0,0 +1,92 @@
+#!python
+# Copyright 2011 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit test for the etw.synthetic module."""
+from etw import etl
+from etw import synthetic
+from etw.descriptors import event
+from etw.descriptors import image
+import os
+import tempfile
+import unittest
+
+
+class SyntheticTest(unittest.TestCase):
+  def setUp(self):
+    fd, self._path = tempfile.mkstemp('.etl', 'SyntheticTest')
+    os.close(fd)
+
+  def tearDown(self):
+    os.remove(self._path)
+
+  def _ReadEvents(self, path):
+    log = etl.EtlFile(path)
+    try:
+      events = []
+      for record in log.IterEvents():
+        event_class = event.EventClass.Get(etl.GuidToString(record.provider_id),
+                                           record.version, record.event_type)
+        if event_class:
+          events.append(event_class(log, record))
+      return log.is_64_bit_log, events
+    finally:
+      log.Close()
+
+  def testRoundTrip(self):
+    """Test that written values decode back, for both pointer sizes."""
+    values = {'ImageBase': 0x7ff00000, 'ImageSize': 0x2000, 'ProcessId': 12,
+              'ImageChecksum': 1, 'TimeDateStamp': 2, 'Reserved0': 0,
+              'DefaultBase': 0x7ff00000, 'Reserved1': 0, 'Reserved2': 0,
+              'Reserved3': 0, 'Reserved4': 0, 'FileName': u'foo.dll'}
+    for pointer_size in (4, 8):
+      output = open(self._path, 'wb')
+      writer = synthetic.EtlWriter(output, pointer_size, buffer_size=4096)
+      # Enough events to fill several buffers.
+      for i in range(100):
+        writer.AddEvent(image.Event.GUID, 2, image.Event.Load[1], values,
+                        pid=12, time_stamp=synthetic.DEFAULT_START_QPC + i)
+      writer.Close()
+      output.close()
+
+      is_64_bit_log, events = self._ReadEvents(self._path)
+      self.assertEqual(pointer_size == 8, is_64_bit_log)
+      self.assertEqual(100, len(events))
+      self.assertTrue(os.path.getsize(self._path) > 4096)
+      for name, value in values.items():
+        self.assertEqual(value, getattr(events[-1], name))
+      self.assertEqual(12, events[-1].process_id)
+
+  def testGenerateLog(self):
+    """Test that every registered event can be generated and decoded."""
+    keys = synthetic.GetEventKeys()
+    for pointer_size in (4, 8):
+      writer = synthetic.GenerateLog(self._path, 2000, pointer_size, seed=1)
+      self.assertEqual(2000, writer.event_count)
+      is_64_bit_log, events = self._ReadEvents(self._path)
+      self.assertEqual(2000, len(events))
+      # Every event is picked from the registered ones.
+      self.assertTrue(len(set(type(e) for e in events)) > len(keys) / 4)
+
+  def testDeterministic(self):
+    """Test that the same seed writes the same log."""
+    synthetic.GenerateLog(self._path, 500, seed=7)
+    first = open(self._path, 'rb').read()
+    synthetic.GenerateLog(self._path, 500, seed=7)
+    self.assertEqual(first, open(self._path, 'rb').read())
+    synthetic.GenerateLog(self._path, 500, seed=8)
+    self.assertNotEqual(first, open(self._path, 'rb').read())
+
+
+if __name__ == '__main__':
+  unittest.main()